@@ -1,7 +1,20 @@
 import argparse
 
+from dataset.benchmarks.pipeline import benchmark_pipeline, STAGES
+from dataset.benchmarks.synthetic import SLOTS_PER_DAY
+from dataset.cache import DEFAULT_CACHE_SIZE
 from dataset.preprocessing.bs_pipeline import process_base_stations
 from dataset.preprocessing.chunks_pipeline import process_chunks
+from dataset.preprocessing.merge_chunks import merge_chunks, MERGE_REDUCTIONS, DEFAULT_MEMORY_LIMIT
+from dataset.preprocessing.storage import OUTPUT_FORMATS
+
+
+def stats_args(parser):
+    parser.add_argument('--stats-file',
+                        help='JSON lines file where the time, CPU, memory, rows and bytes of each stage are saved. '
+                             'Default: "stats/<script>-<date>-<time>.jsonl" in the output folder')
+    parser.add_argument('--no-stats', action='store_true', default=False,
+                        help='If present the statistics of the stages are not saved')
 
 
 def chunks_pipeline_args(module_parser, module_name):
@@ -21,8 +34,44 @@ def chunks_pipeline_args(module_parser, module_name):
                         help='Path to the csv with the aggregated BS. (result of the bs script)')
     parser.add_argument('--full-aggregation', action='store_true', default=False,
                         help='If present, the aggregation will be performed using all the columns')
+    parser.add_argument('--full-data-view', action='store_true', default=False,
+                        help='If present, the aggregation is performed using all the columns, but the aggregated '
+                             'chunks keep only a bs_key column and the BS columns are saved once in the '
+                             'aggregated-bs-dimension file, they are attached when reading the chunks')
     parser.add_argument('--skip-download', action='store_true', default=False,
                         help='If present it will assume the chunks as already downloaded')
+    parser.add_argument('--download-workers', default=1, type=int,
+                        help='Number of chunks downloaded concurrently. The biggest chunks are downloaded first. '
+                             'Default: 1 (sequential download)')
+    parser.add_argument('--stream', action='store_true', default=False,
+                        help='If present the chunks are parsed and aggregated while downloading them, '
+                             'without saving the raw chunks on disk')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of processes used for processing the chunks. Default: 1')
+    parser.add_argument('--format', default='csv', choices=OUTPUT_FORMATS,
+                        help='Format of the processed and aggregated chunks. Parquet files are compressed and '
+                             'partitioned by chunk date. Default: "csv"')
+    parser.add_argument('--engine', default='pandas', choices=['pandas', 'numpy'],
+                        help='Engine used for aggregating the chunks. The numpy engine accumulates each chunk in a '
+                             'dense (cells x idx) array with np.bincount and saves it as .npy next to the processed '
+                             'chunk, plus a (dates x cells x idx) cube of all the chunks. Default: "pandas"')
+    parser.add_argument('--grid-cells',
+                        help='Grid geojson or csv with a cellId column (e.g. data/milan/mi-empty-grid.csv) used for '
+                             'the cells axis of the numpy engine cubes')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='If present, only the stages whose inputs or parameters changed since the last run '
+                             '(as recorded in the manifest.json of the output folder) are executed')
+    parser.add_argument('--metrics', default='internet',
+                        help='Comma separated list of the metrics to keep, one column each in the processed and '
+                             'aggregated chunks. Available: smsin,smsout,callin,callout,internet. Default: "internet"')
+    parser.add_argument('--rollups',
+                        help='Comma separated list of time granularities saved for each chunk in '
+                             'rollups/<level>/. Available: 10min,30min,hour,day. The finest one is computed from the '
+                             'raw chunk, the others are derived from it')
+    parser.add_argument('--merge', choices=MERGE_REDUCTIONS,
+                        help='If present, at the end of the BS aggregation step the aggregated chunks are reduced in '
+                             'the minimal-data (and full-data) files, summing them or averaging them over the days')
+    stats_args(parser)
 
 
 def cell_bs_pipeline_args(module_parser):
@@ -32,17 +81,98 @@ def cell_bs_pipeline_args(module_parser):
     parser.add_argument('--api-path', default='https://opencellid.org/ajax/getCells.php',
                         help='Url of the providers for downloading the base stations')
     parser.add_argument('--api-token', default='',
-                        help='Base station provider token')
+                        help='Base station provider token, as a query string prefix (e.g. "key=<token>&"). '
+                             'Without it the base stations are not downloaded and the existing bs_milan.geojson '
+                             'of the output folder is used')
     parser.add_argument('--box-side', default=10, type=int,
-                        help='Dimension of one box side used for grouping and downloading the base stations')
+                        help='Maximum side, in cells, of the boxes used for downloading the base stations')
+    parser.add_argument('--max-results', default=1000, type=int,
+                        help='Maximum number of base stations returned by the provider for a box, the boxes '
+                             'reaching it are split in four. Default: 1000')
+    parser.add_argument('--download-workers', default=1, type=int,
+                        help='Number of boxes requested concurrently to the base station provider. Default: 1')
+    parser.add_argument('--requests-per-second', type=float,
+                        help='Maximum number of requests per second sent to the base station provider')
+    parser.add_argument('--requests-per-day', type=int,
+                        help='Maximum number of requests per day sent to the base station provider')
     parser.add_argument('--sleep-interval', default=0, type=float,
-                        help='Interval between subsequent call to the base station provider')
-    parser.add_argument('--collection', required=True, help='Name of the collection used for saving the data')
+                        help='Interval between subsequent call to the base station provider, '
+                             'ignored if --requests-per-second is set')
+    parser.add_argument('--collection', help='Name of the collection used for saving the data (mongo engine)')
     parser.add_argument('--skip-bs-download', action='store_true', default=False,
                         help='If present it will skip the download of the base stations from the provider')
     parser.add_argument('--bs-types', default='LTE', help='Comma separated list of types of base station to process')
     parser.add_argument('--skip-db-upload', default=False, action='store_true',
                         help='If present it will skip to upload on the MongoDB')
+    parser.add_argument('--upload-batch-size', default=1000, type=int,
+                        help='Number of base stations written on MongoDB with a single request. Default: 1000')
+    parser.add_argument('--upload-workers', default=1, type=int,
+                        help='Number of threads writing the base stations on MongoDB. Default: 1')
+    parser.add_argument('--format', default='csv', choices=OUTPUT_FORMATS,
+                        help='Format of the files produced. Default: "csv"')
+    parser.add_argument('--engine', default='mongo', choices=['mongo', 'local'],
+                        help='Engine used for finding the base stations of each cell. The local engine loads '
+                             'bs_milan.geojson in an in-memory spatial index and does not need MongoDB. '
+                             'Default: "mongo"')
+    parser.add_argument('--query-workers', default=1, type=int,
+                        help='Number of threads querying the base stations of the cells concurrently. With the '
+                             'mongo engine they share the connection pool of the client (MONGO_POOL_SIZE). '
+                             'Default: 1')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of processes mapping the cells to the base stations, each one maps shards of '
+                             'rows of the grid. Default: 1')
+    parser.add_argument('--no-cache', action='store_true', default=False,
+                        help='If present the base stations are requested again to the provider and the mapping of '
+                             'the cells to the base stations is computed again, without reading or saving them in '
+                             'the .cache folder')
+    parser.add_argument('--cache-size', default=DEFAULT_CACHE_SIZE, type=float,
+                        help=f'Maximum size, in MB, of the cached mappings and of the cached responses of the base '
+                             f'station provider, the least recently used are removed. '
+                             f'Default: {DEFAULT_CACHE_SIZE}')
+    stats_args(parser)
+
+
+def merge_chunks_args(module_parser):
+    parser = module_parser.add_parser('merge-chunks',
+                                      help='Reduce the aggregated chunks in the minimal-data and full-data files')
+    parser.add_argument('input', help='Folder of the aggregated chunks')
+    parser.add_argument('output', help='Output folder for the merged files')
+    parser.add_argument('--bs-types', help='Comma separated list of the BS types, used in the names of the files')
+    parser.add_argument('--reduction', default='sum', choices=MERGE_REDUCTIONS,
+                        help='Sum the chunks or average them over the number of days in which each BS and '
+                             'time slot appears. Default: "sum"')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Number of processes, each one reduces a group of chunks. Default: 1')
+    parser.add_argument('--memory-limit', default=DEFAULT_MEMORY_LIMIT, type=int,
+                        help=f'Memory in MB used for reading the chunks in blocks. Default: {DEFAULT_MEMORY_LIMIT}')
+    parser.add_argument('--format', default='csv', choices=OUTPUT_FORMATS,
+                        help='Format of the merged files. Default: "csv"')
+    parser.add_argument('--bs-dimension',
+                        help='BS dimension of the chunks aggregated with --full-data-view. By default the one of '
+                             '--bs-types is searched in the parent folder of the chunks')
+
+
+def benchmark_args(module_parser):
+    parser = module_parser.add_parser('benchmark',
+                                      help='Time the pipeline stages on synthetic data, without network and MongoDB')
+    parser.add_argument('--cells', default='1000,10000',
+                        help='Comma separated list of the number of cells of the benchmarked grids. '
+                             'Default: "1000,10000"')
+    parser.add_argument('--stages', default=None,
+                        help=f'Comma separated list of the stages to run, among: {", ".join(STAGES)}. Default: all')
+    parser.add_argument('--slots', default=SLOTS_PER_DAY, type=int,
+                        help=f'Ten minutes slots of the synthetic chunks. Default: {SLOTS_PER_DAY} (one day)')
+    parser.add_argument('--repeat', default=1, type=int,
+                        help='Runs of each stage, the best time is reported. Default: 1')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the synthetic data. Default: 0')
+    parser.add_argument('--workers', default=1, type=int,
+                        help='Processes of the bs-mapping stage. Default: 1')
+    parser.add_argument('--download-workers', default=1, type=int,
+                        help='Threads of the bs-download stage. Default: 1')
+    parser.add_argument('--output', default='benchmarks.jsonl',
+                        help='File where a json line is appended for each stage. Default: "benchmarks.jsonl"')
+    parser.add_argument('--work-folder', default='.cache/benchmarks',
+                        help='Folder of the synthetic data, reused by the next runs. Default: ".cache/benchmarks"')
 
 
 def parse_arguments():
@@ -50,6 +180,8 @@ def parse_arguments():
     module_parser = main_parser.add_subparsers(dest='module', title='Module', required=True)
     cell_bs_pipeline_args(module_parser)
     chunks_pipeline_args(module_parser, 'chunks-pipeline')
+    merge_chunks_args(module_parser)
+    benchmark_args(module_parser)
     return main_parser.parse_args()
 
 
@@ -59,3 +191,7 @@ if __name__ == '__main__':
         process_chunks(args)
     if args.module == 'bs':
         process_base_stations(args)
+    if args.module == 'merge-chunks':
+        merge_chunks(args)
+    if args.module == 'benchmark':
+        benchmark_pipeline(args)
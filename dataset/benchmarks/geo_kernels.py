@@ -0,0 +1,97 @@
+"""
+Microbenchmark of the geo kernels: the array versions of `dataset.geo_utils` against the scalar loop
+used by the bs pipeline before them.
+
+    python -m dataset.benchmarks.geo_kernels --points 2000 --cells 500
+"""
+import argparse
+import time
+from math import radians, cos, sin, asin, sqrt
+from typing import Tuple, Callable
+
+import numpy as np
+
+from dataset.geo_utils import haversine_distances, points_in_boxes, EARTH_RADIUS
+
+# area of the Milan grid
+MIN_LNG, MIN_LAT, MAX_LNG, MAX_LAT = 9.011, 45.357, 9.312, 45.568
+
+
+def scalar_haversine_distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    # the scalar implementation of geo_utils.haversine_distance, with the math module
+    lon1, lat1, lon2, lat2 = map(radians, [a[0], a[1], b[0], b[1]])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    return 2 * asin(sqrt(a)) * EARTH_RADIUS
+
+
+def scalar_is_point_in_box(box: Tuple[float, float, float, float], point: Tuple[float, float]) -> bool:
+    min_lng, min_lat, max_lng, max_lat = box
+    return min_lng <= point[0] <= max_lng and min_lat <= point[1] <= max_lat
+
+
+def generate_points(n: int, rng: np.random.Generator) -> np.ndarray:
+    return np.stack([rng.uniform(MIN_LNG, MAX_LNG, n), rng.uniform(MIN_LAT, MAX_LAT, n)], axis=1)
+
+
+def generate_boxes(n: int, rng: np.random.Generator, side: float = 0.003) -> np.ndarray:
+    corners = generate_points(n, rng)
+    return np.concatenate([corners, corners + side], axis=1)
+
+
+def timeit(function: Callable, repeat: int = 3) -> float:
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(n_points: int = 2000, n_cells: int = 500, seed: int = 0, repeat: int = 3) -> dict:
+    rng = np.random.default_rng(seed)
+    points = generate_points(n_points, rng)
+    centers = generate_points(n_cells, rng)
+    boxes = generate_boxes(n_cells, rng)
+    points_list = [tuple(point) for point in points.tolist()]
+    centers_list = [tuple(center) for center in centers.tolist()]
+    boxes_list = [tuple(box) for box in boxes.tolist()]
+
+    def scalar_distances():
+        return [[scalar_haversine_distance(center, point) for center in centers_list] for point in points_list]
+
+    def scalar_containment():
+        return [[scalar_is_point_in_box(box, point) for box in boxes_list] for point in points_list]
+
+    # the two implementations must agree before being compared
+    assert np.allclose(np.array(scalar_distances()), haversine_distances(points, centers), rtol=1e-12, atol=1e-12)
+    assert np.array_equal(np.array(scalar_containment()), points_in_boxes(points, boxes))
+
+    results = {
+        'pairs': n_points * n_cells,
+        'haversine_scalar': timeit(scalar_distances, repeat),
+        'haversine_vectorized': timeit(lambda: haversine_distances(points, centers), repeat),
+        'containment_scalar': timeit(scalar_containment, repeat),
+        'containment_vectorized': timeit(lambda: points_in_boxes(points, boxes), repeat),
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Geo kernels microbenchmark')
+    parser.add_argument('--points', default=2000, type=int, help='Number of points. Default: 2000')
+    parser.add_argument('--cells', default=500, type=int, help='Number of cells. Default: 500')
+    parser.add_argument('--repeat', default=3, type=int, help='Repetitions, the best one is kept. Default: 3')
+    args = parser.parse_args()
+    results = run_benchmark(args.points, args.cells, repeat=args.repeat)
+    print(f'INFO | {results["pairs"]} (point, cell) pairs, best of {args.repeat}')
+    for kernel in ['haversine', 'containment']:
+        scalar = results[f'{kernel}_scalar']
+        vectorized = results[f'{kernel}_vectorized']
+        print(f'INFO | {kernel}: scalar loop {scalar * 1000:.1f} ms | vectorized {vectorized * 1000:.1f} ms '
+              f'| speedup {scalar / vectorized:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
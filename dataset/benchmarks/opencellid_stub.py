@@ -0,0 +1,89 @@
+"""
+Local stub of the OpenCellID getCells api, for running the base stations download without the provider.
+It serves the base stations of a geojson inside the requested bbox, at most `max_results` of them,
+with an optional latency for each request.
+
+    python -m dataset.benchmarks.opencellid_stub data/milan/bs_milan.geojson --port 8766
+    python dataset.py bs ... --api-path http://127.0.0.1:8766/getCells.php --api-token 'key=stub&'
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Tuple
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from dataset.geo_utils import get_feature_lng_and_lat
+from dataset.utils import load_json_file
+
+
+class OpenCellIdStub(ThreadingHTTPServer):
+
+    def __init__(self, geojson_path: str, port: int = 0, max_results: int = 1000, latency: float = 0):
+        super().__init__(('127.0.0.1', port), OpenCellIdStubHandler)
+        self.features = load_json_file(geojson_path)['features']
+        self.points = np.array([get_feature_lng_and_lat(feature) for feature in self.features],
+                               dtype=np.float64).reshape(-1, 2)
+        self.max_results = max_results
+        self.latency = latency
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/getCells.php'
+
+    def get_features(self, bbox: Tuple[float, float, float, float]) -> list:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        in_box = (self.points[:, 0] >= min_lng) & (self.points[:, 0] <= max_lng) & \
+                 (self.points[:, 1] >= min_lat) & (self.points[:, 1] <= max_lat)
+        return [self.features[i] for i in np.flatnonzero(in_box)[:self.max_results]]
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class OpenCellIdStubHandler(BaseHTTPRequestHandler):
+    server: OpenCellIdStub
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.server._lock:
+            self.server.n_requests += 1
+        time.sleep(self.server.latency)
+        query = parse_qs(urlparse(self.path).query)
+        if 'bbox' not in query:
+            body = {'status': 'error', 'message': 'Missing bbox'}
+        else:
+            bbox = tuple(float(value) for value in query['bbox'][0].split(','))
+            body = {'type': 'FeatureCollection', 'features': self.server.get_features(bbox)}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stub of the OpenCellID api')
+    parser.add_argument('geojson', help='Base stations geojson served by the stub')
+    parser.add_argument('--port', default=8766, type=int, help='Port of the server. Default: 8766')
+    parser.add_argument('--max-results', default=1000, type=int,
+                        help='Maximum number of base stations of a response. Default: 1000')
+    parser.add_argument('--latency', default=0, type=float, help='Seconds waited for each request. Default: 0')
+    args = parser.parse_args()
+    server = OpenCellIdStub(args.geojson, args.port, args.max_results, args.latency)
+    print(f'INFO | Serving {len(server.features)} base stations on {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
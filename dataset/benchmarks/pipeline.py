@@ -0,0 +1,275 @@
+"""
+Benchmark of the pipeline stages on synthetic data, at several scales (cells of the grid). Each stage runs in a
+new process, so its peak memory is not affected by the other stages, and the results are appended as json lines
+to the output file, to be compared between versions. It needs neither network nor MongoDB: the base stations are
+mapped with the local engine and downloaded from a local OpenCellID stub.
+
+    python dataset.py benchmark --cells 1000,10000 --output benchmarks.jsonl
+"""
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from dataset.benchmarks.opencellid_stub import OpenCellIdStub
+from dataset.benchmarks.synthetic import generate_chunk, generate_grid_geojson, generate_bs_geojson, SLOTS_PER_DAY
+from dataset.downloader.http_download import download_base_stations
+from dataset.grid_index import GridIndex
+from dataset.metrics import get_max_rss
+from dataset.preprocessing.aggregate_bs_to_cell import aggregate_bs_single_chunk
+from dataset.preprocessing.bs_pipeline import map_cells_to_base_stations
+from dataset.preprocessing.dataframe import load_dataset_chunk
+from dataset.preprocessing.storage import read_dataframe, write_dataframe
+from dataset.utils import ROOT_DIR, create_directory, create_directory_from_filepath, load_json_file
+
+STAGES = ['load-chunk', 'aggregate-bs', 'bs-mapping', 'bs-download']
+BS_TYPES = 'LTE,UMTS'
+MAX_DISTANCE = 500
+# base stations returned by a response of the stub, smaller than the api limit so the quadtree is split
+STUB_MAX_RESULTS = 200
+BOX_SIDE = 10
+
+
+def get_status_rss(field: str = 'VmHWM') -> Optional[int]:
+    # resident memory of the process, in bytes: the current one (VmRSS) or its peak (VmHWM). None if not on Linux
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def reset_peak_rss() -> bool:
+    # set the peak resident memory (VmHWM) of the process to the current one, only on Linux
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageMeasure:
+    """
+    Wall and CPU time and peak resident memory of the code run in its context. The peak memory of the processes
+    started in the context (e.g. the mapping workers) is the one of the largest of them
+    """
+
+    def __init__(self):
+        self.seconds = None
+        self.cpu_seconds = None
+        self.start_rss = None
+        self.peak_rss = None
+        self._start = None
+        self._start_cpu = None
+        self._peak_reset = False
+
+    def __enter__(self) -> 'StageMeasure':
+        # on Linux ru_maxrss is inherited by the processes started from this one, even with spawn, so it is never
+        # lower than the memory of the parent: the peak is measured with VmHWM when it can be reset
+        self._peak_reset = reset_peak_rss()
+        self.start_rss = get_status_rss('VmRSS') if self._peak_reset else get_max_rss()
+        self._start_cpu = time.process_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self._start
+        self.cpu_seconds = time.process_time() - self._start_cpu
+        peak_rss = get_status_rss('VmHWM') if self._peak_reset else get_max_rss()
+        self.peak_rss = max(peak_rss, get_max_rss(resource.RUSAGE_CHILDREN))
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def count_lines(path: str) -> int:
+    with open(path, 'rb') as f:
+        return sum([block.count(b'\n') for block in iter(lambda: f.read(1024 * 1024), b'')])
+
+
+def prepare_fixtures(work_folder: str, n_cells: int, slots: int, seed: int) -> dict:
+    """
+    Generate the synthetic inputs of the stages for a scale, if not already in `work_folder`.
+    The outputs of a stage used as input by another (the processed chunk, the aggregated base stations)
+    are computed here, so each stage is timed alone
+    """
+    folder = os.path.join(work_folder, f'cells-{n_cells}-slots-{slots}-seed-{seed}')
+    create_directory(folder)
+    fixtures = {
+        'folder': folder,
+        'chunk': os.path.join(folder, 'chunk.txt'),
+        'grid': os.path.join(folder, 'grid.geojson'),
+        'bs': os.path.join(folder, 'bs.geojson'),
+        'processed_chunk': os.path.join(folder, 'processed-chunk.csv'),
+        'aggregated_bs': os.path.join(folder, 'cell_base_stations_aggregated.csv'),
+    }
+    if not os.path.exists(fixtures['grid']):
+        generate_grid_geojson(fixtures['grid'], n_cells)
+    if not os.path.exists(fixtures['bs']):
+        generate_bs_geojson(fixtures['bs'], n_cells, seed=seed)
+    if not os.path.exists(fixtures['chunk']):
+        print(f'INFO | Generating a chunk of {n_cells} cells and {slots} slots')
+        generate_chunk(fixtures['chunk'], n_cells, slots=slots, seed=seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not os.path.exists(fixtures['processed_chunk']):
+            write_dataframe(load_dataset_chunk(fixtures['chunk']), fixtures['processed_chunk'])
+        if not os.path.exists(fixtures['aggregated_bs']):
+            grid = GridIndex.from_geojson(fixtures['grid'], use_cache=False)
+            _, aggregated_df = map_cells_to_base_stations(grid, 'local', fixtures['bs'], None, MAX_DISTANCE,
+                                                          BS_TYPES)
+            write_dataframe(aggregated_df, fixtures['aggregated_bs'])
+    fixtures['chunk_rows'] = count_lines(fixtures['chunk'])
+    # the processed chunk has a header
+    fixtures['processed_chunk_rows'] = count_lines(fixtures['processed_chunk']) - 1
+    return fixtures
+
+
+def run_load_chunk(fixtures: dict, options: dict, measure: StageMeasure) -> dict:
+    with measure:
+        df = load_dataset_chunk(fixtures['chunk'])
+    return {'rows': fixtures['chunk_rows'], 'rows_out': len(df), 'bytes_in': os.path.getsize(fixtures['chunk'])}
+
+
+def run_aggregate_bs(fixtures: dict, options: dict, measure: StageMeasure) -> dict:
+    save_path = os.path.join(fixtures['folder'], 'aggregated-chunk.csv')
+    with measure:
+        aggregated_bs_df = read_dataframe(fixtures['aggregated_bs'])
+        aggregate_bs_single_chunk(fixtures['processed_chunk'], aggregated_bs_df, save_path)
+    os.remove(save_path)
+    return {'rows': fixtures['processed_chunk_rows'], 'bytes_in': os.path.getsize(fixtures['processed_chunk'])}
+
+
+def run_bs_mapping(fixtures: dict, options: dict, measure: StageMeasure) -> dict:
+    with measure:
+        grid = GridIndex.from_geojson(fixtures['grid'], use_cache=False)
+        cell_df, _ = map_cells_to_base_stations(grid, 'local', fixtures['bs'], None, MAX_DISTANCE, BS_TYPES,
+                                                workers=options['workers'], geojson_path=fixtures['grid'])
+    return {'rows': len(grid.cell_ids), 'rows_out': len(cell_df), 'bytes_in': os.path.getsize(fixtures['bs'])}
+
+
+def run_bs_download(fixtures: dict, options: dict, measure: StageMeasure) -> dict:
+    save_path = os.path.join(fixtures['folder'], 'downloaded-bs.geojson')
+    grid = GridIndex.from_geojson(fixtures['grid'], use_cache=False)
+    # the stub runs in this process, its memory and the cpu time of its threads are part of the measure
+    server = OpenCellIdStub(fixtures['bs'], max_results=STUB_MAX_RESULTS)
+    server.start()
+    try:
+        with measure:
+            download_base_stations(grid, server.url, 'key=benchmark&', save_path, BOX_SIDE,
+                                   max_results=STUB_MAX_RESULTS, workers=options['download_workers'])
+    finally:
+        server.shutdown()
+        server.server_close()
+    rows = len(load_json_file(save_path)['features'])
+    os.remove(save_path)
+    return {'rows': rows, 'requests': server.n_requests, 'bytes_in': os.path.getsize(fixtures['bs'])}
+
+
+STAGE_FUNCTIONS = {
+    'load-chunk': run_load_chunk,
+    'aggregate-bs': run_aggregate_bs,
+    'bs-mapping': run_bs_mapping,
+    'bs-download': run_bs_download,
+}
+
+
+def _run_stage(stage: str, fixtures: dict, options: dict) -> dict:
+    # executed in a new process, the memory used before the stage is the one of the interpreter and the modules
+    measure = StageMeasure()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = STAGE_FUNCTIONS[stage](fixtures, options, measure)
+    result.update(seconds=measure.seconds, cpu_seconds=measure.cpu_seconds, start_rss=measure.start_rss,
+                  peak_rss=measure.peak_rss)
+    return result
+
+
+def run_stage_in_process(stage: str, fixtures: dict, options: dict) -> dict:
+    # spawn, not fork: a forked process would share the memory of the benchmark process
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_run_stage, stage, fixtures, options).result()
+
+
+def run_benchmarks(
+        cells: List[int],
+        stages: List[str],
+        output: Optional[str],
+        work_folder: str,
+        slots: int = SLOTS_PER_DAY,
+        repeat: int = 1,
+        seed: int = 0,
+        workers: int = 1,
+        download_workers: int = 1
+) -> List[dict]:
+    """
+    Run each stage `repeat` times for each number of cells, keeping the best time, and append a json line
+    for each of them to `output`
+    """
+    run_info = {
+        'run': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+    options = {'workers': workers, 'download_workers': download_workers}
+    records = []
+    for n_cells in cells:
+        fixtures = prepare_fixtures(work_folder, n_cells, slots, seed)
+        for stage in stages:
+            runs = [run_stage_in_process(stage, fixtures, options) for _ in range(repeat)]
+            best = min(runs, key=lambda r: r['seconds'])
+            record = {
+                **run_info,
+                'stage': stage,
+                'cells': n_cells,
+                'slots': slots,
+                'seed': seed,
+                **options,
+                **{key: value for key, value in best.items() if key not in ('start_rss', 'peak_rss')},
+                'rows_per_sec': best['rows'] / best['seconds'] if best['seconds'] > 0 else None,
+                'all_seconds': [r['seconds'] for r in runs],
+                'start_rss_mb': best['start_rss'] / 1024 / 1024,
+                'peak_rss_mb': max([r['peak_rss'] for r in runs]) / 1024 / 1024,
+            }
+            records.append(record)
+            # a stage too fast for the clock has no rate
+            rate = f'{record["rows_per_sec"]:,.0f}' if record['rows_per_sec'] is not None else '-'
+            print(f'INFO | {stage} | cells: {n_cells} | rows: {record["rows"]} | {record["seconds"]:.3f} s'
+                  f' | {rate} rows/s | peak RSS: {record["peak_rss_mb"]:.1f} MB')
+            if output is not None:
+                with open(output, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+    return records
+
+
+def benchmark_pipeline(args):
+    cells = [int(n) for n in args.cells.split(',')]
+    stages = args.stages.split(',') if args.stages else STAGES
+    for stage in stages:
+        if stage not in STAGE_FUNCTIONS:
+            print(f'ERROR | Unknown stage {stage}, the stages are: {", ".join(STAGES)}')
+            return None
+    output = os.path.join(ROOT_DIR, args.output) if args.output else None
+    if output is not None:
+        create_directory_from_filepath(output)
+    print(f'INFO | Cells: {cells} | Stages: {stages} | Slots: {args.slots} | Repeat: {args.repeat}'
+          f' | Output: {output}')
+    run_benchmarks(cells, stages, output, os.path.join(ROOT_DIR, args.work_folder), args.slots, args.repeat,
+                   args.seed, args.workers, args.download_workers)
@@ -0,0 +1,250 @@
+"""
+Synthetic fixtures of the benchmarks: raw chunks in the format of the Telecom Italia dataset, a grid geojson of
+square cells numbered by row and a geojson of base stations over the area of the grid.
+
+    python -m dataset.benchmarks.synthetic chunk /tmp/chunk.txt --cells 10000
+    python -m dataset.benchmarks.synthetic grid /tmp/grid.geojson --cells 10000
+    python -m dataset.benchmarks.synthetic bs /tmp/bs.geojson --cells 10000
+"""
+import argparse
+import datetime
+import io
+import json
+import re
+from math import ceil, sqrt
+from typing import Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+
+from dataset.preprocessing.dataframe import FIELDS, METRICS, TIMEZONE
+from dataset.utils import create_directory_from_filepath
+
+# origin and cell side of the Milan grid
+MIN_LNG, MIN_LAT = 9.011, 45.357
+CELL_LNG_SIDE, CELL_LAT_SIDE = 0.003, 0.0021
+# ten minutes slots of a day
+SLOTS_PER_DAY = 144
+SLOT_MS = 10 * 60 * 1000
+# country codes of the foreign operators, with their frequency
+FOREIGN_COUNTRY_CODES = np.array([33, 49, 46, 40, 355, 41, 420, 7, 44, 34, 86, 1, 43, 48, 380])
+FOREIGN_COUNTRY_WEIGHTS = np.array([8, 8, 6, 6, 4, 4, 2, 2, 6, 6, 3, 3, 2, 2, 2], dtype=np.float64)
+# probability of a row of each kind in a slot of a cell, the foreign rows are a poisson with this mean
+ITALY_ROW_PROBABILITY = 0.97
+NO_COUNTRY_ROW_PROBABILITY = 0.7
+FOREIGN_ROWS_MEAN = 0.6
+# probability that a metric (smsin, smsout, callin, callout, internet) is present in a row, for each kind of row
+ITALY_METRICS_PROBABILITY = np.array([0.95, 0.8, 0.75, 0.8, 0.98])
+NO_COUNTRY_METRICS_PROBABILITY = np.array([0.85, 0.1, 0.05, 0.3, 0.05])
+FOREIGN_METRICS_PROBABILITY = np.array([0.3, 0.2, 0.25, 0.3, 0.6])
+# mean of each metric in a slot of a cell with an average activity
+METRICS_MEAN = np.array([0.22, 0.21, 0.23, 0.21, 7.4])
+# base stations types, with their frequency
+BS_TYPES = np.array(['LTE', 'UMTS', 'GSM'])
+BS_TYPES_WEIGHTS = np.array([0.5, 0.35, 0.15])
+BS_PER_CELL = 1.13
+# rows written at once
+CELLS_PER_BLOCK = 500
+
+_trailing_tabs = re.compile(r'\t+$', flags=re.MULTILINE)
+
+
+def get_grid_shape(n_cells: int) -> Tuple[int, int]:
+    # the most square grid with at least n_cells cells
+    n_cols = ceil(sqrt(n_cells))
+    return ceil(n_cells / n_cols), n_cols
+
+
+def get_grid_bbox(n_cells: int) -> Tuple[float, float, float, float]:
+    n_rows, n_cols = get_grid_shape(n_cells)
+    return MIN_LNG, MIN_LAT, MIN_LNG + n_cols * CELL_LNG_SIDE, MIN_LAT + n_rows * CELL_LAT_SIDE
+
+
+def get_cells_activity(n_cells: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Activity level of each cell, higher in the center of the grid, with a lognormal noise. The average is about 1
+    """
+    n_rows, n_cols = get_grid_shape(n_cells)
+    positions = np.arange(n_cells)
+    rows = (positions // n_cols) / max(n_rows - 1, 1) - 0.5
+    cols = (positions % n_cols) / max(n_cols - 1, 1) - 0.5
+    center = 0.2 + np.exp(-(rows ** 2 + cols ** 2) * 6)
+    activity = center * rng.lognormal(0, 0.5, n_cells)
+    return activity / activity.mean()
+
+
+def get_daily_profile() -> np.ndarray:
+    # activity of each slot of the day, low at night and with peaks in the late morning and in the evening
+    hours = np.arange(SLOTS_PER_DAY) / 6
+    return 0.15 + 0.6 * np.exp(-((hours - 11) / 3) ** 2) + 0.5 * np.exp(-((hours - 18.5) / 2.5) ** 2)
+
+
+def generate_chunk_block(
+        cell_ids: np.ndarray,
+        activity: np.ndarray,
+        day_start: int,
+        slots: int,
+        rng: np.random.Generator
+) -> pd.DataFrame:
+    """
+    Rows of the given cells for `slots` ten minutes slots from `day_start` (epoch milliseconds), sorted by cell,
+    slot and country code as in the dataset chunks
+    """
+    n_cells = len(cell_ids)
+    cell_position = np.repeat(np.arange(n_cells), slots)
+    slot = np.tile(np.arange(slots), n_cells)
+    # the rows of each slot: italian operators (39), no country code (0) and a few foreign operators
+    n_foreign = rng.poisson(FOREIGN_ROWS_MEAN, len(slot))
+    has_italy = rng.random(len(slot)) < ITALY_ROW_PROBABILITY
+    has_no_country = rng.random(len(slot)) < NO_COUNTRY_ROW_PROBABILITY
+    rows_per_slot = n_foreign + has_italy + has_no_country
+    row_slot = np.repeat(np.arange(len(slot)), rows_per_slot)
+    # position of the row among the rows of its slot, 0 and 39 come first when present
+    first_row = np.cumsum(rows_per_slot) - rows_per_slot
+    rank = np.arange(len(row_slot)) - first_row[row_slot]
+    country_code = rng.choice(FOREIGN_COUNTRY_CODES, len(row_slot),
+                              p=FOREIGN_COUNTRY_WEIGHTS / FOREIGN_COUNTRY_WEIGHTS.sum())
+    no_country_rank = np.where(has_no_country, 0, -1)[row_slot]
+    italy_rank = (has_no_country.astype(np.int64) + np.where(has_italy, 0, -100))[row_slot]
+    country_code[rank == no_country_rank] = 0
+    country_code[rank == italy_rank] = 39
+    # the foreign rows are sorted by country code, the duplicated ones are dropped
+    df = pd.DataFrame({'slot': row_slot, 'countrycode': country_code})
+    df = df.drop_duplicates().sort_values(['slot', 'countrycode'], kind='stable')
+    row_slot = df['slot'].to_numpy()
+    country_code = df['countrycode'].to_numpy()
+    # the metrics, sparse and proportional to the activity of the cell in the slot
+    probability = np.where((country_code == 39)[:, None], ITALY_METRICS_PROBABILITY,
+                           np.where((country_code == 0)[:, None], NO_COUNTRY_METRICS_PROBABILITY,
+                                    FOREIGN_METRICS_PROBABILITY))
+    present = rng.random(probability.shape) < probability
+    # a row has at least one metric
+    present[~present.any(axis=1), 0] = True
+    scale = np.where(country_code == 39, 1.0, np.where(country_code == 0, 0.3, 0.05))
+    level = activity[cell_position[row_slot]] * get_daily_profile()[slot[row_slot] % SLOTS_PER_DAY] * scale
+    values = rng.gamma(2.0, 0.5, probability.shape) * METRICS_MEAN * level[:, None]
+    values[~present] = np.nan
+    block = pd.DataFrame({
+        'cellId': cell_ids[cell_position[row_slot]],
+        'datetime': day_start + slot[row_slot].astype(np.int64) * SLOT_MS,
+        'countrycode': country_code,
+    })
+    for i, metric in enumerate(METRICS):
+        block[metric] = values[:, i]
+    return block[FIELDS]
+
+
+def generate_chunk(
+        save_path: str,
+        n_cells: int = 10000,
+        date: str = '2013-11-01',
+        slots: int = SLOTS_PER_DAY,
+        seed: int = 0,
+        cells_per_block: int = CELLS_PER_BLOCK
+) -> int:
+    """
+    Write a synthetic raw chunk of `n_cells` cells for `slots` ten minutes slots of `date` (local time): tab separated,
+    without header, sorted by cell, time and country code, with the empty trailing fields omitted.
+    It returns the number of rows written
+    """
+    rng = np.random.default_rng(seed)
+    activity = get_cells_activity(n_cells, rng)
+    day = datetime.datetime.fromisoformat(date).replace(tzinfo=ZoneInfo(TIMEZONE))
+    day_start = int(day.timestamp() * 1000)
+    cell_ids = np.arange(1, n_cells + 1, dtype=np.int64)
+    n_rows = 0
+    create_directory_from_filepath(save_path)
+    with open(save_path, 'w', encoding='utf-8') as f:
+        for start in range(0, n_cells, cells_per_block):
+            end = min(start + cells_per_block, n_cells)
+            block = generate_chunk_block(cell_ids[start:end], activity[start:end], day_start, slots, rng)
+            buffer = io.StringIO()
+            block.to_csv(buffer, sep='\t', header=False, index=False, na_rep='')
+            f.write(_trailing_tabs.sub('', buffer.getvalue()))
+            n_rows += len(block)
+    return n_rows
+
+
+def generate_grid_geojson(save_path: str, n_cells: int = 10000) -> int:
+    """
+    Write a grid of `n_cells` square cells, numbered by row from the bottom left corner as the Milan grid
+    """
+    n_rows, n_cols = get_grid_shape(n_cells)
+    features = []
+    for position in range(n_cells):
+        min_lng = round(MIN_LNG + (position % n_cols) * CELL_LNG_SIDE, 6)
+        min_lat = round(MIN_LAT + (position // n_cols) * CELL_LAT_SIDE, 6)
+        max_lng = round(min_lng + CELL_LNG_SIDE, 6)
+        max_lat = round(min_lat + CELL_LAT_SIDE, 6)
+        features.append({
+            'type': 'Feature',
+            'id': position,
+            'properties': {'cellId': position + 1},
+            'geometry': {'type': 'Polygon', 'coordinates': [[
+                [min_lng, min_lat], [max_lng, min_lat], [max_lng, max_lat], [min_lng, max_lat], [min_lng, min_lat]
+            ]]}
+        })
+    create_directory_from_filepath(save_path)
+    with open(save_path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    return n_cells
+
+
+def generate_bs_geojson(save_path: str, n_cells: int = 10000, n_base_stations: Optional[int] = None,
+                        seed: int = 0) -> int:
+    """
+    Write the base stations of the area of a grid of `n_cells` cells, in the format of the OpenCellID api.
+    They are denser in the center of the area, about BS_PER_CELL for each cell if `n_base_stations` is not set
+    """
+    rng = np.random.default_rng(seed)
+    n_base_stations = n_base_stations if n_base_stations is not None else int(n_cells * BS_PER_CELL)
+    min_lng, min_lat, max_lng, max_lat = get_grid_bbox(n_cells)
+    # half uniform and half around the center of the area
+    n_center = n_base_stations // 2
+    lng = np.concatenate([rng.uniform(min_lng, max_lng, n_base_stations - n_center),
+                          rng.normal((min_lng + max_lng) / 2, (max_lng - min_lng) / 6, n_center)])
+    lat = np.concatenate([rng.uniform(min_lat, max_lat, n_base_stations - n_center),
+                          rng.normal((min_lat + max_lat) / 2, (max_lat - min_lat) / 6, n_center)])
+    lng = np.clip(lng, min_lng, max_lng)
+    lat = np.clip(lat, min_lat, max_lat)
+    radio = rng.choice(BS_TYPES, n_base_stations, p=BS_TYPES_WEIGHTS)
+    cells = 10 ** 6 + rng.choice(2 * 10 ** 8, n_base_stations, replace=False)
+    created = rng.integers(1300000000, 1500000000, n_base_stations)
+    features = [{
+        'type': 'Feature',
+        'properties': {'cell': int(cells[i]), 'radio': str(radio[i]), 'range': 1000,
+                       'created': int(created[i]), 'updated': int(created[i])},
+        'geometry': {'type': 'Point', 'coordinates': [float(lng[i]), float(lat[i])]}
+    } for i in range(n_base_stations)]
+    create_directory_from_filepath(save_path)
+    with open(save_path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    return n_base_stations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the synthetic fixtures of the benchmarks')
+    parser.add_argument('fixture', choices=['chunk', 'grid', 'bs'], help='Fixture to generate')
+    parser.add_argument('save_path', help='Path of the generated file')
+    parser.add_argument('--cells', default=10000, type=int, help='Number of cells of the grid. Default: 10000')
+    parser.add_argument('--date', default='2013-11-01', help='Day of the chunk. Default: 2013-11-01')
+    parser.add_argument('--slots', default=SLOTS_PER_DAY, type=int,
+                        help=f'Ten minutes slots of the chunk. Default: {SLOTS_PER_DAY}')
+    parser.add_argument('--base-stations', default=None, type=int,
+                        help='Number of base stations, if not set they are proportional to the cells')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the generator. Default: 0')
+    args = parser.parse_args()
+    if args.fixture == 'chunk':
+        n = generate_chunk(args.save_path, args.cells, args.date, args.slots, args.seed)
+        print(f'INFO | Generated a chunk of {n} rows in {args.save_path}')
+    elif args.fixture == 'grid':
+        n = generate_grid_geojson(args.save_path, args.cells)
+        print(f'INFO | Generated a grid of {n} cells in {args.save_path}')
+    else:
+        n = generate_bs_geojson(args.save_path, args.cells, args.base_stations, args.seed)
+        print(f'INFO | Generated {n} base stations in {args.save_path}')
+
+
+if __name__ == '__main__':
+    main()
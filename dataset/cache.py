@@ -0,0 +1,115 @@
+import hashlib
+import os
+import pickle
+import threading
+from glob import glob
+from typing import Any, Optional, List, Tuple
+
+from dataset.utils import ROOT_DIR, create_directory
+
+CACHE_FOLDER = os.path.join(ROOT_DIR, '.cache')
+# default maximum size, in MB, of the entries of a result cache
+DEFAULT_CACHE_SIZE = 512
+# fraction of the maximum size kept by an eviction, so the next one happens only after some more entries are saved
+EVICT_RATIO = 0.9
+
+
+def get_cache_key(*parts) -> str:
+    """
+    Content address of a cached result: the md5 of all the parts (checksums of the input files and parameters)
+    """
+    hasher = hashlib.md5()
+    for part in parts:
+        hasher.update(repr(part).encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """
+    On disk cache of pickled results in `.cache/<name>/<key>.pkl`. When the entries exceed `max_size` MB the least
+    recently used ones are removed. It can be shared by threads, and by more runs using the same folder.
+    The size of the entries is listed from the folder at the first put and then updated in memory, the folder is
+    listed again only when the size exceeds `max_size` (the entries saved by other runs are counted then)
+    """
+
+    def __init__(self, name: str, max_size: float = DEFAULT_CACHE_SIZE):
+        self.folder = os.path.join(CACHE_FOLDER, name)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._total_size = None
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.folder, f'{key}.pkl')
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            # not cached, or evicted by another thread or run
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            print(f'WARNING | Ignoring the unreadable cache entry {path}: {e}')
+            return None
+        # the modification time is the last use of the entry
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted in the meantime by another run
+            pass
+        return value
+
+    def put(self, key: str, value: Any):
+        create_directory(self.folder)
+        path = self.get_path(key)
+        # write and rename, so a concurrent thread or run never reads a truncated entry
+        tmp_path = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            if self._total_size is None:
+                self._total_size = sum([size for _, size, _ in self.list_entries()])
+            try:
+                # the entry replaced, if any, is not counted anymore
+                self._total_size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self._total_size += size
+            if self._total_size > self.max_size * 1024 * 1024:
+                self._total_size = self.evict(keep=path)
+
+    def list_entries(self) -> List[Tuple[float, int, str]]:
+        # (modification time, size, path) of the entries
+        entries = []
+        for path in glob(os.path.join(self.folder, '*.pkl')):
+            # the entries can be removed by another run while listing them
+            try:
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Remove the least recently used entries, down to EVICT_RATIO of the maximum size. It returns the size of
+        the remaining entries
+        """
+        entries = self.list_entries()
+        total = sum([size for _, size, _ in entries])
+        if total <= self.max_size * 1024 * 1024:
+            return total
+        for _, size, path in sorted(entries):
+            if total <= self.max_size * 1024 * 1024 * EVICT_RATIO:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Optional, Dict, Tuple, Callable, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# connect and read timeouts, in seconds, of every request
+DEFAULT_TIMEOUT = (10, 60)
+# retries of a single request on connection errors and on the RETRY_STATUSES, with an exponential backoff
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# connections kept alive for each host, it should not be lower than the concurrent downloads
+DEFAULT_POOL_SIZE = 16
+# attempts of a whole download, repeated when it fails after the request retries (e.g. a reset while streaming)
+DEFAULT_DOWNLOAD_ATTEMPTS = 3
+
+# sessions of the process, with and without the retries of the RETRY_STATUSES responses
+_sessions: Dict[bool, requests.Session] = {}
+_session_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    """
+    A download that failed. `retryable` is True when repeating it later can succeed (connection errors,
+    timeouts, 429 and 5xx responses, corrupted files), False otherwise (e.g. a 404 or an error of the provider).
+    `retry_after` is the Retry-After, in seconds, of the response
+    """
+
+    def __init__(self, url: str, message: str, status_code: Optional[int] = None, retryable: bool = False,
+                 retry_after: Optional[float] = None):
+        super().__init__(f'{message} | url: {url}' + (f' | status code: {status_code}' if status_code else ''))
+        self.url = url
+        self.message = message
+        self.status_code = status_code
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def get_session(status_retries: bool = True) -> requests.Session:
+    """
+    requests Session shared by all the downloaders of the process. It keeps the connections alive and retries the
+    requests failed for connection errors or, with `status_retries`, for a RETRY_STATUSES response, waiting
+    DEFAULT_BACKOFF * 2 ^ retry seconds (or the Retry-After of the response) between them
+    """
+    with _session_lock:
+        if status_retries not in _sessions:
+            # without status retries the RETRY_STATUSES responses are returned at once (status=0)
+            retry = Retry(total=DEFAULT_RETRIES, status=None if status_retries else 0, backoff_factor=DEFAULT_BACKOFF,
+                          status_forcelist=RETRY_STATUSES, allowed_methods=['GET'],
+                          respect_retry_after_header=True, raise_on_status=False)
+            adapter = HTTPAdapter(max_retries=retry, pool_connections=DEFAULT_POOL_SIZE,
+                                  pool_maxsize=DEFAULT_POOL_SIZE)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[status_retries] = session
+        return _sessions[status_retries]
+
+
+def http_get(
+        url: str,
+        stream: bool = False,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        status_retries: bool = True
+) -> requests.Response:
+    """
+    GET request with the shared session. The errors still present after the retries are raised as DownloadError,
+    while the responses are returned whatever their status code. The requests to a rate limited provider are
+    sent without `status_retries`, so they are repeated only by the caller after acquiring a new token
+    """
+    try:
+        return get_session(status_retries).get(url, stream=stream, headers=headers, timeout=timeout)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise DownloadError(url, f'Connection failed: {e!r}', retryable=True) from e
+    except requests.RequestException as e:
+        raise DownloadError(url, f'Request failed: {e!r}') from e
+
+
+def check_response(response: requests.Response, url: str):
+    """
+    Raise a DownloadError if the response is not successful
+    """
+    if response.status_code not in (200, 206):
+        retry_after = response.headers.get('Retry-After')
+        raise DownloadError(url, f'Error while downloading: {response.text[:200]}', status_code=response.status_code,
+                            retryable=response.status_code in RETRY_STATUSES,
+                            retry_after=float(retry_after) if retry_after is not None and retry_after.isdigit()
+                            else None)
+
+
+def with_download_retries(
+        function: Callable[..., Any],
+        *args,
+        attempts: int = DEFAULT_DOWNLOAD_ATTEMPTS,
+        backoff: float = DEFAULT_BACKOFF,
+        **kwargs
+) -> Any:
+    """
+    Call `function` again when it raises a retryable DownloadError, up to `attempts` times with an exponential
+    backoff (or the Retry-After of the response, if longer), the last error is raised
+    """
+    for attempt in range(attempts):
+        try:
+            return function(*args, **kwargs)
+        except DownloadError as e:
+            if not e.retryable or attempt == attempts - 1:
+                raise
+            wait_time = max(backoff * 2 ** attempt, e.retry_after or 0)
+            print(f'\nWARNING | {e} | attempt {attempt + 1}/{attempts} failed, retrying in {wait_time} seconds')
+            time.sleep(wait_time)
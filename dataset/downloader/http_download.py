@@ -1,13 +1,24 @@
 import json
 import os
-import time
-from typing import Optional, List, Tuple
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, List, Tuple, Iterator, Callable, Any
 
+import numpy as np
 import pandas as pd
 import requests
 
-from dataset.utils import create_directory, format_bytes, print_status, ROOT_DIR
-from dataset.geo_utils import get_box_features, get_box_min_max_coordinates, points_distance
+from dataset.cache import ResultCache, get_cache_key
+from dataset.downloader.http_client import http_get, check_response, DownloadError, with_download_retries
+from dataset.downloader.rate_limiter import RateLimiter, DAILY_QUOTA_FILE
+from dataset.grid_index import GridIndex
+from dataset.metrics import stage
+from dataset.utils import create_directory, format_bytes, print_status, print_progress, ROOT_DIR, file_checksum, \
+    new_hasher, update_hasher_from_file
+from dataset.geo_utils import points_distance, iterate_quadtree_boxes
+
+# maximum number of base stations returned by the provider for a single box
+DEFAULT_MAX_RESULTS = 1000
 
 
 def download_dataset_chunk(
@@ -15,82 +26,382 @@ def download_dataset_chunk(
         persistent_id: str,
         save_folder: str,
         filename: Optional[str] = None,
-        protocol: str = 'https'
+        protocol: str = 'https',
+        progress: Optional['DownloadProgress'] = None,
+        checksum: Optional[str] = None,
+        checksum_type: str = 'MD5',
+        filesize: Optional[int] = None
 ):
     filename = filename if filename is not None else f'{persistent_id.split("/")[-1]}.txt'
     if not os.path.isabs(save_folder):
         save_folder = os.path.join(ROOT_DIR, save_folder)
     full_path = os.path.join(save_folder, filename)
     full_uri = f'{protocol}://{server_url}/api/access/datafile/:persistentId?persistentId={persistent_id}'
-    with (requests.get(full_uri, stream=True)) as r:
-        if r.status_code == 200:
-            total_len = int(r.headers['content-length'])
-            formatted_total_len = format_bytes(total_len)
-            create_directory(save_folder)
+    existing_len = os.path.getsize(full_path) if os.path.exists(full_path) else 0
+    if existing_len > 0 and checksum is not None and (filesize is None or existing_len >= filesize):
+        if file_checksum(full_path, checksum_type) == checksum:
+            print(f'INFO | File {filename} already downloaded and verified, skipping it')
+            if progress is not None:
+                progress.update(existing_len)
+            return full_path
+        # the file is complete but corrupted, we download it again from the beginning
+        existing_len = 0
+    if (filesize is not None and existing_len >= filesize) or (checksum is None and filesize is None):
+        # without the expected size and checksum we cannot tell whether the file is partial
+        existing_len = 0
+    headers = {'Range': f'bytes={existing_len}-'} if existing_len > 0 else None
+    with stage('download', file=filename) as download_stage, \
+            http_get(full_uri, stream=True, headers=headers) as r:
+        if r.status_code == 416:
+            # the server is not able to resume from the partial file, we restart from zero
+            r.close()
+            os.remove(full_path)
+            download_stage.status = 'restarted'
+            return download_dataset_chunk(server_url, persistent_id, save_folder, filename, protocol,
+                                          progress, checksum, checksum_type, filesize)
+        check_response(r, full_uri)
+        hasher = new_hasher(checksum_type) if checksum is not None else None
+        if r.status_code == 206:
+            # we are resuming a partial download, the digest must include the bytes already on disk
+            mode = 'ab'
+            downloaded = existing_len
+            if hasher is not None:
+                update_hasher_from_file(hasher, full_path)
+            print(f'INFO | Resuming download of {filename} from {format_bytes(existing_len)}')
+        else:
+            mode = 'wb'
             downloaded = 0
-            with open(full_path, 'wb') as file:
+        resumed_from = downloaded
+        total_len = downloaded + int(r.headers['content-length'])
+        formatted_total_len = format_bytes(total_len)
+        create_directory(save_folder)
+        with open(full_path, mode) as file:
+            try:
                 for data in r.iter_content(chunk_size=1024*64):
                     downloaded += len(data)
                     file.write(data)
+                    if hasher is not None:
+                        hasher.update(data)
+                    if progress is not None:
+                        progress.update(len(data))
+                    else:
+                        print_status(downloaded, total_len,
+                                     pre_message=f'INFO | Downloading {filename}',
+                                     loading_len=50,
+                                     current_formatted=format_bytes(downloaded),
+                                     total_formatted=formatted_total_len)
+            except requests.RequestException as e:
+                # the partial file is kept, the next attempt resumes from it
+                raise DownloadError(full_uri, f'Download of {filename} interrupted: {e!r}', retryable=True) from e
+            finally:
+                download_stage.add(bytes_in=downloaded - resumed_from, bytes_out=downloaded - resumed_from)
+            if progress is None:
+                print()
+        if hasher is not None and hasher.hexdigest() != checksum:
+            os.remove(full_path)
+            raise DownloadError(full_uri, f'Checksum mismatch for file {filename}: expected {checksum_type} '
+                                          f'{checksum} | obtained {hasher.hexdigest()}', retryable=True)
+        return full_path
+
+
+def stream_dataset_chunk(
+        server_url: str,
+        persistent_id: str,
+        consumer: Callable[[bytes], None],
+        protocol: str = 'https',
+        progress: Optional['DownloadProgress'] = None,
+        checksum: Optional[str] = None,
+        checksum_type: str = 'MD5',
+        block_size: int = 1024 * 64
+) -> bool:
+    """
+    Download a dataset chunk passing its content to the `consumer` callable block by block,
+    without saving anything on disk. If the checksum is provided the digest is verified at the end of the stream.
+    A failed or corrupted stream raises a DownloadError, the consumer has to be reset before trying again
+    Returns
+    -------
+    bool
+        True once the whole chunk has been streamed and verified
+    """
+    full_uri = f'{protocol}://{server_url}/api/access/datafile/:persistentId?persistentId={persistent_id}'
+    # the time of the stream includes the consumer, i.e. the parsing of the chunk
+    with stage('stream', file=persistent_id) as stream_stage, http_get(full_uri, stream=True) as r:
+        check_response(r, full_uri)
+        total_len = int(r.headers['content-length'])
+        formatted_total_len = format_bytes(total_len)
+        hasher = new_hasher(checksum_type) if checksum is not None else None
+        downloaded = 0
+        try:
+            for data in r.iter_content(chunk_size=block_size):
+                downloaded += len(data)
+                if hasher is not None:
+                    hasher.update(data)
+                consumer(data)
+                if progress is not None:
+                    progress.update(len(data))
+                else:
                     print_status(downloaded, total_len,
-                                 pre_message=f'INFO | Downloading {filename}',
+                                 pre_message=f'INFO | Streaming {persistent_id}',
                                  loading_len=50,
                                  current_formatted=format_bytes(downloaded),
                                  total_formatted=formatted_total_len)
-                print()
-            return full_path
-        else:
-            print(f'ERROR | Error while collecting file: {persistent_id}')
-            print(f'ERROR | Status code {r.status_code}')
-            print(f'ERROR | Content {r.text}')
+        except requests.RequestException as e:
+            raise DownloadError(full_uri, f'Stream of {persistent_id} interrupted: {e!r}', retryable=True) from e
+        finally:
+            stream_stage.add(bytes_in=downloaded)
+        if progress is None:
+            print()
+        if hasher is not None and hasher.hexdigest() != checksum:
+            raise DownloadError(full_uri, f'Checksum mismatch for file {persistent_id}: expected {checksum_type} '
+                                          f'{checksum} | obtained {hasher.hexdigest()}', retryable=True)
+        return True
+
+
+def download_metadata_chunk(
+        server_url: str,
+        file: dict,
+        save_folder: str,
+        protocol: str = 'https',
+        progress: Optional['DownloadProgress'] = None
+) -> Optional[str]:
+    """
+    Download the dataset chunk described by a file entry of the metadata json,
+    using its checksum and filesize for resuming and verifying the download. A failed download is attempted again,
+    resuming from the partial file, and it raises a DownloadError when all the attempts fail
+    """
+    data_file = file['dataFile']
+    checksum, checksum_type = get_data_file_checksum(data_file)
+    return with_download_retries(download_dataset_chunk, server_url, data_file['persistentId'], save_folder,
+                                 data_file['filename'], protocol=protocol, progress=progress, checksum=checksum,
+                                 checksum_type=checksum_type, filesize=data_file.get('filesize'))
+
+
+def get_data_file_checksum(data_file: dict) -> Tuple[Optional[str], str]:
+    if 'checksum' in data_file:
+        return data_file['checksum']['value'], data_file['checksum']['type']
+    return data_file.get('md5'), 'MD5'
+
+
+class DownloadProgress:
+    """
+    Thread safe progress display shared by all the concurrent downloads, it prints a single line with
+    the bytes downloaded so far over the total bytes expected
+    """
+
+    def __init__(self, total_bytes: int, pre_message: str = 'INFO | Downloading chunks', loading_len: int = 50):
+        self.total_bytes = max(total_bytes, 1)
+        self.pre_message = pre_message
+        self.loading_len = loading_len
+        self.downloaded = 0
+        self.completed_files = 0
+        self._formatted_total = format_bytes(total_bytes)
+        self._lock = threading.Lock()
+
+    def update(self, n_bytes: int):
+        with self._lock:
+            self.downloaded += n_bytes
+            self._print()
+
+    def file_completed(self):
+        with self._lock:
+            self.completed_files += 1
+            self._print()
+
+    def _print(self):
+        # files can be larger than the size declared in the metadata, we never go over the full bar
+        print_status(min(self.downloaded, self.total_bytes), self.total_bytes,
+                     pre_message=f'{self.pre_message} ({self.completed_files} completed)',
+                     loading_len=self.loading_len,
+                     current_formatted=format_bytes(self.downloaded),
+                     total_formatted=self._formatted_total)
+
+
+def download_dataset_chunks(
+        server_url: str,
+        files: List[Tuple[int, dict]],
+        save_folder: str,
+        protocol: str = 'https',
+        workers: int = 4,
+        fetch: Optional[Callable[..., Any]] = None,
+        on_failed: Optional[Callable[[int, DownloadError], None]] = None
+) -> Iterator[Tuple[int, dict, Any]]:
+    """
+    Download the dataset chunks using a bounded pool of threads. The chunks are downloaded starting from the
+    biggest ones (using the `filesize` of the metadata) and they are yielded as soon as they are completed.
+    At most `workers` chunks are downloaded or waiting to be consumed at the same time, so the disk usage is
+    bounded too.
+    Parameters
+    ----------
+    server_url: str
+        data server url (without protocol)
+    files: List[Tuple[int, dict]]
+        list of (chunk index, metadata file entry) to download
+    save_folder: str
+        folder where the chunks are saved
+    protocol: str
+        protocol used for the http requests
+    workers: int
+        maximum number of concurrent downloads
+    fetch: Optional[Callable[..., Any]]
+        function called as `fetch(server_url, file, save_folder, protocol, progress)` for each chunk.
+        Default: `download_metadata_chunk`
+    Returns
+    -------
+    Iterator[Tuple[int, dict, Any]]
+        for each chunk downloaded the chunk index, its metadata file entry and the result of `fetch`
+        (the path where it has been saved with the default `fetch`)
+    """
+    fetch = fetch if fetch is not None else download_metadata_chunk
+    files = sorted(files, key=lambda item: item[1]['dataFile'].get('filesize', 0), reverse=True)
+    progress = DownloadProgress(sum([file['dataFile'].get('filesize', 0) for _, file in files]))
+    pending = iter(files)
+    running = {}
+
+    def submit_next(executor: ThreadPoolExecutor) -> bool:
+        next_item = next(pending, None)
+        if next_item is None:
+            return False
+        index, file = next_item
+        future = executor.submit(fetch, server_url, file, save_folder, protocol, progress)
+        running[future] = (index, file)
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers):
+            if not submit_next(executor):
+                break
+        while len(running) > 0:
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                index, file = running.pop(future)
+                progress.file_completed()
+                try:
+                    result = future.result()
+                except DownloadError as e:
+                    # the other chunks go on, the failed one is reported to the caller
+                    print(f'\nERROR | Download of chunk {index + 1} failed: {e}')
+                    if on_failed is None:
+                        raise
+                    on_failed(index, e)
+                else:
+                    yield index, file, result
+                submit_next(executor)
+    print()
 
 
 def download_base_stations(
-        geojson: dict,
+        grid: GridIndex,
         api_path: str,
         api_token: str,
         save_path: str,
         box_side: int = 5,
-        sleep_interval: float = 0
+        sleep_interval: float = 0,
+        max_results: int = DEFAULT_MAX_RESULTS,
+        workers: int = 1,
+        requests_per_second: Optional[float] = None,
+        requests_per_day: Optional[int] = None,
+        cache: Optional[ResultCache] = None,
+        quota_path: Optional[str] = None
 ):
+    """
+    Download the base stations covering the cells of the grid, of any shape. The area is tiled with an adaptive
+    quadtree (see `iterate_quadtree_boxes`): the boxes are at most `box_side` cells wide and high and a box is
+    split when the provider returns `max_results` base stations, while the areas without cells are never requested.
+    The boxes are requested by `workers` threads, within the `requests_per_second` and `requests_per_day` limits
+    (`sleep_interval`, if set, is converted in requests per second). The responses are saved in the `cache`, so
+    a download interrupted or repeated requests only the boxes missing from it. The requests of the day are
+    counted in `quota_path` (by default next to the cached responses, see `DailyQuota`). If any box fails
+    a DownloadError is raised and `save_path` is left as it is
+    """
+    if requests_per_second is None and sleep_interval > 0:
+        requests_per_second = 1 / sleep_interval
+    # the requests of the day are counted in a file, so the quota holds across the runs
+    if quota_path is None and cache is not None:
+        quota_path = os.path.join(cache.folder, DAILY_QUOTA_FILE)
+    rate_limiter = RateLimiter(requests_per_second, requests_per_day, quota_path=quota_path)
+    # the size of a cell is the median one, the cells of a grid have almost the same size
+    cell_width = float(np.median(grid.bboxes[:, 2] - grid.bboxes[:, 0]))
+    cell_height = float(np.median(grid.bboxes[:, 3] - grid.bboxes[:, 1]))
+    stats = {'boxes': 0, 'requests': 0, 'cached': 0}
+    failed_boxes = []
+    stats_lock = threading.Lock()
+
+    def load_box(box: Tuple[float, float, float, float]) -> Optional[List[dict]]:
+        min_lon, min_lat, max_lon, max_lat = box
+        bbox = f'bbox={min_lon},{min_lat},{max_lon},{max_lat}'
+        # the token is not part of the key, the responses do not depend on it
+        cache_key = get_cache_key(api_path, bbox) if cache is not None else None
+        loaded_bs = cache.get(cache_key) if cache is not None else None
+        from_cache = loaded_bs is not None
+        if not from_cache:
+            try:
+                loaded_bs = with_download_retries(_load_base_stations, api_path, api_token, bbox, rate_limiter)
+            except DownloadError as e:
+                print(f'\nERROR | {e}')
+                with stats_lock:
+                    failed_boxes.append(box)
+            # the failed requests are not cached, they are repeated by the next run
+            if loaded_bs is not None and cache is not None:
+                cache.put(cache_key, loaded_bs)
+        with stats_lock:
+            stats['boxes'] += 1
+            stats['cached' if from_cache else 'requests'] += 1
+            # the number of boxes is not known in advance
+            print_progress(f'INFO | Loading base stations from box: {stats["boxes"]} boxes'
+                           f' | {stats["requests"]} requests | {stats["cached"]} from cache')
+        return loaded_bs
+
     base_stations = []
     base_stations_map = {}
-    features = geojson['features']
-    grid_side_len = int((len(features))**(1/2))
-    count = 0
-    for i in range(0, grid_side_len, box_side):
-        for j in range(0, grid_side_len, box_side):
-            box_features = get_box_features(i, j, span=box_side, side_len=grid_side_len, features=features)
-            min_lon, min_lat, max_lon, max_lat = get_box_min_max_coordinates(box_features)
-            bbox = f'bbox={min_lon},{min_lat},{max_lon},{max_lat}'
-            full_url = f'{api_path}?{api_token}{bbox}'
-            loaded_bs = _load_base_stations(full_url)
+    with stage('download-bs', workers=workers) as download_stage:
+        boxes = iterate_quadtree_boxes(grid.bboxes, load_box, max_results,
+                                       max_box_size=(cell_width * box_side, cell_height * box_side), workers=workers)
+        for box, loaded_bs in boxes:
             if loaded_bs is not None:
                 for bs in loaded_bs:
                     cell_id = bs['properties']['cell']
                     if cell_id not in base_stations_map:
                         base_stations.append(bs)
                         base_stations_map[cell_id] = True
-            count += 1
-            print_status(count, box_side ** 2, 'Loading base stations from box')
-            time.sleep(sleep_interval)
-    print()
+        download_stage.add(rows=len(base_stations), boxes=stats['boxes'], requests=stats['requests'],
+                           cached=stats['cached'], failed_boxes=len(failed_boxes))
+    print(f'INFO | Loading base stations from box: {stats["boxes"]} boxes | {stats["requests"]} requests'
+          f' | {stats["cached"]} from cache')
     print(f'Loaded {len(base_stations)} base stations')
+    if len(failed_boxes) > 0:
+        # an incomplete download does not replace the base stations already saved
+        raise DownloadError(api_path, f'{len(failed_boxes)} boxes failed, {save_path} is not saved'
+                            + ('. The other boxes are cached, running the download again requests only the failed '
+                               'ones' if cache is not None else ''))
     base_stations_geojson = {
         'type': 'FeatureCollection',
         'features': base_stations
     }
-    with open(os.path.join(ROOT_DIR, save_path), 'w') as f:
-        json.dump(base_stations_geojson, f)
+    with stage('write', file=os.path.basename(save_path)) as write_stage:
+        path = os.path.join(ROOT_DIR, save_path)
+        # write and rename, an interrupted write does not leave a truncated geojson
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(base_stations_geojson, f)
+        os.replace(tmp_path, path)
+        write_stage.add(rows=len(base_stations), bytes_out=os.path.getsize(path))
 
 
-def _load_base_stations(url: str) -> dict:
-    r = requests.get(url)
-    if r.status_code == 200:
+def _load_base_stations(api_path: str, api_token: str, bbox: str, rate_limiter: RateLimiter) -> List[dict]:
+    rate_limiter.acquire()
+    # the errors report the url without the token
+    url = f'{api_path}?{bbox}'
+    try:
+        # the 429 and 5xx responses are retried by with_download_retries, acquiring a new token for each attempt
+        r = http_get(f'{api_path}?{api_token}{bbox}', status_retries=False)
+    except DownloadError as e:
+        # the message of the request error contains the full url
+        raise DownloadError(url, f'Request failed: {type(e.__cause__).__name__}', retryable=e.retryable) from None
+    check_response(r, url)
+    try:
         base_stations = r.json()
-        if 'status' in base_stations and base_stations['status'] == 'error':
-            print(f'ERROR | url: {url} | message: {base_stations["message"]}')
-        else:
-            return base_stations['features']
-    else:
-        print(f'ERROR | Error while downloading using url: {url}')
+    except ValueError as e:
+        raise DownloadError(url, f'Invalid response of the provider: {e!r}', retryable=True) from e
+    if 'status' in base_stations and base_stations['status'] == 'error':
+        raise DownloadError(url, f'Error of the provider: {base_stations["message"]}')
+    return base_stations['features']
@@ -0,0 +1,127 @@
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from dataset.utils import create_directory_from_filepath
+
+# file of the requests sent in the current UTC day, in the folder of the responses cache
+DAILY_QUOTA_FILE = 'requests-per-day.json'
+
+
+class TokenBucket:
+    """
+    Token bucket of `capacity` tokens refilled at `rate` tokens per second, it is not thread safe
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def wait_time(self) -> float:
+        """
+        Seconds to wait before a token is available, 0 if a token is available now
+        """
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+def get_utc_date() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+class DailyQuota:
+    """
+    Quota of `limit` requests for each UTC day. With `path` the requests are counted in a json file, so the quota
+    is shared by the following runs (and by the runs started in the meantime), otherwise it is counted only by
+    this run. It is not thread safe
+    """
+
+    def __init__(self, limit: int, path: Optional[str] = None):
+        self.limit = limit
+        self.path = path
+        self.date = get_utc_date()
+        self.requests = 0
+
+    def load(self):
+        date = get_utc_date()
+        if self.path is not None:
+            try:
+                with open(self.path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            self.requests = state.get('requests', 0) if state.get('date') == date else 0
+        elif date != self.date:
+            self.requests = 0
+        self.date = date
+
+    def save(self):
+        if self.path is None:
+            return
+        create_directory_from_filepath(self.path)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'date': self.date, 'requests': self.requests}, f)
+        os.replace(tmp_path, self.path)
+
+    def wait_time(self) -> float:
+        """
+        Seconds to wait before a request is allowed, 0 if it is allowed now. The quota is reset at UTC midnight
+        """
+        self.load()
+        if self.requests < self.limit:
+            return 0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(),
+                                             tzinfo=datetime.timezone.utc)
+        return (midnight - now).total_seconds()
+
+    def take(self):
+        self.load()
+        self.requests += 1
+        self.save()
+
+
+class RateLimiter:
+    """
+    Thread safe rate limiter of the requests sent to a provider, with a token bucket for the requests per second
+    (bursts of at most `burst` requests) and a daily quota, saved in `quota_path` if given (see `DailyQuota`).
+    `acquire` blocks until both allow a new request. A limit set to None is not enforced
+    """
+
+    def __init__(self, requests_per_second: Optional[float] = None, requests_per_day: Optional[int] = None,
+                 burst: int = 1, quota_path: Optional[str] = None):
+        self.buckets = []
+        if requests_per_second is not None and requests_per_second > 0:
+            self.buckets.append(TokenBucket(requests_per_second, max(burst, 1)))
+        if requests_per_day is not None and requests_per_day > 0:
+            self.buckets.append(DailyQuota(requests_per_day, quota_path))
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            while True:
+                wait_time = max([bucket.wait_time() for bucket in self.buckets], default=0)
+                if wait_time == 0:
+                    break
+                if wait_time > 60:
+                    print(f'\nWARNING | Requests quota reached, waiting {wait_time / 60:.1f} minutes')
+                # the lock is kept, the other threads wait their turn
+                time.sleep(wait_time)
+            for bucket in self.buckets:
+                bucket.take()
@@ -1,6 +1,6 @@
 import os
 
-from dataset.downloader.http_download import download_dataset_chunk
+from dataset.downloader.http_download import download_metadata_chunk, download_dataset_chunks
 from dataset.utils import load_json_file
 
 
@@ -11,20 +11,24 @@ def download_dataset(args):
     chunks_to_skip = args.skip
     server_url = args.server_url
     protocol = args.protocol
+    download_workers = args.download_workers
     print(f'INFO | Metadata path is: {metadata_path}')
     print(f'INFO | Saving path is: {save_folder}')
     print(f'INFO | Chunks to skip: {chunks_to_skip} | '
-          f'Chunks to download is: {chunks_to_load} | server_url: {server_url} | protocol: {protocol}')
+          f'Chunks to download is: {chunks_to_load} | server_url: {server_url} | protocol: {protocol} '
+          f'| download workers: {download_workers}')
     if os.path.exists(metadata_path):
         metadata = load_json_file(metadata_path)
         files = metadata['datasetVersion']['files']
         n = chunks_to_load if chunks_to_load != -1 else len(files)
         print(f'INFO | Found {len(files)} dataset chunks, going to load {n - chunks_to_skip} chunks')
-        for i in range(chunks_to_skip, n):
-            file = files[i]
-            persistentId = file['dataFile']['persistentId']
-            filename = file['dataFile']['filename']
-            download_dataset_chunk(server_url, persistentId, save_folder, filename, protocol=protocol)
+        if download_workers > 1:
+            chunks = [(i, files[i]) for i in range(chunks_to_skip, n)]
+            for _ in download_dataset_chunks(server_url, chunks, save_folder, protocol, workers=download_workers):
+                pass
+        else:
+            for i in range(chunks_to_skip, n):
+                download_metadata_chunk(server_url, files[i], save_folder, protocol=protocol)
         print(f'INFO | All the {n} chunks have been downloaded in {save_folder}')
     else:
         print(f'ERROR | Metadata path not exist: "{metadata_path}"')
@@ -1,13 +1,55 @@
-from math import radians, cos, sin, asin, sqrt
-from typing import List, Tuple
+import math
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Tuple, Iterator, Callable, Optional
 
+import numpy as np
 import pandas as pd
 
+# Radius of earth in kilometers. Use 3956 for miles. Determines return value units.
+EARTH_RADIUS = 6371
+# maximum number of (point, cell) pairs computed at once by the array kernels, it bounds the memory used
+# (about 8 bytes for each pair and temporary array)
+DEFAULT_MAX_PAIRS = 1024 * 1024 * 4
+# maximum number of times a box of the quadtree tiling is split
+DEFAULT_MAX_DEPTH = 20
+
 
 def is_point_in_cell(cell: dict, point: Tuple[float, float]) -> float:
-    min_lng, min_lat, max_lng, max_lat = get_box_min_max_coordinates([cell])
-    point_lng, point_lat = point
-    return min_lng <= point_lng <= max_lng and min_lat <= point_lat <= max_lat
+    return is_point_in_box(get_box_min_max_coordinates([cell]), point)
+
+
+def is_point_in_box(box: Tuple[float, float, float, float], point: Tuple[float, float]) -> bool:
+    return bool(points_in_boxes(np.array([point], dtype=np.float64), np.array([box], dtype=np.float64))[0, 0])
+
+
+def points_in_boxes(
+        points: np.ndarray,
+        boxes: np.ndarray,
+        max_pairs: int = DEFAULT_MAX_PAIRS
+) -> np.ndarray:
+    """
+    Bounding box containment (borders included) between N points and M boxes
+    Parameters
+    ----------
+    points: np.ndarray
+        (N, 2) array of lng, lat
+    boxes: np.ndarray
+        (M, 4) array of min_lng, min_lat, max_lng, max_lat
+    max_pairs: int
+        maximum number of pairs computed at once, the points are processed in chunks
+    Returns
+    -------
+    np.ndarray
+        (N, M) boolean array, True if the point is inside the box
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    result = np.empty((len(points), len(boxes)), dtype=bool)
+    for start, end in iter_chunks(len(points), len(boxes), max_pairs):
+        lng = points[start:end, 0:1]
+        lat = points[start:end, 1:2]
+        result[start:end] = (boxes[:, 0] <= lng) & (lng <= boxes[:, 2]) & (boxes[:, 1] <= lat) & (lat <= boxes[:, 3])
+    return result
 
 
 def get_box_features(row: int, col: int, span: int, side_len: int, features: List[dict]) -> List[dict]:
@@ -21,6 +63,108 @@ def get_box_features(row: int, col: int, span: int, side_len: int, features: Lis
     return box_features
 
 
+def iterate_quadtree_boxes(
+        cell_bboxes: np.ndarray,
+        fetch: Callable[[Tuple[float, float, float, float]], Optional[list]],
+        max_results: int,
+        max_box_size: Tuple[float, float],
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        workers: int = 1
+) -> Iterator[Tuple[Tuple[float, float, float, float], Optional[list]]]:
+    """
+    Cover the cells with the fewest boxes passed to `fetch`, with an adaptive quadtree: the bounding box of all the
+    cells is divided in the fewest equal boxes not larger than `max_box_size`, then a box is split in four when
+    `fetch` returns `max_results` items (the provider may have truncated them). Boxes without cells are skipped,
+    so the irregular shapes of the grid are not requested
+    Parameters
+    ----------
+    cell_bboxes: np.ndarray
+        (M, 4) array of min_lng, min_lat, max_lng, max_lat of the cells
+    fetch: Callable[[Tuple[float, float, float, float]], Optional[list]]
+        function called with each box, returning the items found in it or None if the request failed
+    max_results: int
+        maximum number of items returned by `fetch`
+    max_box_size: Tuple[float, float]
+        maximum width and height of a box, in degrees
+    max_depth: int
+        maximum number of splits of a box, a box at the limit is not split anymore
+    workers: int
+        number of threads calling `fetch` concurrently. With more than one worker the results are yielded
+        once all the boxes are completed, in the same order of the serial run
+    Returns
+    -------
+    Iterator[Tuple[Tuple[float, float, float, float], Optional[list]]]
+        every box passed to `fetch` with its result, including the boxes that are split afterwards
+    """
+    cell_bboxes = np.asarray(cell_bboxes, dtype=np.float64).reshape(-1, 4)
+    if len(cell_bboxes) == 0:
+        return
+    min_lng, min_lat = float(cell_bboxes[:, 0].min()), float(cell_bboxes[:, 1].min())
+    max_lng, max_lat = float(cell_bboxes[:, 2].max()), float(cell_bboxes[:, 3].max())
+    # the first boxes are the fewest boxes of equal size, not larger than max_box_size, covering all the cells
+    # (the tolerance avoids an additional row or column of boxes for the rounding errors)
+    n_cols = max(1, math.ceil((max_lng - min_lng) / max_box_size[0] - 1e-9))
+    n_rows = max(1, math.ceil((max_lat - min_lat) / max_box_size[1] - 1e-9))
+    lng_edges = np.linspace(min_lng, max_lng, n_cols + 1).tolist()
+    lat_edges = np.linspace(min_lat, max_lat, n_rows + 1).tolist()
+    # each box is identified by its path in the quadtree, sorting the paths gives the order of the serial run
+    roots = [((lng_edges[j], lat_edges[i], lng_edges[j + 1], lat_edges[i + 1]), (i * n_cols + j,))
+             for i in range(n_rows) for j in range(n_cols)]
+
+    def has_cells(box: Tuple[float, float, float, float]) -> bool:
+        # boxes touching a cell only on its border are skipped, the neighbour boxes cover that cell
+        return bool(((cell_bboxes[:, 0] < box[2]) & (cell_bboxes[:, 2] > box[0]) &
+                     (cell_bboxes[:, 1] < box[3]) & (cell_bboxes[:, 3] > box[1])).any())
+
+    def get_children(box: Tuple[float, float, float, float], path: tuple, result: Optional[list]) -> list:
+        if result is None or len(result) < max_results:
+            return []
+        if len(path) > max_depth:
+            print(f'WARNING | The box {box} returned {len(result)} results, but it cannot be split anymore')
+            return []
+        return [(child, path + (k,)) for k, child in enumerate(split_box(box))]
+
+    if workers <= 1:
+        stack = list(reversed(roots))
+        while len(stack) > 0:
+            box, path = stack.pop()
+            if not has_cells(box):
+                continue
+            result = fetch(box)
+            yield box, result
+            stack.extend(reversed(get_children(box, path, result)))
+        return
+    completed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {executor.submit(fetch, box): (box, path) for box, path in roots if has_cells(box)}
+        while len(running) > 0:
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                box, path = running.pop(future)
+                result = future.result()
+                completed.append((path, box, result))
+                for child, child_path in get_children(box, path, result):
+                    if has_cells(child):
+                        running[executor.submit(fetch, child)] = (child, child_path)
+    for _, box, result in sorted(completed, key=lambda item: item[0]):
+        yield box, result
+
+
+def split_box(box: Tuple[float, float, float, float]) -> List[Tuple[float, float, float, float]]:
+    """
+    The four quadrants of a box, sorted by row (from the south) and by column
+    """
+    min_lng, min_lat, max_lng, max_lat = box
+    mid_lng = (min_lng + max_lng) / 2
+    mid_lat = (min_lat + max_lat) / 2
+    return [
+        (min_lng, min_lat, mid_lng, mid_lat),
+        (mid_lng, min_lat, max_lng, mid_lat),
+        (min_lng, mid_lat, mid_lng, max_lat),
+        (mid_lng, mid_lat, max_lng, max_lat),
+    ]
+
+
 def get_box_min_max_coordinates(box_features: List[dict]) -> Tuple[float, float, float, float]:
     columns = ['lon', 'lat']
     data = []
@@ -56,16 +200,52 @@ def haversine_distance(a: Tuple[float, float], b: Tuple[float, float]) -> float:
     Calculate the great circle distance in kilometers between two points
     on the earth (specified in decimal degrees)
     """
-    # convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(radians, [a[0], a[1], b[0], b[1]])
-
-    # haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371  # Radius of earth in kilometers. Use 3956 for miles. Determines return value units.
-    return c * r
+    return float(haversine_distances(np.array([a], dtype=np.float64), np.array([b], dtype=np.float64))[0, 0])
+
+
+def haversine_distances(
+        a: np.ndarray,
+        b: np.ndarray,
+        radius: float = EARTH_RADIUS,
+        max_pairs: int = DEFAULT_MAX_PAIRS
+) -> np.ndarray:
+    """
+    Great circle distances between N points and M points (in decimal degrees), in the unit of `radius`
+    Parameters
+    ----------
+    a: np.ndarray
+        (N, 2) array of lng, lat
+    b: np.ndarray
+        (M, 2) array of lng, lat
+    radius: float
+        radius of the sphere, by default the earth radius in kilometers
+    max_pairs: int
+        maximum number of pairs computed at once, the points of `a` are processed in chunks
+    Returns
+    -------
+    np.ndarray
+        (N, M) array of distances
+    """
+    a = np.radians(np.asarray(a, dtype=np.float64).reshape(-1, 2))
+    b = np.radians(np.asarray(b, dtype=np.float64).reshape(-1, 2))
+    result = np.empty((len(a), len(b)), dtype=np.float64)
+    cos_lat_b = np.cos(b[:, 1])
+    for start, end in iter_chunks(len(a), len(b), max_pairs):
+        lng = a[start:end, 0:1]
+        lat = a[start:end, 1:2]
+        # haversine formula
+        h = np.sin((b[:, 1] - lat) / 2) ** 2 + np.cos(lat) * cos_lat_b * np.sin((b[:, 0] - lng) / 2) ** 2
+        result[start:end] = 2 * np.arcsin(np.sqrt(np.minimum(h, 1))) * radius
+    return result
+
+
+def iter_chunks(n: int, m: int, max_pairs: int = DEFAULT_MAX_PAIRS) -> Iterator[Tuple[int, int]]:
+    """
+    Split n rows in chunks of at most `max_pairs` // m rows (at least one row), yielding their start and end
+    """
+    step = max(1, max_pairs // max(m, 1))
+    for start in range(0, n, step):
+        yield start, min(start + step, n)
 
 
 def get_feature_lng_and_lat(feature: dict) -> Tuple[float, float]:
@@ -0,0 +1,139 @@
+import os
+from collections import Counter
+from typing import Tuple
+
+import numpy as np
+
+from dataset.cache import CACHE_FOLDER
+from dataset.utils import ROOT_DIR, load_json_file, file_checksum, create_directory
+
+# version of the cached arrays, to increase when they change
+CACHE_VERSION = 1
+
+
+class GridIndex:
+    """
+    Compact geometry of a grid of cells, extracted once from the grid geojson into contiguous arrays:
+
+    - `cell_ids`: (M,) cellId of each cell, in the order of the geojson
+    - `centers`: (M, 2) lng, lat of the cell center (the mean of the polygon vertices)
+    - `bboxes`: (M, 4) min_lng, min_lat, max_lng, max_lat of the cell
+    - `rows`, `cols`: (M,) position of the cell in the grid, cellIds are numbered by row starting from 1
+    - `vertices`: (M, V, 2) polygon of the cell, used for rebuilding the geojson for the plots
+
+    The arrays are cached in `.cache/grid-<md5 of the geojson>-v<CACHE_VERSION>.npz`, so the geojson is parsed
+    only the first time
+    """
+
+    ARRAYS = ['cell_ids', 'centers', 'bboxes', 'rows', 'cols', 'vertices', 'feature_ids']
+
+    def __init__(
+            self,
+            cell_ids: np.ndarray,
+            centers: np.ndarray,
+            bboxes: np.ndarray,
+            rows: np.ndarray,
+            cols: np.ndarray,
+            vertices: np.ndarray,
+            feature_ids: np.ndarray
+    ):
+        self.cell_ids = cell_ids
+        self.centers = centers
+        self.bboxes = bboxes
+        self.rows = rows
+        self.cols = cols
+        self.vertices = vertices
+        # the `id` of the geojson features, -1 if not present
+        self.feature_ids = feature_ids
+        self.n_rows = int(rows.max()) + 1 if len(rows) > 0 else 0
+        self.n_cols = int(cols.max()) + 1 if len(cols) > 0 else 0
+        self._positions = None
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    @classmethod
+    def from_geojson(cls, geojson_path: str, use_cache: bool = True) -> 'GridIndex':
+        geojson_path = os.path.join(ROOT_DIR, geojson_path)
+        cache_path = None
+        if use_cache:
+            cache_path = os.path.join(CACHE_FOLDER, f'grid-{file_checksum(geojson_path)}-v{CACHE_VERSION}.npz')
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as data:
+                    return cls(**{name: data[name] for name in cls.ARRAYS})
+        grid = cls.from_features(load_json_file(geojson_path)['features'])
+        if cache_path is not None:
+            grid.save(cache_path)
+        return grid
+
+    @classmethod
+    def from_features(cls, features: list) -> 'GridIndex':
+        cell_ids = np.array([feature['properties']['cellId'] for feature in features], dtype=np.int64)
+        vertices = np.array([feature['geometry']['coordinates'][0] for feature in features], dtype=np.float64)
+        vertices = vertices.reshape(len(features), -1, 2)
+        feature_ids = np.array([feature.get('id', -1) for feature in features], dtype=np.int64)
+        # the center is the mean of all the vertices, the closing one included
+        centers = vertices.mean(axis=1)
+        bboxes = np.concatenate([vertices.min(axis=1), vertices.max(axis=1)], axis=1)
+        n_cols = get_grid_n_cols(cell_ids, centers, vertices)
+        rows = ((cell_ids - 1) // n_cols).astype(np.int32)
+        cols = ((cell_ids - 1) % n_cols).astype(np.int32)
+        return cls(cell_ids, centers, bboxes, rows, cols, vertices, feature_ids)
+
+    def save(self, path: str):
+        create_directory(os.path.dirname(path))
+        # write and rename, so a concurrent run never reads a truncated cache
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(tmp_path, **{name: getattr(self, name) for name in self.ARRAYS})
+        os.replace(tmp_path, path)
+
+    def get_position(self, cell_id: int) -> int:
+        """
+        Position of a cell in the arrays
+        """
+        if self._positions is None:
+            self._positions = {cell_id: i for i, cell_id in enumerate(self.cell_ids.tolist())}
+        return self._positions[cell_id]
+
+    def get_center(self, position: int) -> Tuple[float, float]:
+        return float(self.centers[position, 0]), float(self.centers[position, 1])
+
+    def get_bbox(self, position: int) -> Tuple[float, float, float, float]:
+        return tuple(float(value) for value in self.bboxes[position])
+
+    def to_geojson(self) -> dict:
+        """
+        Rebuild the grid geojson (cellId property and polygon of each cell), e.g. for the plots
+        """
+        features = []
+        for i in range(len(self)):
+            feature = {
+                'type': 'Feature',
+                'properties': {'cellId': int(self.cell_ids[i])},
+                'geometry': {'type': 'Polygon', 'coordinates': [self.vertices[i].tolist()]}
+            }
+            if self.feature_ids[i] != -1:
+                feature['id'] = int(self.feature_ids[i])
+            features.append(feature)
+        return {'type': 'FeatureCollection', 'features': features}
+
+
+def get_grid_n_cols(cell_ids: np.ndarray, centers: np.ndarray, vertices: np.ndarray, samples: int = 64) -> int:
+    """
+    Number of columns of a grid whose cellIds are numbered by row. For a sample of cells, it looks for the cells
+    adjacent along the polygon edges: the most common cellId difference, other than 1, is the length of a row.
+    If no adjacent cell is found the grid is assumed to be square
+    """
+    differences = Counter()
+    for k in np.linspace(0, len(cell_ids) - 1, min(samples, len(cell_ids))).astype(np.int64):
+        for edge in [vertices[k, 1] - vertices[k, 0], vertices[k, -2] - vertices[k, 0]]:
+            edge_len = np.linalg.norm(edge)
+            for direction in [1, -1]:
+                distances = np.linalg.norm(centers - (centers[k] + direction * edge), axis=1)
+                j = int(distances.argmin())
+                if j != k and distances[j] < edge_len / 4:
+                    differences[abs(int(cell_ids[j] - cell_ids[k]))] += 1
+    differences.pop(1, None)
+    if len(differences) == 0:
+        return max(int(len(cell_ids) ** (1 / 2)), 1)
+    return differences.most_common(1)[0][0]
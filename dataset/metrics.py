@@ -0,0 +1,197 @@
+"""
+Metrics of the pipeline stages. A stage is timed with the `stage` context manager, which records its wall and
+CPU time, the resident memory and the counters added to it (rows, bytes_in, bytes_out, ...):
+
+    with stage('parse', chunk=filename) as s:
+        df = read_dataset_chunk(path)
+        s.add(rows=len(df), bytes_in=os.path.getsize(path))
+
+When a run is started with `start_run`, each stage is appended as a json line to the metrics file of the run, and
+`end_run` adds a summary line for each stage name. The file is shared with the processes started by the run
+(its path is in the METRICS_FILE_ENV environment variable), their stages have their own pid.
+Without a run the stages are timed but not saved.
+"""
+import datetime
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+
+from dataset.utils import create_directory_from_filepath, format_bytes
+
+METRICS_FILE_ENV = 'DATASET_METRICS_FILE'
+METRICS_RUN_ENV = 'DATASET_METRICS_RUN'
+METRICS_FOLDER = 'stats'
+
+_write_lock = threading.Lock()
+
+
+def get_metrics_path(output_folder: str, module: str) -> str:
+    # <output folder>/stats/<module>-<local date and time>.jsonl
+    now = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    return os.path.join(output_folder, METRICS_FOLDER, f'{module}-{now}.jsonl')
+
+
+def get_metrics_file() -> Optional[str]:
+    return os.environ.get(METRICS_FILE_ENV)
+
+
+def get_rss() -> Optional[int]:
+    # current resident memory of the process in bytes, None if not available (only on Linux)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_max_rss(who: int = resource.RUSAGE_SELF) -> int:
+    # peak resident memory of the process in bytes (ru_maxrss is in KB on Linux and in bytes on macOS)
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def write_record(record: Dict[str, Any]):
+    """
+    Append a json line to the metrics file of the run, if a run is started
+    """
+    path = get_metrics_file()
+    if path is None:
+        return
+    line = json.dumps(record, default=str) + '\n'
+    # a single write of the whole line in append mode, the lines of concurrent processes are not mixed
+    with _write_lock:
+        with open(path, 'a') as f:
+            f.write(line)
+
+
+class Stage:
+    """
+    Measure of a stage, see `stage`. `cpu_seconds` is the CPU time of the thread running the stage, the work done
+    by other threads or processes is recorded by their own stages
+    """
+
+    def __init__(self, name: str, **labels):
+        self.name = name
+        self.labels = labels
+        self.counters: Dict[str, float] = OrderedDict(rows=0, bytes_in=0, bytes_out=0)
+        self.status = 'ok'
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self._start = None
+        self._start_cpu = None
+        self._started_at = None
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def __enter__(self) -> 'Stage':
+        self._started_at = datetime.datetime.now().isoformat(timespec='milliseconds')
+        self._start_cpu = time.thread_time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_seconds = time.perf_counter() - self._start
+        self.cpu_seconds = time.thread_time() - self._start_cpu
+        if exc_type is not None:
+            self.status = 'error'
+        rss = get_rss()
+        peak_rss = get_max_rss()
+        write_record({
+            'type': 'stage',
+            'run': os.environ.get(METRICS_RUN_ENV),
+            'stage': self.name,
+            **self.labels,
+            'status': self.status,
+            'started_at': self._started_at,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            **self.counters,
+            'rss_mb': rss / 1024 / 1024 if rss is not None else None,
+            # peak of the process since its start, not of the stage alone: the stages of the threads overlap, so
+            # the peak cannot be reset for each of them as in the benchmarks
+            'process_peak_rss_mb': max(peak_rss, rss or 0) / 1024 / 1024,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+        })
+        # the errors are not handled here
+        return False
+
+
+def stage(name: str, **labels) -> Stage:
+    """
+    Context manager measuring a stage. The labels (e.g. the chunk) are saved in its record, the counters
+    are added with `Stage.add`
+    """
+    return Stage(name, **labels)
+
+
+def start_run(path: str, module: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Start saving the stages in the json lines file at `path`, with a first line describing the run. It returns
+    the id of the run
+    """
+    run_id = uuid.uuid4().hex[:12]
+    create_directory_from_filepath(path)
+    # in the environment, so the processes started by the run save their stages in the same file
+    os.environ[METRICS_FILE_ENV] = path
+    os.environ[METRICS_RUN_ENV] = run_id
+    write_record({
+        'type': 'run',
+        'run': run_id,
+        'module': module,
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'params': params or {},
+        'pid': os.getpid(),
+        'cpus': os.cpu_count(),
+    })
+    print(f'INFO | Saving the stats of the run in {path}')
+    return run_id
+
+
+def summarize_stages(path: str, run_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Totals of the stages with the same name in a metrics file, in the order of their first record
+    """
+    summary = OrderedDict()
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get('type') != 'stage' or (run_id is not None and record.get('run') != run_id):
+                continue
+            totals = summary.setdefault(record['stage'], OrderedDict(
+                type='summary', run=record.get('run'), stage=record['stage'], count=0, errors=0, wall_seconds=0,
+                cpu_seconds=0, rows=0, bytes_in=0, bytes_out=0, max_process_peak_rss_mb=0))
+            totals['count'] += 1
+            totals['errors'] += record['status'] != 'ok'
+            for key in ['wall_seconds', 'cpu_seconds', 'rows', 'bytes_in', 'bytes_out']:
+                totals[key] += record.get(key, 0)
+            totals['max_process_peak_rss_mb'] = max(totals['max_process_peak_rss_mb'], record['process_peak_rss_mb'])
+    return list(summary.values())
+
+
+def end_run():
+    """
+    Append the summary of the stages to the metrics file of the run, print it and stop saving the stages
+    """
+    path = get_metrics_file()
+    if path is None:
+        return
+    summary = summarize_stages(path, os.environ.get(METRICS_RUN_ENV))
+    print('INFO | Stages of the run:')
+    for totals in summary:
+        write_record(totals)
+        print(f'INFO | {totals["stage"]:<16} | count: {totals["count"]} | wall: {totals["wall_seconds"]:.2f} s'
+              f' | cpu: {totals["cpu_seconds"]:.2f} s | rows: {totals["rows"]}'
+              f' | in: {format_bytes(totals["bytes_in"])} | out: {format_bytes(totals["bytes_out"])}'
+              f' | process peak RSS: {totals["max_process_peak_rss_mb"]:.1f} MB'
+              + (f' | errors: {totals["errors"]}' if totals['errors'] > 0 else ''))
+    del os.environ[METRICS_FILE_ENV]
+    del os.environ[METRICS_RUN_ENV]
@@ -1,16 +1,49 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Iterator
 from urllib.parse import quote_plus
 
 from dotenv import load_dotenv
-from pymongo import MongoClient, GEOSPHERE, TEXT
-from pymongo.errors import (PyMongoError, BulkWriteError)
+from pymongo import MongoClient, GEOSPHERE, ASCENDING, ReplaceOne
+from pymongo.errors import BulkWriteError
 
-from dataset.utils import ROOT_DIR, load_json_file
+from dataset.utils import ROOT_DIR, iter_geojson_features
 
 load_dotenv(dotenv_path=os.path.join(ROOT_DIR, '.env'))
 
+# maximum number of connections of the shared client, it bounds the concurrent queries sent to the server
+DEFAULT_POOL_SIZE = 100
+# features written with a single bulk_write by upload_geojson
+DEFAULT_BATCH_SIZE = 1000
+
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    MongoClient shared by the whole process. The client is thread safe and keeps a pool of connections, whose size
+    can be set with the MONGO_POOL_SIZE environment variable
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            pool_size = int(os.getenv('MONGO_POOL_SIZE') or DEFAULT_POOL_SIZE)
+            _client = MongoClient(get_connection_uri(), maxPoolSize=pool_size)
+        return _client
+
+
+def reset_client():
+    """
+    Forget the shared client, e.g. in a forked process where the client of the parent cannot be used,
+    the next get_client() creates a new one
+    """
+    global _client
+    with _client_lock:
+        _client = None
+
 
 def get_connection_uri(mongo_password=None):
     host = os.getenv('MONGO_HOST')
@@ -41,41 +74,90 @@ def upload_geojson(
         geojson_path: str,
         to_collection: str,
         geosphere_index_name: str = 'geometry',
-        additional_indexes: List[Tuple[str, str]] = None
+        additional_indexes: List[Tuple[str, str]] = None,
+        key: str = 'properties.cell',
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = 1
 ):
-    geojson = load_json_file(geojson_path)
-    client = MongoClient(get_connection_uri())
+    """
+    Upload the features of a geojson on a collection. The features are parsed one by one and written in batches
+    of `batch_size` features, from `workers` threads, so the memory used does not depend on the size of the file.
+    Each feature replaces the document with the same `key`, so uploading the same file again does not create
+    duplicates. The 2dsphere index and the `additional_indexes` are built once all the features are loaded
+    """
     to_db = os.getenv('MONGO_DB')
-    db = client[to_db]
-    collection = db[to_collection]
+    collection = get_client()[to_db][to_collection]
+    # the upserts look up the documents by key, its index is needed during the load
+    collection.create_index([(key, ASCENDING)])
+
+    stats = {'upserted': 0, 'matched': 0, 'errors': 0}
+    stats_lock = threading.Lock()
+
+    def write_batch(batch: List[dict]):
+        operations = [ReplaceOne({key: get_feature_key(feature, key)}, feature, upsert=True) for feature in batch]
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as bwe:
+            details = bwe.details
+            print_bulk_write_errors(details)
+        with stats_lock:
+            stats['upserted'] += details['nUpserted']
+            stats['matched'] += details['nMatched']
+            stats['errors'] += len(details['writeErrors'])
+
+    batches = iter_feature_batches(geojson_path, batch_size)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = set()
+            for batch in batches:
+                # at most two batches for worker are parsed and waiting, so the memory stays bounded
+                if len(running) >= workers * 2:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                running.add(executor.submit(write_batch, batch))
+            for future in running:
+                future.result()
+    else:
+        for batch in batches:
+            write_batch(batch)
+    print(f"Number of Features successfully inserted: {stats['upserted']} | already present: {stats['matched']}"
+          f" | errors: {stats['errors']}")
 
-    # create 2dsphere index and initialize unordered bulk insert
     collection.create_index([(geosphere_index_name, GEOSPHERE)])
-    for index in additional_indexes:
+    for index in additional_indexes if additional_indexes is not None else []:
         collection.create_index([index])
-    bulk = collection.initialize_unordered_bulk_op()
 
-    for feature in geojson['features']:
+
+def iter_feature_batches(geojson_path: str, batch_size: int) -> Iterator[List[dict]]:
+    batch = []
+    for feature in iter_geojson_features(geojson_path):
         # Note: comment out next two lines if input file does not contain timestamp field having proper format
         created = feature['properties']['created']
         feature['properties']['created'] = datetime.fromtimestamp(created)
         updated = feature['properties']['updated']
         feature['properties']['updated'] = datetime.fromtimestamp(updated)
+        batch.append(feature)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def get_feature_key(feature: dict, key: str):
+    value = feature
+    for field in key.split('.'):
+        value = value[field]
+    return value
+
 
-        # append to bulk insert list
-        bulk.insert(feature)
-
-    # execute bulk operation to the DB
-    try:
-        result = bulk.execute()
-        print(f"Number of Features successfully inserted: {result['nInserted']}")
-    except BulkWriteError as bwe:
-        nInserted = bwe.details["nInserted"]
-        errMsg = bwe.details["writeErrors"]
-        print("Errors encountered inserting features")
-        print(f"Number of Features successully inserted: {nInserted}")
-        print("The following errors were found:")
-        for item in errMsg:
-            print(f"Index of feature: {item['index']}")
-            print(f"Error code: {item['code']}")
-            print(f"Message (truncated due to data length): {item['errmsg'][0:120]}...")
+def print_bulk_write_errors(details: dict):
+    errors = details["writeErrors"]
+    print("Errors encountered inserting features")
+    print("The following errors were found:")
+    for item in errors:
+        print(f"Index of feature: {item['index']}")
+        print(f"Error code: {item['code']}")
+        print(f"Message (truncated due to data length): {item['errmsg'][0:120]}...")
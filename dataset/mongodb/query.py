@@ -1,16 +1,24 @@
 import os
 from typing import Optional, Tuple, Dict, Any
 
-from pymongo import MongoClient
 from pymongo.cursor import Cursor
 
-from dataset.mongodb.geojson_uploader import get_connection_uri
+from dataset.mongodb.geojson_uploader import get_client
+
+# fields of the base stations read by the bs pipeline
+BS_PROJECTION = {
+    '_id': 0,
+    'geometry': 1,
+    'properties.cell': 1,
+    'properties.radio': 1,
+    'properties.range': 1,
+    'properties.created': 1,
+}
 
 
 def get_db():
-    client = MongoClient(get_connection_uri())
     to_db = os.getenv('MONGO_DB')
-    return client[to_db]
+    return get_client()[to_db]
 
 
 def get_bs_in_range(
@@ -18,7 +26,8 @@ def get_bs_in_range(
         center: Tuple[float, float],
         max_distance: float,
         filters: Optional[Dict[str, Any]] = None,
-        db=None
+        db=None,
+        projection: Optional[Dict[str, int]] = None
 ) -> Cursor:
     db = db if db is not None else get_db()
     collection = db[from_collection]
@@ -33,4 +42,4 @@ def get_bs_in_range(
                 '$maxDistance': max_distance
             }
     }
-    return collection.find(query)
+    return collection.find(query, projection)
@@ -1,18 +1,15 @@
-import os
-import json
-
 import numpy as np
 import pandas as pd
 
+from dataset.grid_index import GridIndex
 from dataset.plots.map_plots import plot_grid, plot_map_scatter, plot_grid_with_scatter, \
     plot_grid_with_scatter_aggregated
 from dataset.preprocessing.dataframe import geojson_base_stations_to_df
-from dataset.utils import ROOT_DIR
 
 
 def plot_empty_grid_on_map(geojson_path: str, empty_grid_path: str, center, zoom=11.4, save_path=None, title=None):
-    with open(os.path.join(ROOT_DIR, geojson_path), 'r') as f:
-        geojson = json.load(f)
+    # only the cellId and the polygon of the cells are needed, rebuilt from the cached grid index
+    geojson = GridIndex.from_geojson(geojson_path).to_geojson()
 
     df = pd.read_csv(empty_grid_path)
 
@@ -32,8 +29,8 @@ def plot_base_stations_with_grid(
         bs_geojson_path: str,
         center, zoom=11.4, save_path=None, title=None, filter_type=None,
 ):
-    with open(os.path.join(ROOT_DIR, grid_geojson_path), 'r') as f:
-        grid_geojson = json.load(f)
+    # only the cellId and the polygon of the cells are needed, rebuilt from the cached grid index
+    grid_geojson = GridIndex.from_geojson(grid_geojson_path).to_geojson()
 
     grid_df = pd.read_csv(empty_grid_path)
     bs_df = geojson_base_stations_to_df(bs_geojson_path, filter_type=filter_type)
@@ -58,8 +55,8 @@ def plot_base_stations_with_grid_aggregated(
         bs_df_path: str,
         center, zoom=11.4, save_path=None, title=None,
 ):
-    with open(os.path.join(ROOT_DIR, grid_geojson_path), 'r') as f:
-        grid_geojson = json.load(f)
+    # only the cellId and the polygon of the cells are needed, rebuilt from the cached grid index
+    grid_geojson = GridIndex.from_geojson(grid_geojson_path).to_geojson()
 
     grid_df = pd.read_csv(empty_grid_path)
     bs_df = pd.read_csv(bs_df_path)
@@ -1,11 +1,19 @@
 import os.path
-from glob import glob
+from typing import Optional, List
 
 import numpy as np
 import pandas as pd
 
+from dataset.metrics import stage
+from dataset.preprocessing.dataframe import get_metric_columns
+from dataset.preprocessing.storage import list_chunk_files, read_dataframe, write_dataframe, get_file_format, \
+    get_chunk_output_path, get_date_from_name
 from dataset.utils import ROOT_DIR, create_directory_from_filepath, print_status
 
+# id of the BS group (the distinct values of all the BS columns) in the BS dimension table,
+# used by the aggregated chunks of the full-data view in place of the BS columns
+BS_KEY = 'bs_key'
+
 
 def aggregate_bs_to_cell(
         chunks_folder: str,
@@ -18,42 +26,40 @@ def aggregate_bs_to_cell(
     aggregated_bs_path = os.path.join(ROOT_DIR, aggregated_bs_path)
     save_path = os.path.join(ROOT_DIR, save_path)
     create_directory_from_filepath(save_path)
-    chunks = glob(f'{chunks_folder}/*.csv')
+    chunks = list_chunk_files(chunks_folder)
+    output_format = get_file_format(save_path)
 
-    aggregated_bs_df = pd.read_csv(aggregated_bs_path)
-    sliced_columns = ['cellId', 'aggregated_bs_id']
-    if keep_all_columns:
-        sliced_columns = ['cellId', 'aggregated_bs_id', 'type', 'lng', 'lat', 'n_base_stations']
+    aggregated_bs_df = read_dataframe(aggregated_bs_path)
+    # the cellId -> BS mapping is the same for all the chunks, it is compiled only once
+    bs_lookup = compile_bs_lookup(aggregated_bs_df, keep_all_columns)
 
     for i, file_path in enumerate(chunks):
-        chunk_df = pd.read_csv(file_path)
-        sliced = aggregated_bs_df[sliced_columns]
-        chunk_df = pd.merge(chunk_df, sliced, on=['cellId'])
-        columns_reordered = ['hour', 'weekday', 'idx', 'internet']
-        columns_groupby = ['hour', 'weekday', 'idx']
-        for col in sliced_columns:
-            if col != 'cellId':
-                columns_reordered.append(col)
-                columns_groupby.append(col)
-        chunk_df = chunk_df[columns_reordered]
-        chunk_df = chunk_df.groupby(columns_groupby, as_index=False).sum()
-        if mode == 'a':
-            keep_header = True if i == 0 else False
-            save_path_full = save_path
+        chunk_df = aggregate_bs_chunk(read_dataframe(file_path), aggregated_bs_df, keep_all_columns, bs_lookup)
+        if output_format == 'parquet':
+            # parquet files cannot be appended, in append mode the save path becomes a dataset folder
+            # with one partition for each chunk date
+            name = os.path.basename(save_path).replace('.parquet', '')
+            folder = save_path if mode == 'a' else os.path.dirname(save_path)
+            save_path_full = get_chunk_output_path(folder, f'{name}-{get_date_from_file_path(file_path)}', 'parquet')
+            write_dataframe(chunk_df, save_path_full)
         else:
-            keep_header = True
-            save_path_full = save_path.replace('.csv', f'-{get_date_from_file_path(file_path)}.csv')
-
-        # ids = []
-        # for j in range(2850, 2850 + 2000, 70):
-        #     start = j
-        #     ids += np.arange(start, start+15).tolist()
-        #
-        # chunk_df = chunk_df[chunk_df['aggregated_bs_id'].isin(ids)]
-
-        chunk_df.to_csv(
-            path_or_buf=save_path_full, header=keep_header, mode=mode, index=False
-        )
+            if mode == 'a':
+                keep_header = True if i == 0 else False
+                save_path_full = save_path
+            else:
+                keep_header = True
+                save_path_full = save_path.replace('.csv', f'-{get_date_from_file_path(file_path)}.csv')
+
+            # ids = []
+            # for j in range(2850, 2850 + 2000, 70):
+            #     start = j
+            #     ids += np.arange(start, start+15).tolist()
+            #
+            # chunk_df = chunk_df[chunk_df['aggregated_bs_id'].isin(ids)]
+
+            chunk_df.to_csv(
+                path_or_buf=save_path_full, header=keep_header, mode=mode, index=False
+            )
         print_status(i+1, len(chunks), 'Processed chunks', loading_len=40)
     print()
 
@@ -62,30 +68,146 @@ def aggregate_bs_single_chunk(
         chunk_path: str,
         aggregated_bs_df: pd.DataFrame,
         save_path: str,
-        keep_all_columns: bool = False
+        keep_all_columns: bool = False,
+        bs_lookup: Optional['BsLookup'] = None,
+        full_data_view: bool = False
 ):
-    sliced_columns = ['cellId', 'aggregated_bs_id']
+    name = os.path.basename(chunk_path)
+    if bs_lookup is None:
+        bs_lookup = compile_bs_lookup(aggregated_bs_df, keep_all_columns or full_data_view)
+    with stage('aggregate', chunk=name) as aggregate_stage:
+        chunk_df = read_dataframe(chunk_path)
+        aggregate_stage.add(rows=len(chunk_df), bytes_in=os.path.getsize(chunk_path))
+        chunk_df = aggregate_bs_chunk(chunk_df, aggregated_bs_df, keep_all_columns, bs_lookup,
+                                      full_data_view=full_data_view)
+    with stage('write-aggregated', chunk=name) as write_stage:
+        write_dataframe(chunk_df, save_path)
+        write_stage.add(rows=len(chunk_df), bytes_out=os.path.getsize(save_path))
+
+
+def get_bs_columns(keep_all_columns: bool = False) -> List[str]:
     if keep_all_columns:
-        sliced_columns = ['cellId', 'aggregated_bs_id', 'type', 'lng', 'lat', 'n_base_stations']
-    chunk_df = pd.read_csv(chunk_path)
+        return ['aggregated_bs_id', 'type', 'lng', 'lat', 'n_base_stations']
+    return ['aggregated_bs_id']
+
+
+class BsLookup:
+    """
+    cellId -> BS mapping compiled in an integer lookup array. Each BS group (the distinct values of the BS columns,
+    in the order used by the groupby on them) has an offset and `cell_to_group[cellId]` is the offset of the group
+    of the cell, -1 for the cells without a BS
+    """
+
+    def __init__(self, cell_to_group: np.ndarray, groups: pd.DataFrame):
+        self.cell_to_group = cell_to_group
+        self.groups = groups
+
+    @property
+    def n_groups(self) -> int:
+        return len(self.groups)
 
+
+def compile_bs_lookup(aggregated_bs_df: pd.DataFrame, keep_all_columns: bool = False) -> Optional[BsLookup]:
+    """
+    Compile the aggregated BS dataframe in a `BsLookup`. It returns None when the mapping can not be expressed
+    as a lookup array (cellIds that are duplicated, negative or not integers), in that case the chunks are
+    aggregated with the merge
+    """
+    bs_columns = get_bs_columns(keep_all_columns)
+    cell_ids = aggregated_bs_df['cellId']
+    if not pd.api.types.is_integer_dtype(cell_ids) or len(cell_ids) == 0 or cell_ids.min() < 0 \
+            or cell_ids.duplicated().any():
+        print('WARNING | The aggregated BS cellIds can not be compiled in a lookup array, using the merge')
+        return None
+    grouped = aggregated_bs_df[bs_columns].groupby(bs_columns, sort=True, observed=True)
+    # cells with a missing BS value are dropped by the groupby, they get -1 as the cells without a BS
+    cell_to_group = np.full(int(cell_ids.max()) + 1, -1, dtype=np.int64)
+    cell_to_group[cell_ids.to_numpy(dtype=np.int64)] = grouped.ngroup().to_numpy(dtype=np.int64)
+    groups = grouped.size().reset_index()[bs_columns]
+    return BsLookup(cell_to_group, groups)
+
+
+def aggregate_bs_chunk(
+        chunk_df: pd.DataFrame,
+        aggregated_bs_df: pd.DataFrame,
+        keep_all_columns: bool = False,
+        bs_lookup: Optional[BsLookup] = None,
+        full_data_view: bool = False
+) -> pd.DataFrame:
+    """
+    Aggregate a processed chunk by BS, with the lookup array if available, otherwise merging it with the BS dataframe.
+    With `full_data_view` the chunk is aggregated by all the BS columns, but only `aggregated_bs_id` and `BS_KEY`
+    are kept, the other columns are attached when reading it (see `dataset.preprocessing.bs_dimension`)
+    """
+    if full_data_view:
+        if bs_lookup is None or len(bs_lookup.groups.columns) == 1:
+            raise ValueError('The full-data view requires the lookup compiled with all the BS columns')
+        return aggregate_bs_chunk_with_lookup(chunk_df, bs_lookup, attach_bs_columns=False)
+    if bs_lookup is not None:
+        return aggregate_bs_chunk_with_lookup(chunk_df, bs_lookup)
+    return aggregate_bs_chunk_with_merge(chunk_df, aggregated_bs_df, keep_all_columns)
+
+
+def aggregate_bs_chunk_with_merge(
+        chunk_df: pd.DataFrame,
+        aggregated_bs_df: pd.DataFrame,
+        keep_all_columns: bool = False
+) -> pd.DataFrame:
+    sliced_columns = ['cellId'] + get_bs_columns(keep_all_columns)
     sliced = aggregated_bs_df[sliced_columns]
     chunk_df = pd.merge(chunk_df, sliced, on=['cellId'])
-    columns_reordered = ['hour', 'weekday', 'idx', 'internet']
+    columns_reordered = ['hour', 'weekday', 'idx'] + get_metric_columns(chunk_df)
     columns_groupby = ['hour', 'weekday', 'idx']
     for col in sliced_columns:
         if col != 'cellId':
             columns_reordered.append(col)
             columns_groupby.append(col)
     chunk_df = chunk_df[columns_reordered]
-    chunk_df = chunk_df.groupby(columns_groupby, as_index=False).sum()
+    return chunk_df.groupby(columns_groupby, as_index=False, observed=True).sum()
+
+
+def aggregate_bs_chunk_with_lookup(
+        chunk_df: pd.DataFrame,
+        bs_lookup: BsLookup,
+        attach_bs_columns: bool = True
+) -> pd.DataFrame:
+    """
+    Gather the BS group of each row from the lookup array and sum the metrics over a single integer key
+    (hour, weekday, BS group), the BS columns are attached only to the aggregated rows.
+    The rows keep the order of the chunk and the sums are done by the same groupby reduction of the merge path,
+    so the result is identical to `aggregate_bs_chunk_with_merge`. Without `attach_bs_columns` only
+    `aggregated_bs_id` and the BS group (`BS_KEY`) are kept
+    """
+    metrics = get_metric_columns(chunk_df)
+    cell_ids = chunk_df['cellId'].to_numpy(dtype=np.int64)
+    groups = np.full(len(cell_ids), -1, dtype=np.int64)
+    in_range = (cell_ids >= 0) & (cell_ids < len(bs_lookup.cell_to_group))
+    groups[in_range] = bs_lookup.cell_to_group[cell_ids[in_range]]
+    valid = groups >= 0
+    hours = chunk_df['hour'].to_numpy(dtype=np.int64)[valid]
+    weekdays = chunk_df['weekday'].to_numpy(dtype=np.int64)[valid]
+    keys = (hours * 7 + weekdays) * bs_lookup.n_groups + groups[valid]
+    sums = chunk_df.loc[valid, metrics].groupby(keys, sort=True).sum()
 
-    chunk_df.to_csv(path_or_buf=save_path, header=True, index=False)
+    keys = sums.index.to_numpy(dtype=np.int64)
+    slots, group_offsets = np.divmod(keys, bs_lookup.n_groups)
+    hours, weekdays = np.divmod(slots, 7)
+    df = pd.DataFrame({
+        'hour': hours.astype(chunk_df['hour'].dtype),
+        'weekday': weekdays.astype(chunk_df['weekday'].dtype),
+        'idx': (hours + weekdays * 24).astype(chunk_df['idx'].dtype)
+    })
+    if attach_bs_columns:
+        bs_columns = bs_lookup.groups.iloc[group_offsets].reset_index(drop=True)
+    else:
+        bs_columns = pd.DataFrame({
+            'aggregated_bs_id': bs_lookup.groups['aggregated_bs_id'].to_numpy()[group_offsets],
+            BS_KEY: group_offsets
+        })
+    df = pd.concat([df, bs_columns, sums.reset_index(drop=True)], axis=1)
+    return df
 
 
 def get_date_from_file_path(file_path: str) -> str:
-    last_item = file_path.split('/')[-1]
-    last_item = last_item.replace('.csv', '')
-    date_portion = last_item.split('-')[-3:]
-    return '-'.join(date_portion)
+    return get_date_from_name(file_path)
 
@@ -0,0 +1,142 @@
+import json
+import os
+from glob import glob
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from dataset.preprocessing.aggregate_bs_to_cell import BsLookup, BS_KEY
+from dataset.preprocessing.dataframe import get_metric_columns
+from dataset.preprocessing.storage import read_dataframe, write_dataframe
+from dataset.utils import load_json_file
+
+# BS columns of the full-data files, in the order of their header
+BS_COLUMNS = ['type', 'lng', 'lat', 'n_base_stations']
+BS_DIMENSION_NAME = 'aggregated-bs-dimension'
+VIEW_EXTENSION = '.view.json'
+
+
+def build_bs_dimension(bs_lookup: BsLookup) -> pd.DataFrame:
+    """
+    BS dimension table of the full-data view: one row for each BS group of the lookup, the row position is its
+    `BS_KEY`
+    """
+    dimension = bs_lookup.groups.copy()
+    dimension.insert(0, BS_KEY, np.arange(len(dimension), dtype=np.int64))
+    return dimension
+
+
+def get_bs_dimension_path(folder: str, bs_types: Optional[str] = None, output_format: str = 'csv') -> str:
+    # aggregated-bs-dimension-LTE-UMTS.csv
+    parts = [BS_DIMENSION_NAME] + (bs_types.split(',') if bs_types is not None else [])
+    return os.path.join(folder, f'{"-".join(parts)}.{output_format}')
+
+
+def find_bs_dimension(folder: str, bs_types: Optional[str] = None) -> Optional[str]:
+    """
+    Search the BS dimension in `folder`: the one of `bs_types` if they are known, otherwise the only one of the
+    folder. It raises an AttributeError if more than one dimension matches, the path has to be given explicitly
+    """
+    if bs_types is not None:
+        paths = sorted(glob(get_bs_dimension_path(folder, bs_types, '*')))
+    else:
+        paths = sorted(glob(os.path.join(folder, f'{BS_DIMENSION_NAME}*')))
+    if len(paths) > 1:
+        raise AttributeError(f'ERROR | More than one BS dimension found in {folder}: '
+                             f'{", ".join([os.path.basename(path) for path in paths])}, provide the one to use')
+    return paths[0] if len(paths) > 0 else None
+
+
+def get_chunks_parent_folder(chunk_path: str) -> str:
+    # <output>/aggregated-chunks/<chunk> or <output>/aggregated-chunks/date=<date>/<chunk> -> <output>
+    folder = os.path.dirname(os.path.abspath(chunk_path))
+    if os.path.basename(folder).startswith('date='):
+        folder = os.path.dirname(folder)
+    return os.path.dirname(folder)
+
+
+def read_bs_dimension(path: str) -> pd.DataFrame:
+    """
+    Read the BS dimension indexed by `BS_KEY`, with the BS type as a categorical column
+    """
+    dimension = read_dataframe(path).set_index(BS_KEY).sort_index()
+    dimension['type'] = dimension['type'].astype('category')
+    return dimension
+
+
+def attach_bs_dimension(facts: pd.DataFrame, dimension: pd.DataFrame) -> pd.DataFrame:
+    """
+    Join the BS columns to the aggregated rows by position on `BS_KEY`, returning the full-data header:
+    hour, weekday, idx, aggregated_bs_id, type, lng, lat, n_base_stations, <metrics>
+    """
+    keys = facts[BS_KEY].to_numpy(dtype=np.int64)
+    if not dimension.index.equals(pd.RangeIndex(len(dimension))):
+        keys = dimension.index.get_indexer(keys)
+    bs_columns = dimension.iloc[keys][BS_COLUMNS].reset_index(drop=True)
+    time_columns = facts[['hour', 'weekday', 'idx', 'aggregated_bs_id']].reset_index(drop=True)
+    metrics = facts[get_metric_columns(facts)].reset_index(drop=True)
+    return pd.concat([time_columns, bs_columns, metrics], axis=1)
+
+
+def save_full_data_view(view_path: str, facts_path: str, dimension_path: str):
+    """
+    Save the descriptor of a full-data view: the paths, relative to the descriptor, of the aggregated rows
+    (facts) and of the BS dimension
+    """
+    folder = os.path.dirname(view_path)
+    view = {
+        'facts': os.path.relpath(facts_path, folder),
+        'dimension': os.path.relpath(dimension_path, folder),
+        'key': BS_KEY
+    }
+    with open(view_path, 'w') as f:
+        json.dump(view, f, indent=2)
+
+
+def read_full_data(
+        path: str,
+        columns: Optional[List[str]] = None,
+        dimension_path: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Read a full-data file. It can be a materialized file, a full-data view descriptor (`*.view.json`) or
+    an aggregated chunk with the `BS_KEY` column, in that case the BS dimension is searched in the parent folder
+    of the chunk if `dimension_path` is not provided (it must be provided if the folder has the dimensions of more
+    BS types). The BS columns are attached only if requested in `columns`
+    """
+    if path.endswith(VIEW_EXTENSION):
+        view = load_json_file(path)
+        folder = os.path.dirname(path)
+        path = os.path.join(folder, view['facts'])
+        dimension_path = os.path.join(folder, view['dimension'])
+    facts = read_dataframe(path)
+    if BS_KEY not in facts.columns:
+        return facts[columns] if columns is not None else facts
+    if columns is not None and not any([col in BS_COLUMNS for col in columns]):
+        return facts[columns]
+    if dimension_path is None:
+        dimension_path = find_bs_dimension(get_chunks_parent_folder(path))
+        if dimension_path is None:
+            raise AttributeError(f'ERROR | BS dimension not found for the full-data view: {path}')
+    df = attach_bs_dimension(facts, read_bs_dimension(dimension_path))
+    return df[columns] if columns is not None else df
+
+
+def write_full_data_view(
+        facts: pd.DataFrame,
+        view_path: str,
+        dimension_path: str,
+        output_format: str = 'csv'
+) -> str:
+    """
+    Save the aggregated rows of a full-data view next to its descriptor (<name>-facts.<format>)
+    Returns
+    -------
+    str
+        the path of the facts file
+    """
+    facts_path = view_path.replace(VIEW_EXTENSION, f'-facts.{output_format}')
+    write_dataframe(facts, facts_path, output_format)
+    save_full_data_view(view_path, facts_path, dimension_path)
+    return facts_path
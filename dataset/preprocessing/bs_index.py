@@ -0,0 +1,83 @@
+import math
+from datetime import datetime
+from typing import List, Tuple, Optional, Dict
+
+import numpy as np
+
+from dataset.geo_utils import get_feature_lng_and_lat, haversine_distances
+from dataset.utils import load_json_file
+
+# radius of the earth, in km, used by MongoDB for the $nearSphere distances
+MONGO_EARTH_RADIUS = 6378.1
+# side, in degrees, of the buckets of the grid hash (about 1 km of latitude)
+DEFAULT_BUCKET_SIDE = 0.01
+
+
+class BaseStationIndex:
+    """
+    In-memory spatial index of the base stations, it replaces the MongoDB $nearSphere queries of the bs pipeline.
+    The base stations are hashed in a uniform grid of `bucket_side` degrees, a query visits only the buckets
+    overlapping the bounding box of the search radius and returns the base stations sorted as MongoDB does:
+    by their spherical distance from the center, the base stations at the same distance in the order of the geojson
+    """
+
+    def __init__(self, features: List[dict], bs_types: Optional[str] = None,
+                 bucket_side: float = DEFAULT_BUCKET_SIDE):
+        if bs_types is not None:
+            types = bs_types.split(',')
+            features = [feature for feature in features if feature['properties']['radio'] in types]
+        self.features = features
+        self.bucket_side = bucket_side
+        points = np.array([get_feature_lng_and_lat(feature) for feature in features], dtype=np.float64)
+        points = points.reshape(-1, 2)
+        self.lng = points[:, 0]
+        self.lat = points[:, 1]
+        self.buckets: Dict[Tuple[int, int], np.ndarray] = {}
+        keys = np.floor(points / bucket_side).astype(np.int64)
+        for i, key in enumerate(map(tuple, keys)):
+            self.buckets.setdefault(key, []).append(i)
+        self.buckets = {key: np.array(indexes, dtype=np.int64) for key, indexes in self.buckets.items()}
+
+    @classmethod
+    def from_geojson(cls, geojson_path: str, bs_types: Optional[str] = None,
+                     bucket_side: float = DEFAULT_BUCKET_SIDE) -> 'BaseStationIndex':
+        """
+        Load the base stations geojson (e.g. bs_milan.geojson). As when they are uploaded on MongoDB,
+        the `created` and `updated` timestamps are converted to datetimes
+        """
+        features = load_json_file(geojson_path)['features']
+        for feature in features:
+            feature['properties']['created'] = datetime.fromtimestamp(feature['properties']['created'])
+            feature['properties']['updated'] = datetime.fromtimestamp(feature['properties']['updated'])
+        return cls(features, bs_types=bs_types, bucket_side=bucket_side)
+
+    def __len__(self):
+        return len(self.features)
+
+    def query(self, center: Tuple[float, float], max_distance: float) -> List[dict]:
+        """
+        Base stations within `max_distance` meters from `center` (lng, lat), sorted by distance
+        """
+        indexes = self._candidates(center, max_distance)
+        if len(indexes) == 0:
+            return []
+        points = np.stack([self.lng[indexes], self.lat[indexes]], axis=1)
+        distances = haversine_distances(np.array([center]), points, radius=MONGO_EARTH_RADIUS)[0]
+        in_range = distances <= max_distance / 1000
+        indexes = indexes[in_range]
+        order = np.lexsort((indexes, distances[in_range]))
+        return [self.features[i] for i in indexes[order]]
+
+    def _candidates(self, center: Tuple[float, float], max_distance: float) -> np.ndarray:
+        delta_lat = math.degrees(max_distance / 1000 / MONGO_EARTH_RADIUS)
+        delta_lng = delta_lat / max(math.cos(math.radians(center[1]) + math.radians(delta_lat)), 1e-6)
+        min_col = math.floor((center[0] - delta_lng) / self.bucket_side)
+        max_col = math.floor((center[0] + delta_lng) / self.bucket_side)
+        min_row = math.floor((center[1] - delta_lat) / self.bucket_side)
+        max_row = math.floor((center[1] + delta_lat) / self.bucket_side)
+        found = [self.buckets[(col, row)] for col in range(min_col, max_col + 1) for row in range(min_row, max_row + 1)
+                 if (col, row) in self.buckets]
+        if len(found) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
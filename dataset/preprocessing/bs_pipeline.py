@@ -1,17 +1,36 @@
 import datetime
+import itertools
 import math
 import os.path
 import time
-from typing import List, Tuple, Dict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import List, Tuple, Dict, Optional, Iterable, Iterator
 
+import numpy as np
 import pandas as pd
-from pymongo import TEXT
 
+from dataset.cache import ResultCache, get_cache_key, CACHE_FOLDER
+from dataset.downloader.http_client import DownloadError
 from dataset.downloader.http_download import download_base_stations
-from dataset.mongodb.geojson_uploader import upload_geojson
-from dataset.mongodb.query import get_db, get_bs_in_range
-from dataset.utils import load_json_file, ROOT_DIR, create_directory, print_status
-from dataset.geo_utils import is_point_in_cell, get_cell_center, points_distance, get_feature_lng_and_lat
+from dataset.downloader.rate_limiter import DAILY_QUOTA_FILE
+from dataset.grid_index import GridIndex
+from dataset.metrics import stage, start_run, end_run, get_metrics_path
+from dataset.preprocessing.bs_index import BaseStationIndex
+from dataset.preprocessing.storage import write_dataframe
+from dataset.utils import ROOT_DIR, create_directory, print_status, file_checksum
+from dataset.geo_utils import points_in_boxes, haversine_distances, get_feature_lng_and_lat
+
+# base stations of a query checked together, the loop can stop before the end of the query results
+BS_BATCH_SIZE = 64
+# times the search distance of a cell without base stations is doubled
+MAX_RETRY = 4
+# shards of rows of the grid for each mapping process, more shards than processes balance the load
+SHARDS_PER_WORKER = 4
+# folder of the cached mappings in the cache, and version to increase when the mapping changes
+MAPPING_CACHE_NAME = 'bs-mapping'
+MAPPING_CACHE_VERSION = 1
+# folder of the cached responses of the base stations provider in the cache
+RESPONSES_CACHE_NAME = 'opencellid-responses'
 
 
 def process_base_stations(args):
@@ -25,69 +44,301 @@ def process_base_stations(args):
     skip_bs_download = args.skip_bs_download
     skip_db_upload = args.skip_db_upload
     bs_types = args.bs_types
+    output_format = args.format
+    engine = args.engine
+    query_workers = args.query_workers
+    workers = args.workers
+    if engine == 'mongo' and to_collection is None:
+        print('ERROR | The mongo engine requires the --collection argument')
+        return None
     create_directory(save_folder)
     print(f'INFO | Geojson path: {geojson_path}')
     print(f'INFO | Save path: {save_folder}')
     print(f'INFO | Api path: {api_path} | box_side: {box_side} | sleep_interval: {sleep_interval}'
           f' | Saving in collection: {to_collection} | Skip BS download: {skip_bs_download} |'
-          f' Skip DB upload: {skip_db_upload} | BS Types: {bs_types}')
-    # load the grid dataset
-    geojson = load_json_file(os.path.join(ROOT_DIR, geojson_path))
-    # download all the base stations in a certain area, delimited by all the cells of the dataset grid
-    full_bs_save_path = os.path.join(save_folder, 'bs_milan.geojson')
-    # if not skip_bs_download:
-    #     download_base_stations(geojson, api_path, api_token, full_bs_save_path, box_side, sleep_interval)
-    if not skip_db_upload:
+          f' Skip DB upload: {skip_db_upload} | BS Types: {bs_types} | Format: {output_format} | Engine: {engine}'
+          f' | Query workers: {query_workers} | Workers: {workers}')
+    if not args.no_stats:
+        stats_file = args.stats_file if args.stats_file is not None else get_metrics_path(save_folder, 'bs')
+        # the api token is not saved with the parameters of the run
+        start_run(os.path.join(ROOT_DIR, stats_file), 'bs',
+                  {key: value for key, value in vars(args).items() if key != 'api_token'})
+    # the run is ended also when a stage fails
+    try:
+        # load the grid dataset
+        with stage('load-grid') as grid_stage:
+            grid = GridIndex.from_geojson(geojson_path)
+            grid_stage.add(rows=len(grid), bytes_in=os.path.getsize(os.path.join(ROOT_DIR, geojson_path)))
+        # download all the base stations in a certain area, delimited by all the cells of the dataset grid
+        full_bs_save_path = os.path.join(save_folder, 'bs_milan.geojson')
+        if not skip_bs_download and api_token == '':
+            # the provider rejects the requests without a token, the download is run only if one is given
+            print(f'WARNING | No --api-token, the base stations are not downloaded: using {full_bs_save_path}')
+        elif not skip_bs_download:
+            # with --no-cache the responses are requested again to the provider, the daily quota is still counted
+            responses_cache = None if args.no_cache else ResultCache(RESPONSES_CACHE_NAME, max_size=args.cache_size)
+            try:
+                download_base_stations(grid, api_path, api_token, full_bs_save_path, box_side, sleep_interval,
+                                       max_results=args.max_results, workers=args.download_workers,
+                                       requests_per_second=args.requests_per_second,
+                                       requests_per_day=args.requests_per_day, cache=responses_cache,
+                                       quota_path=os.path.join(CACHE_FOLDER, RESPONSES_CACHE_NAME, DAILY_QUOTA_FILE))
+            except DownloadError as e:
+                print(f'ERROR | Download of the base stations failed: {e}')
+                return None
+        if not os.path.exists(full_bs_save_path):
+            print(f'ERROR | Base stations file not found: {full_bs_save_path}')
+            return None
+        max_distance = 500  # in meters
+        if engine == 'mongo' and not skip_db_upload:
+            # before reading the cache, so the collection is loaded also when the mapping is cached
+            upload_base_stations(full_bs_save_path, to_collection, args.upload_batch_size, args.upload_workers)
+        cache = None
+        cache_key = None
+        # the cached mapping is valid only if the base stations queried are the ones of the geojson
+        if not args.no_cache and os.path.exists(full_bs_save_path) and (engine == 'local' or not skip_db_upload):
+            cache = ResultCache(MAPPING_CACHE_NAME, max_size=args.cache_size)
+            cache_key = get_cache_key(MAPPING_CACHE_VERSION, file_checksum(os.path.join(ROOT_DIR, geojson_path)),
+                                      file_checksum(full_bs_save_path), bs_types, max_distance, MAX_RETRY, engine)
+        cached = None
+        if cache is not None:
+            with stage('cache-load') as cache_stage:
+                cached = cache.get(cache_key)
+                cache_stage.add(hits=int(cached is not None))
+        if cached is not None:
+            print(f'INFO | Mapping of the grid cells to the base stations loaded from the cache ({cache_key})')
+            cell_df, aggregated_df = cached
+        else:
+            cell_df, aggregated_df = map_cells_to_base_stations(
+                grid, engine, full_bs_save_path, to_collection, max_distance, bs_types, query_workers,
+                skip_db_upload=True, workers=workers, geojson_path=geojson_path)
+            if cache is not None:
+                cache.put(cache_key, (cell_df, aggregated_df))
+        # we store the cell_base_stations_mapped
+        filename = f'cell_base_stations_mapped-{"-".join(bs_types.split(","))}.{output_format}'
+        write_output(cell_df, os.path.join(save_folder, filename), output_format)
+        # we group by cellId so that we have one base station for cell,
+        # composed by all the base station belonging to that cell, if any
+        # we save the cell_base_stations_aggregated
+        filename = f'cell_base_stations_aggregated-{"-".join(bs_types.split(","))}.{output_format}'
+        write_output(aggregated_df, os.path.join(save_folder, filename), output_format)
+
+        bs_df = aggregated_df.groupby(['aggregated_bs_id', 'type', 'n_base_stations', 'lng', 'lat'],
+                                      as_index=False).count()
+        bs_df.drop(['cellId', 'distance'], axis=1, inplace=True)
+        filename = f'aggregated_bs_data-{"-".join(bs_types.split(","))}.{output_format}'
+        write_output(bs_df, os.path.join(save_folder, filename), output_format)
+    finally:
+        end_run()
+
+
+def write_output(df: pd.DataFrame, path: str, output_format: str):
+    with stage('write', file=os.path.basename(path)) as write_stage:
+        write_dataframe(df, path, output_format)
+        write_stage.add(rows=len(df), bytes_out=os.path.getsize(path))
+
+
+def upload_base_stations(full_bs_save_path: str, to_collection: str, batch_size: int = 1000, workers: int = 1):
+    """
+    Upload the base stations geojson in the MongoDB collection queried by the mongo engine
+    """
+    # MongoDB is needed only by the mongo engine
+    from pymongo import TEXT
+    from dataset.mongodb.geojson_uploader import upload_geojson
+    with stage('upload-bs', collection=to_collection) as upload_stage:
         upload_geojson(full_bs_save_path, to_collection=to_collection,
-                       geosphere_index_name='geometry', additional_indexes=[('properties.radio', TEXT)])
-    max_distance = 500  # in meters
-    mongo_db = get_db()
+                       geosphere_index_name='geometry', additional_indexes=[('properties.radio', TEXT)],
+                       batch_size=batch_size, workers=workers)
+        upload_stage.add(bytes_in=os.path.getsize(full_bs_save_path))
+
+
+def map_cells_to_base_stations(
+        grid: GridIndex,
+        engine: str,
+        full_bs_save_path: str,
+        to_collection: Optional[str],
+        max_distance: float,
+        bs_types: str,
+        query_workers: int = 1,
+        skip_db_upload: bool = False,
+        upload_batch_size: int = 1000,
+        upload_workers: int = 1,
+        workers: int = 1,
+        geojson_path: Optional[str] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Map each cell of the grid to its base stations, returning the cell_base_stations_mapped and the
+    cell_base_stations_aggregated dataframes. With more than one worker the grid is split in shards of rows mapped
+    by a pool of processes (`geojson_path` is needed for loading the grid in the workers), the aggregated bs ids
+    are then assigned in the order of the cells, so the result is the same of the serial run
+    """
+    mongo_db = None
+    bs_index = None
+    if engine == 'mongo':
+        # MongoDB is needed only by the mongo engine
+        from dataset.mongodb.query import get_db
+        if not skip_db_upload:
+            upload_base_stations(full_bs_save_path, to_collection, upload_batch_size, upload_workers)
+        if workers <= 1:
+            mongo_db = get_db()
+    elif workers <= 1:
+        # the base stations are loaded once in an in-memory spatial index, queried in the same way of MongoDB
+        bs_index = load_bs_index(full_bs_save_path, bs_types)
+        print(f'INFO | Loaded {len(bs_index)} base stations of types {bs_types} in the spatial index')
     mapped_columns = ['bs_id', 'type', 'range', 'created', 'lng', 'lat', 'cellId', 'distance']
     mapped_data = []
     aggregated_columns = ['type', 'lng', 'lat', 'cellId', 'distance', 'n_base_stations', 'aggregated_bs_id']
     aggregated_data = []
-    all_cells = geojson['features']
-    n_cells = len(all_cells)
+    n_cells = len(grid)
     aggregated_bs_id_mapping = {}
-    for i, cell in enumerate(all_cells):
-        set_cell_base_stations(cell, mapped_data, aggregated_data, mongo_db, to_collection, max_distance,
-                               bs_types=bs_types, aggregated_bs_id_mapping=aggregated_bs_id_mapping)
-        print_status(i+1, n_cells, 'Mapping grid cells to base stations', loading_len=50)
+    with stage('map-cells', engine=engine, workers=workers, query_workers=query_workers) as map_stage:
+        if workers > 1:
+            cells = [None] * n_cells
+            completed = 0
+            shards = get_row_shards(grid, workers * SHARDS_PER_WORKER)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_mapping_worker,
+                                     initargs=(geojson_path, engine, full_bs_save_path, bs_types)) as executor:
+                futures = [executor.submit(_map_shard_in_worker, positions, to_collection, max_distance, bs_types,
+                                           query_workers) for positions in shards]
+                for future in as_completed(futures):
+                    for i, cell_mapped_data, cell_aggregated_data in future.result():
+                        cells[i] = (cell_mapped_data, cell_aggregated_data)
+                        completed += 1
+                    print_status(completed, n_cells, 'Mapping grid cells to base stations', loading_len=50)
+            # deterministic merge: the ids are assigned in the order of the cells, as in the serial run
+            for cell_mapped_data, cell_aggregated_data in cells:
+                mapped_data.extend(cell_mapped_data)
+                cell_aggregated_data[-1] = get_aggregated_bs_id((cell_aggregated_data[1], cell_aggregated_data[2]),
+                                                                aggregated_bs_id_mapping)
+                aggregated_data.append(cell_aggregated_data)
+        else:
+            results = iterate_cells_base_stations(grid, range(n_cells), mongo_db, to_collection, max_distance,
+                                                  bs_types, bs_index, query_workers)
+            for i, (cell_base_stations, distance) in enumerate(results):
+                add_cell_base_stations(int(grid.cell_ids[i]), cell_base_stations, distance, mapped_data,
+                                       aggregated_data, aggregated_bs_id_mapping)
+                print_status(i+1, n_cells, 'Mapping grid cells to base stations', loading_len=50)
+        map_stage.add(rows=n_cells, base_stations=len(mapped_data))
     print()
     cell_df = pd.DataFrame(data=mapped_data, columns=mapped_columns)
-    # we store the cell_base_stations_mapped
-    filename = f'cell_base_stations_mapped-{"-".join(bs_types.split(","))}.csv'
-    cell_df.to_csv(
-        path_or_buf=os.path.join(save_folder, filename),
-        index=False
-    )
-    # we group by cellId so that we have one base station for cell,
-    # composed by all the base station belonging to that cell, if any
     aggregated_df = pd.DataFrame(data=aggregated_data, columns=aggregated_columns)
-    # we save the cell_base_stations_aggregated
-    filename = f'cell_base_stations_aggregated-{"-".join(bs_types.split(","))}.csv'
-    aggregated_df.to_csv(
-        path_or_buf=os.path.join(save_folder, filename),
-        index=False
-    )
+    return cell_df, aggregated_df
+
+
+def iterate_cells_base_stations(
+        grid: GridIndex,
+        positions: Iterable[int],
+        mongo_db,
+        to_collection: Optional[str],
+        max_distance: float,
+        bs_types: str,
+        bs_index: Optional[BaseStationIndex] = None,
+        query_workers: int = 1
+) -> Iterator[Tuple[List[dict], float]]:
+    """
+    Base stations and distance of the cells in `positions`, in the same order. With more than one query worker
+    the queries run concurrently in a pool of threads
+    """
+    def find(i: int) -> Tuple[List[dict], float]:
+        return find_cell_base_stations(grid.get_bbox(i), grid.get_center(i), mongo_db, to_collection, max_distance,
+                                       bs_types=bs_types, bs_index=bs_index)
+
+    if query_workers > 1:
+        with ThreadPoolExecutor(max_workers=query_workers) as executor:
+            yield from executor.map(find, positions)
+    else:
+        for i in positions:
+            yield find(i)
+
 
-    bs_df = aggregated_df.groupby(['aggregated_bs_id', 'type', 'n_base_stations', 'lng', 'lat'], as_index=False).count()
-    bs_df.drop(['cellId', 'distance'], 1, inplace=True)
-    filename = f'aggregated_bs_data-{"-".join(bs_types.split(","))}.csv'
-    bs_df.to_csv(path_or_buf=os.path.join(save_folder, filename), header=True, index=False)
+def load_bs_index(full_bs_save_path: str, bs_types: str) -> BaseStationIndex:
+    with stage('load-bs-index', bs_types=bs_types) as load_stage:
+        bs_index = BaseStationIndex.from_geojson(full_bs_save_path, bs_types=bs_types)
+        load_stage.add(rows=len(bs_index), bytes_in=os.path.getsize(full_bs_save_path))
+    return bs_index
 
 
-def set_cell_base_stations(cell, mapped_data, aggregated_data, mongo_db, to_collection, max_distance,
+def get_row_shards(grid: GridIndex, n_shards: int) -> List[np.ndarray]:
+    """
+    Split the positions of the cells in shards of consecutive rows of the grid
+    """
+    shards = []
+    for rows in np.array_split(np.arange(grid.n_rows), min(n_shards, max(grid.n_rows, 1))):
+        if len(rows) > 0:
+            positions = np.flatnonzero((grid.rows >= rows[0]) & (grid.rows <= rows[-1]))
+            if len(positions) > 0:
+                shards.append(positions)
+    return shards
+
+
+# grid, base stations index and MongoDB connection of the mapping worker, they are set once when the worker starts
+_worker_grid: Optional[GridIndex] = None
+_worker_bs_index: Optional[BaseStationIndex] = None
+_worker_mongo_db = None
+
+
+def _init_mapping_worker(geojson_path: str, engine: str, full_bs_save_path: str, bs_types: str):
+    global _worker_grid, _worker_bs_index, _worker_mongo_db
+    _worker_grid = GridIndex.from_geojson(geojson_path)
+    if engine == 'mongo':
+        from dataset.mongodb.geojson_uploader import reset_client
+        from dataset.mongodb.query import get_db
+        # a MongoClient must not be shared with a forked process
+        reset_client()
+        _worker_mongo_db = get_db()
+    else:
+        _worker_bs_index = load_bs_index(full_bs_save_path, bs_types)
+
+
+def _map_shard_in_worker(positions: np.ndarray, to_collection: Optional[str], max_distance: float, bs_types: str,
+                         query_workers: int) -> List[Tuple[int, list, list]]:
+    results = []
+    positions = positions.tolist()
+    with stage('map-shard', first_cell=positions[0], query_workers=query_workers) as shard_stage:
+        found = iterate_cells_base_stations(_worker_grid, positions, _worker_mongo_db, to_collection, max_distance,
+                                            bs_types, _worker_bs_index, query_workers)
+        for i, (cell_base_stations, distance) in zip(positions, found):
+            cell_mapped_data = []
+            cell_aggregated_data = []
+            # the aggregated bs id is assigned by the main process
+            add_cell_base_stations(int(_worker_grid.cell_ids[i]), cell_base_stations, distance, cell_mapped_data,
+                                   cell_aggregated_data, aggregated_bs_id_mapping=None)
+            results.append((i, cell_mapped_data, cell_aggregated_data[0]))
+        shard_stage.add(rows=len(positions))
+    return results
+
+
+def set_cell_base_stations(cell_id: int, cell_center: Tuple[float, float], cell_box: Tuple[float, float, float, float],
+                           mapped_data, aggregated_data, mongo_db, to_collection, max_distance,
                            aggregated_bs_id_mapping: Dict[(Tuple[float, float]), int],
-                           max_retry=4, bs_types='LTE'):
-    cell_center = get_cell_center(cell)
-    cell_base_stations, distance = get_cell_base_stations(cell, cell_center, mongo_db, to_collection,
-                                                          max_distance, bs_types)
+                           max_retry=MAX_RETRY, bs_types='LTE', bs_index: Optional[BaseStationIndex] = None):
+    cell_base_stations, distance = find_cell_base_stations(cell_box, cell_center, mongo_db, to_collection,
+                                                           max_distance, max_retry=max_retry, bs_types=bs_types,
+                                                           bs_index=bs_index)
+    add_cell_base_stations(cell_id, cell_base_stations, distance, mapped_data, aggregated_data,
+                           aggregated_bs_id_mapping)
+
+
+def find_cell_base_stations(cell_box: Tuple[float, float, float, float], cell_center: Tuple[float, float],
+                            mongo_db, to_collection, max_distance, max_retry=MAX_RETRY, bs_types='LTE',
+                            bs_index: Optional[BaseStationIndex] = None) -> Tuple[List[dict], float]:
+    """
+    Base stations of a cell, doubling the search distance up to `max_retry` times if none is found.
+    It does not change any shared state, so it can be called from multiple threads
+    """
+    cell_base_stations, distance = get_cell_base_stations(cell_box, cell_center, mongo_db, to_collection,
+                                                          max_distance, bs_types, bs_index=bs_index)
     trials = 1
     while len(cell_base_stations) == 0 and trials <= max_retry:
         cell_base_stations, distance = get_cell_base_stations(
-            cell, cell_center, mongo_db, to_collection, max_distance=max_distance * (2 * trials), bs_types=bs_types)
+            cell_box, cell_center, mongo_db, to_collection, max_distance=max_distance * (2 * trials),
+            bs_types=bs_types, bs_index=bs_index)
         trials += 1
+    return cell_base_stations, distance
+
+
+def add_cell_base_stations(cell_id: int, cell_base_stations: List[dict], distance: float, mapped_data,
+                           aggregated_data, aggregated_bs_id_mapping: Optional[Dict[(Tuple[float, float]), int]]):
     all_lng = []
     all_lat = []
     n_bs = 0
@@ -105,18 +356,20 @@ def set_cell_base_stations(cell, mapped_data, aggregated_data, mongo_db, to_coll
             bs['properties']['created'],
             bs_point[0],
             bs_point[1],
-            cell['properties']['cellId'],
+            cell_id,
             distance
         ])
     final_bs_type = bs_type if n_bs == 1 else 'AGGREGATED'
     avg_lng = sum(all_lng)/n_bs
     avg_lat = sum(all_lat)/n_bs
-    aggregated_bs_id = get_aggregated_bs_id((avg_lng, avg_lat), aggregated_bs_id_mapping)
+    aggregated_bs_id = None
+    if aggregated_bs_id_mapping is not None:
+        aggregated_bs_id = get_aggregated_bs_id((avg_lng, avg_lat), aggregated_bs_id_mapping)
     aggregated_data.append([
         final_bs_type,
         avg_lng,
         avg_lat,
-        cell['properties']['cellId'],
+        cell_id,
         distance,
         n_bs,
         aggregated_bs_id
@@ -130,28 +383,34 @@ def get_aggregated_bs_id(aggregated_bs_point: Tuple[float, float], aggregated_bs
 
 
 def get_cell_base_stations(
-        cell: dict,
+        cell_box: Tuple[float, float, float, float],
         cell_center: Tuple[float, float],
         mongo_db,
         to_collection: str,
         max_distance: float,
-        bs_types: str
+        bs_types: str,
+        bs_index: Optional[BaseStationIndex] = None
 ) -> Tuple[List[dict], float]:
-    base_stations = get_bs_in_range(
-        to_collection,
-        center=cell_center,
-        max_distance=max_distance,
-        filters={'properties.radio': {'$in': bs_types.split(',')}},
-        db=mongo_db
-    )
+    if bs_index is not None:
+        # the index contains only the base stations of `bs_types`
+        base_stations = bs_index.query(cell_center, max_distance)
+    else:
+        from dataset.mongodb.query import get_bs_in_range, BS_PROJECTION
+        base_stations = get_bs_in_range(
+            to_collection,
+            center=cell_center,
+            max_distance=max_distance,
+            filters={'properties.radio': {'$in': bs_types.split(',')}},
+            db=mongo_db,
+            projection=BS_PROJECTION
+        )
     bs_in_cell = False
     candidate_bs = []
     min_distance = math.inf
     count = 0
     count_after_min_found = None
-    for bs in base_stations:
-        bs_point = get_feature_lng_and_lat(bs)
-        if is_point_in_cell(cell, bs_point):
+    for bs, in_cell, bs_distance in iterate_bs_batches(base_stations, cell_center, cell_box):
+        if in_cell:
             if bs_in_cell:
                 candidate_bs.append(bs)
                 count_after_min_found = 0
@@ -162,7 +421,7 @@ def get_cell_base_stations(
                 count_after_min_found = 0
         else:
             if not bs_in_cell:
-                distance = points_distance(cell_center, bs_point)
+                distance = bs_distance
                 if distance < min_distance:
                     min_distance = distance
                     candidate_bs = [bs]
@@ -173,3 +432,27 @@ def get_cell_base_stations(
             return candidate_bs, min_distance
         count += 1
     return candidate_bs, min_distance
+
+
+def iterate_bs_batches(
+        base_stations,
+        cell_center: Tuple[float, float],
+        cell_box: Tuple[float, float, float, float],
+        batch_size: int = BS_BATCH_SIZE
+):
+    """
+    Iterate the base stations (a list or a MongoDB cursor) with, for each of them, if it is inside the cell box
+    and its distance from the cell center. Both are computed for a batch of base stations at a time
+    """
+    base_stations = iter(base_stations)
+    center = np.array([cell_center], dtype=np.float64)
+    box = np.array([cell_box], dtype=np.float64)
+    while True:
+        batch = list(itertools.islice(base_stations, batch_size))
+        if len(batch) == 0:
+            return
+        points = np.array([get_feature_lng_and_lat(bs) for bs in batch], dtype=np.float64)
+        in_cell = points_in_boxes(points, box)[:, 0]
+        distances = haversine_distances(center, points)[0]
+        for bs, bs_in_cell, distance in zip(batch, in_cell.tolist(), distances.tolist()):
+            yield bs, bs_in_cell, distance
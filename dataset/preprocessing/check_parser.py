@@ -0,0 +1,70 @@
+"""
+Regression check of the fast chunk parser: on a raw chunk it compares the rows read by the fast path and the
+chunk grouped in hour/weekday buckets with the ones of the legacy parser (`fast=False`), that parses each
+timestamp with `datetime.fromtimestamp` in the timezone of the host, set here to the one of the dataset.
+All the fields are compared, not only the default metrics.
+
+    python -m dataset.preprocessing.check_parser data/milan/chunk_sample.txt
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+from dataset.preprocessing.dataframe import load_dataset_chunk, read_dataset_chunk, TIMEZONE
+from dataset.utils import ROOT_DIR
+
+
+def compare_dataframes(name: str, legacy: pd.DataFrame, fast: pd.DataFrame) -> bool:
+    try:
+        pd.testing.assert_frame_equal(legacy.reset_index(drop=True), fast.reset_index(drop=True), check_exact=True)
+    except AssertionError as e:
+        print(f'ERROR | The {name} of the fast parser are different from the legacy ones: {e}')
+        return False
+    print(f'INFO | The {len(fast)} {name} of the fast parser are identical to the legacy ones')
+    return True
+
+
+def check_fast_chunk_parser(file_path: str, sep: str = '\t', encoding='utf-8-sig') -> bool:
+    """
+    Compare the fast and the legacy parser on the chunk at `file_path`. The host timezone must be the one of the
+    dataset, as set by `main`
+    Returns
+    -------
+    bool
+        True if the rows and the buckets are identical
+    """
+    file_path = os.path.join(ROOT_DIR, file_path)
+    print(f'INFO | Checking the fast parser on {file_path}')
+    with warnings.catch_warnings():
+        # the date_parser argument of the legacy path is deprecated in pandas 2
+        warnings.simplefilter('ignore', FutureWarning)
+        legacy_rows = read_dataset_chunk(file_path, sep=sep, encoding=encoding, fast=False)
+        legacy_buckets = load_dataset_chunk(file_path, sep=sep, encoding=encoding, keep_all_columns=True, fast=False)
+    fast_rows = read_dataset_chunk(file_path, sep=sep, encoding=encoding, keep_all_columns=True)
+    # the legacy dates are naive local times
+    fast_rows['datetime'] = fast_rows['datetime'].dt.tz_localize(None)
+    fast_buckets = load_dataset_chunk(file_path, sep=sep, encoding=encoding, keep_all_columns=True)
+    same_rows = compare_dataframes('rows', legacy_rows, fast_rows)
+    same_buckets = compare_dataframes('buckets', legacy_buckets, fast_buckets)
+    return same_rows and same_buckets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the fast chunk parser reads the same rows and '
+                                                 'buckets of the legacy one')
+    parser.add_argument('input', nargs='*', default=['data/milan/chunk_sample.txt'],
+                        help='Paths of the raw chunks used for the check. Default: "data/milan/chunk_sample.txt"')
+    args = parser.parse_args()
+    # the legacy parser converts the timestamps in the timezone of the host
+    os.environ['TZ'] = TIMEZONE
+    time.tzset()
+    results = [check_fast_chunk_parser(path) for path in args.input]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,29 @@
+import functools
+import itertools
 import json
 import os.path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Iterable, Iterator, Tuple, Optional, Union, Set, Callable
 
+import numpy as np
 import pandas as pd
 
-from dataset.downloader.http_download import download_dataset_chunk
-from dataset.preprocessing.aggregate_bs_to_cell import aggregate_bs_single_chunk
-from dataset.preprocessing.dataframe import load_dataset_chunk
-from dataset.utils import ROOT_DIR, create_directory
+from dataset.downloader.http_download import download_metadata_chunk, download_dataset_chunks, \
+    stream_dataset_chunk, get_data_file_checksum, DownloadProgress
+from dataset.downloader.http_client import DownloadError, with_download_retries
+from dataset.metrics import stage, start_run, end_run, get_metrics_path
+from dataset.preprocessing.aggregate_bs_to_cell import aggregate_bs_single_chunk, compile_bs_lookup, BsLookup
+from dataset.preprocessing.cube import load_cell_ids, build_cell_lookup, chunk_to_cube, processed_chunk_to_cube, \
+    cube_to_dataframe, save_cube, get_cube_path, stack_cubes
+from dataset.preprocessing.dataframe import ChunkStreamAggregator, read_dataset_chunk, \
+    parse_metrics, DEFAULT_METRICS, group_dataset_chunk, finalize_dataset_chunk
+from dataset.preprocessing.rollups import parse_rollups, rollup, compute_rollups, save_rollups, \
+    RollupStreamAggregator
+from dataset.preprocessing.manifest import RunManifest, MANIFEST_FILENAME
+from dataset.preprocessing.merge_chunks import merge_aggregated_chunks
+from dataset.preprocessing.bs_dimension import build_bs_dimension, get_bs_dimension_path
+from dataset.preprocessing.storage import read_dataframe, write_dataframe, get_chunk_output_path, list_chunk_files
+from dataset.utils import ROOT_DIR, create_directory, create_directory_from_filepath, file_checksum
 
 
 def process_chunks(args):
@@ -19,8 +36,20 @@ def process_chunks(args):
     bs_aggregation_step = args.bs_aggregation_step
     aggregated_bs_file = args.aggregated_bs_file
     full_aggregation = args.full_aggregation
+    full_data_view = args.full_data_view
     skip_download = args.skip_download
-    aggregated_bs_file = os.path.join(ROOT_DIR, aggregated_bs_file)
+    download_workers = args.download_workers
+    stream = args.stream
+    workers = args.workers
+    output_format = args.format
+    engine = args.engine
+    grid_cells = args.grid_cells
+    incremental = args.incremental
+    metrics = parse_metrics(args.metrics)
+    rollups = parse_rollups(args.rollups) if args.rollups is not None else []
+    merge = args.merge
+    if aggregated_bs_file is not None:
+        aggregated_bs_file = os.path.join(ROOT_DIR, aggregated_bs_file)
     full_download_folder = os.path.join(ROOT_DIR, output_folder, 'full-chunks')
     full_out_folder = os.path.join(ROOT_DIR, output_folder, 'processed-chunks')
     aggregated_out_folder = os.path.join(ROOT_DIR, output_folder, 'aggregated-chunks')
@@ -32,7 +61,10 @@ def process_chunks(args):
     print(f'INFO | Chunks to skip: {chunks_to_skip} | '
           f'Chunks to download is: {chunks_to_process} | server_url: {server_url} | protocol: {protocol} '
           f'| bs_aggregation_step: {bs_aggregation_step} | aggregated_bs_file: {aggregated_bs_file} '
-          f'| full_aggregation: {full_aggregation} | skip download: {skip_download}')
+          f'| full_aggregation: {full_aggregation} | full data view: {full_data_view} | skip download: {skip_download} '
+          f'| download workers: {download_workers} | stream: {stream} | workers: {workers} '
+          f'| format: {output_format} | engine: {engine} | grid cells: {grid_cells} | incremental: {incremental} '
+          f'| metrics: {",".join(metrics)} | rollups: {",".join(rollups)} | merge: {merge}')
 
     # read the metadata
     with open(os.path.join(ROOT_DIR, metadata_path), 'r') as f:
@@ -42,46 +74,425 @@ def process_chunks(args):
     n = chunks_to_process if chunks_to_process != -1 else len(files)
     print(f'INFO | Found {len(files)} dataset chunks, going to load {n - chunks_to_skip} chunks')
 
+    cell_ids = None
+    if engine == 'numpy':
+        if grid_cells is None:
+            print('ERROR | The numpy engine requires the --grid-cells file')
+            return None
+        cell_ids = load_cell_ids(grid_cells)
+        print(f'INFO | Loaded {len(cell_ids)} grid cells for the numpy engine')
+
     aggregated_bs_df = None
+    aggregated_bs_checksum = None
+    bs_lookup = None
     if bs_aggregation_step:
-        aggregated_bs_df = pd.read_csv(aggregated_bs_file)
-
-    for i in range(chunks_to_skip, n):
-        # for each chunk of the dataset
-        file = files[i]
-        persistentId = file['dataFile']['persistentId']
-        filename = file['dataFile']['filename']
-        if not skip_download:
-            # download the chunk and temporary save if
-            file_path = download_dataset_chunk(server_url, persistentId, full_download_folder, filename,
-                                               protocol=protocol)
-            # load the chunk and do its preprocessing:
-            # filtering unnecessary fields and grouping the data by hour, weed day and cell id
-            chunk_df = load_dataset_chunk(file_path, keep_all_columns=False)
-            print(f'INFO | Processing file chunk {i+1}/{n}', end='\r')
-        filename_csv = filename
-        filename_csv = filename_csv.replace('.txt', '.csv').replace('sms-call-internet-mi', 'internet-mi')
+        aggregated_bs_df = read_dataframe(aggregated_bs_file)
+        aggregated_bs_checksum = file_checksum(aggregated_bs_file)
+        bs_lookup = compile_bs_lookup(aggregated_bs_df, full_aggregation or full_data_view)
+        if full_data_view:
+            if bs_lookup is None:
+                print('ERROR | The full-data view can not be produced without the BS lookup')
+                return None
+            # the BS columns are saved only once, the aggregated chunks reference them with their bs_key
+            dimension_path = get_bs_dimension_path(os.path.join(ROOT_DIR, output_folder),
+                                                   get_bs_types_from_file(aggregated_bs_file), output_format)
+            write_dataframe(build_bs_dimension(bs_lookup), dimension_path, output_format)
+
+    # the run is started after the checks of the arguments, and it is ended also when a stage fails
+    if not args.no_stats:
+        stats_file = args.stats_file if args.stats_file is not None else \
+            get_metrics_path(os.path.join(ROOT_DIR, output_folder), 'chunks-pipeline')
+        start_run(os.path.join(ROOT_DIR, stats_file), 'chunks-pipeline', vars(args))
+    try:
+        # plan the stages to execute: with the incremental option a stage is skipped
+        # when the manifest shows that it has been already executed with the same inputs and parameters
+        manifest = RunManifest(os.path.join(ROOT_DIR, output_folder, MANIFEST_FILENAME))
+        process_params = {'format': output_format, 'engine': engine, 'grid_cells': grid_cells, 'metrics': metrics,
+                          'rollups': rollups}
+        aggregate_params = {'format': output_format, 'full_aggregation': full_aggregation,
+                            'full_data_view': full_data_view}
+        to_process = []
+        aggregate_only = set()
+        for i in range(chunks_to_skip, n):
+            data_file = files[i]['dataFile']
+            processed_path, aggregated_path = get_chunk_paths(data_file['filename'], full_out_folder,
+                                                              aggregated_out_folder, output_format, metrics)
+            name = get_chunk_name(data_file['filename'], metrics)
+            process_needed = not skip_download and not (incremental and manifest.is_up_to_date(
+                name, 'process', get_data_file_checksum(data_file)[0], process_params))
+            if process_needed:
+                to_process.append(i)
+            elif bs_aggregation_step:
+                if not incremental or not manifest.is_up_to_date(
+                        name, 'aggregate', get_aggregate_input_checksum(processed_path, aggregated_bs_checksum),
+                        aggregate_params):
+                    aggregate_only.add(i)
+        if incremental:
+            print(f'INFO | Incremental run: {len(to_process)} chunks to process, '
+                  f'{len(aggregate_only)} chunks to aggregate only, '
+                  f'{n - chunks_to_skip - len(to_process) - len(aggregate_only)} chunks up to date')
+
+        def record_chunk(index: int, processed_path: str, aggregated_path: Optional[str]):
+            data_file = files[index]['dataFile']
+            name = get_chunk_name(data_file['filename'], metrics)
+            processed_checksum = file_checksum(processed_path)
+            if index not in aggregate_only and not skip_download:
+                manifest.record(name, 'process', get_data_file_checksum(data_file)[0], process_params,
+                                processed_path, output_checksum=processed_checksum)
+            if aggregated_path is not None:
+                manifest.record(name, 'aggregate', f'{processed_checksum}-{aggregated_bs_checksum}', aggregate_params,
+                                aggregated_path, output_checksum=file_checksum(aggregated_path))
+            manifest.save()
+
+        download_failed = []
+        chunks = itertools.chain(
+            iterate_chunks(files, to_process, server_url, full_download_folder, protocol,
+                           skip_download=skip_download, download_workers=download_workers, stream=stream,
+                           metrics=metrics, rollups=rollups, on_failed=lambda i, e: download_failed.append(i)),
+            [(i, files[i], None) for i in sorted(aggregate_only)]
+        )
+        chunk_kwargs = {
+            'processed_folder': full_out_folder,
+            'aggregated_folder': aggregated_out_folder,
+            'skip_download': skip_download,
+            'stream': stream,
+            'bs_aggregation_step': bs_aggregation_step,
+            'full_aggregation': full_aggregation,
+            'full_data_view': full_data_view,
+            'output_format': output_format,
+            'cell_ids': cell_ids,
+            'metrics': metrics,
+            'rollups': rollups,
+            'rollups_folder': os.path.join(ROOT_DIR, output_folder)
+        }
+        if workers > 1:
+            failed = process_chunks_in_pool(chunks, n, workers, aggregated_bs_df, chunk_kwargs,
+                                            aggregate_only=aggregate_only, on_processed=record_chunk,
+                                            bs_lookup=bs_lookup)
+        else:
+            failed = []
+            for i, file, chunk in chunks:
+                # for each chunk of the dataset
+                print(f'INFO | Processing file chunk {i+1}/{n}', end='\r')
+                kwargs = get_chunk_kwargs(chunk_kwargs, i in aggregate_only)
+                paths = process_chunk(chunk, file['dataFile']['filename'], aggregated_bs_df=aggregated_bs_df,
+                                      bs_lookup=bs_lookup, **kwargs)
+                record_chunk(i, *paths)
+                print(f'INFO |  Processed file chunk {i+1}/{n}')
+        if len(download_failed) > 0:
+            # the chunks not downloaded are not in the manifest, a new incremental run downloads only them
+            print(f'ERROR | {len(download_failed)} chunks not downloaded: '
+                  f'{", ".join([str(i + 1) for i in sorted(download_failed)])}')
+        if len(failed) > 0:
+            print(f'ERROR | {len(failed)} chunks failed: {", ".join([str(i + 1) for i in sorted(failed)])}')
+        # the partial files of the interrupted downloads are kept, to be resumed by the next run
+        if len(os.listdir(full_download_folder)) == 0:
+            os.rmdir(full_download_folder)
+        if engine == 'numpy':
+            for metric in metrics:
+                cube_paths = [get_cube_path(path, metric) for path in list_chunk_files(full_out_folder)
+                              if os.path.exists(get_cube_path(path, metric))]
+                if len(cube_paths) > 0:
+                    cube_path = os.path.join(ROOT_DIR, output_folder, get_cube_name(cube_paths[0]))
+                    with stage('stack-cubes', metric=metric) as stack_stage:
+                        stacked = stack_cubes(cube_paths, cube_path, cell_ids=cell_ids)
+                        stack_stage.add(rows=len(cube_paths), bytes_out=stacked.nbytes)
+                    print(f'INFO | Saved the {stacked.shape} (dates x cells x idx) {metric} cube in {cube_path}')
+        if bs_aggregation_step and merge is not None:
+            with stage('merge', reduction=merge) as merge_stage:
+                merged_paths = merge_aggregated_chunks(aggregated_out_folder, os.path.join(ROOT_DIR, output_folder),
+                                                       bs_types=get_bs_types_from_file(aggregated_bs_file),
+                                                       reduction=merge, workers=workers, output_format=output_format)
+                chunk_files = list_chunk_files(aggregated_out_folder)
+                merge_stage.add(bytes_in=sum([os.path.getsize(path) for path in chunk_files]),
+                                bytes_out=sum([os.path.getsize(path) for path in merged_paths]))
+        print(f'INFO | All the {n} chunks have been downloaded in {full_out_folder}')
+    finally:
+        end_run()
+
+
+def get_chunk_name(filename: str, metrics: Optional[List[str]] = None) -> str:
+    # sms-call-internet-mi-2013-11-01.txt -> internet-mi-2013-11-01 (<metrics>-<city>-<date>)
+    metrics = metrics if metrics is not None else DEFAULT_METRICS
+    parts = filename.replace('.txt', '').split('-')
+    return '-'.join(metrics + parts[-4:])
+
+
+def get_chunk_paths(
+        filename: str,
+        processed_folder: str,
+        aggregated_folder: str,
+        output_format: str = 'csv',
+        metrics: Optional[List[str]] = None
+) -> Tuple[str, str]:
+    name = get_chunk_name(filename, metrics)
+    name_aggregated = f'aggregated-{name}'
+    return (get_chunk_output_path(processed_folder, name, output_format),
+            get_chunk_output_path(aggregated_folder, name_aggregated, output_format))
+
+
+def get_bs_types_from_file(aggregated_bs_file: str) -> Optional[str]:
+    # cell_base_stations_aggregated-LTE-UMTS.csv -> LTE,UMTS
+    name = os.path.splitext(os.path.basename(aggregated_bs_file))[0]
+    if 'aggregated-' not in name:
+        return None
+    return ','.join(name.split('aggregated-', 1)[1].split('-'))
+
+
+def get_aggregate_input_checksum(processed_path: str, aggregated_bs_checksum: Optional[str]) -> Optional[str]:
+    if not os.path.exists(processed_path):
+        return None
+    return f'{file_checksum(processed_path)}-{aggregated_bs_checksum}'
+
+
+def get_chunk_kwargs(chunk_kwargs: dict, aggregate_only: bool) -> dict:
+    # chunks with an up to date processed file only need the aggregation step
+    return dict(chunk_kwargs, skip_download=True) if aggregate_only else chunk_kwargs
+
+
+def process_chunk(
+        chunk: Union[str, Tuple[pd.DataFrame, Optional[pd.DataFrame]], None],
+        filename: str,
+        processed_folder: str,
+        aggregated_folder: str,
+        aggregated_bs_df: Optional[pd.DataFrame] = None,
+        bs_lookup: Optional[BsLookup] = None,
+        skip_download: bool = False,
+        stream: bool = False,
+        bs_aggregation_step: bool = False,
+        full_aggregation: bool = False,
+        full_data_view: bool = False,
+        output_format: str = 'csv',
+        cell_ids: Optional[np.ndarray] = None,
+        metrics: Optional[List[str]] = None,
+        rollups: Optional[List[str]] = None,
+        rollups_folder: Optional[str] = None
+) -> Tuple[str, Optional[str]]:
+    """
+    Process a single chunk: it saves the processed chunk (unless the download is skipped) and,
+    if requested, the chunk aggregated by BS
+    Returns
+    -------
+    Tuple[str, Optional[str]]
+        the path of the processed chunk and the path of the aggregated chunk (None without the aggregation step)
+    """
+    processed_chunk_path, aggregated_chunk_path = get_chunk_paths(filename, processed_folder, aggregated_folder,
+                                                                  output_format, metrics)
+    if not skip_download:
+        name = get_chunk_name(filename, metrics)
+        raw_df = None
+        rollup_base_df = None
+        if stream:
+            # the chunk has been already parsed and grouped while downloading it
+            chunk, rollup_base_df = chunk
+        else:
+            # load the chunk, filtering unnecessary fields
+            with stage('parse', chunk=name) as parse_stage:
+                raw_df = read_dataset_chunk(chunk, metrics=metrics)
+                parse_stage.add(rows=len(raw_df), bytes_in=os.path.getsize(chunk))
+        if cell_ids is not None:
+            # numpy engine: the chunk is accumulated in a dense (cells x idx) cube saved next to the processed chunk
+            with stage('cube', chunk=name) as cube_stage:
+                cell_lookup = build_cell_lookup(cell_ids)
+                if stream:
+                    cubes, counts, dropped = processed_chunk_to_cube(chunk, cell_lookup, len(cell_ids), metrics)
+                else:
+                    cubes, counts, dropped = chunk_to_cube(raw_df, cell_lookup, len(cell_ids), metrics)
+                if dropped > 0:
+                    print(f'WARNING | {dropped} rows of {filename} belong to cells outside the grid, they are ignored')
+                chunk_df = cube_to_dataframe(cubes, counts, cell_ids)
+                create_directory_from_filepath(processed_chunk_path)
+                for metric, cube in cubes.items():
+                    save_cube(get_cube_path(processed_chunk_path, metric), cube)
+                cube_stage.add(rows=len(chunk) if stream else len(raw_df),
+                               bytes_out=sum([cube.nbytes for cube in cubes.values()]))
+        elif stream:
+            chunk_df = chunk
+        else:
+            # grouping the data by hour, week day and cell id
+            with stage('group', chunk=name) as group_stage:
+                chunk_df = finalize_dataset_chunk(group_dataset_chunk(raw_df), metrics=metrics)
+                group_stage.add(rows=len(raw_df))
         # save the processed dataframe
-        processed_chunk_path = os.path.join(full_out_folder, filename_csv)
-        if not skip_download:
-            chunk_df.to_csv(
-                path_or_buf=processed_chunk_path,
-                header=True,
-                index=False
-            )
-        # aggregate the base stations to the cells, if requested
-        if bs_aggregation_step:
-            filename_aggregated = filename_csv.replace('internet-mi', 'aggregated-internet-mi')
-            aggregated_chunk_path = os.path.join(aggregated_out_folder, filename_aggregated)
-            aggregate_bs_single_chunk(
-                chunk_path=processed_chunk_path,
-                aggregated_bs_df=aggregated_bs_df,
-                save_path=aggregated_chunk_path,
-                keep_all_columns=full_aggregation
-            )
-        # remove the chunk file
-        if not skip_download:
-            os.remove(file_path)
-        print(f'INFO |  Processed file chunk {i+1}/{n}')
-    os.rmdir(full_download_folder)
-    print(f'INFO | All the {n} chunks have been downloaded in {full_out_folder}')
+        with stage('write-processed', chunk=name) as write_stage:
+            write_dataframe(chunk_df, processed_chunk_path, output_format)
+            write_stage.add(rows=len(chunk_df), bytes_out=os.path.getsize(processed_chunk_path))
+        if rollups:
+            with stage('rollups', chunk=name) as rollups_stage:
+                # the finest level is computed once from the raw data, the others are cascaded from it
+                if rollup_base_df is None:
+                    rollup_base_df = rollup(raw_df, rollups[0], metrics)
+                save_rollups(compute_rollups(rollup_base_df, rollups, metrics), rollups_folder, name, output_format)
+                rollups_stage.add(rows=len(rollup_base_df))
+    # aggregate the base stations to the cells, if requested
+    if bs_aggregation_step:
+        aggregate_bs_single_chunk(
+            chunk_path=processed_chunk_path,
+            aggregated_bs_df=aggregated_bs_df,
+            save_path=aggregated_chunk_path,
+            keep_all_columns=full_aggregation,
+            bs_lookup=bs_lookup,
+            full_data_view=full_data_view
+        )
+    # remove the chunk file
+    if not skip_download and not stream:
+        os.remove(chunk)
+    return processed_chunk_path, aggregated_chunk_path if bs_aggregation_step else None
+
+
+def get_cube_name(chunk_cube_path: str) -> str:
+    # internet-mi-2013-11-01.npy -> internet-mi-cube.npy
+    name = os.path.basename(chunk_cube_path).replace('.npy', '')
+    return '-'.join(name.split('-')[:-3]) + '-cube.npy'
+
+
+# aggregated BS dataframe and its compiled lookup of the pool worker, they are set once when the worker starts
+_worker_aggregated_bs_df: Optional[pd.DataFrame] = None
+_worker_bs_lookup: Optional[BsLookup] = None
+
+
+def _init_chunk_worker(aggregated_bs_df: Optional[pd.DataFrame], bs_lookup: Optional[BsLookup] = None):
+    global _worker_aggregated_bs_df, _worker_bs_lookup
+    _worker_aggregated_bs_df = aggregated_bs_df
+    _worker_bs_lookup = bs_lookup
+
+
+def _process_chunk_in_worker(chunk, filename, chunk_kwargs) -> Tuple[str, Optional[str]]:
+    try:
+        return process_chunk(chunk, filename, aggregated_bs_df=_worker_aggregated_bs_df,
+                             bs_lookup=_worker_bs_lookup, **chunk_kwargs)
+    except Exception:
+        # the other chunks go on, the raw file of the failed one is removed as the processed ones
+        # (a path, not a dataframe as in stream mode or None when the download is skipped)
+        if isinstance(chunk, str) and os.path.exists(chunk):
+            os.remove(chunk)
+        raise
+
+
+def process_chunks_in_pool(
+        chunks: Iterator[Tuple[int, dict, Union[str, pd.DataFrame, None]]],
+        n: int,
+        workers: int,
+        aggregated_bs_df: Optional[pd.DataFrame],
+        chunk_kwargs: dict,
+        aggregate_only: Optional[Set[int]] = None,
+        on_processed: Optional[Callable[[int, str, Optional[str]], None]] = None,
+        bs_lookup: Optional[BsLookup] = None
+) -> List[int]:
+    """
+    Process the chunks using a pool of processes. The aggregated BS dataframe and its lookup are sent to each worker
+    only once, when the worker starts, and a failure in a chunk is reported without stopping the other chunks.
+    At most two chunks per worker are waiting to be processed, so the downloaded chunks do not pile up on disk.
+    `on_processed` is called in the main process with the chunk index and the paths returned by `process_chunk`
+    Returns
+    -------
+    List[int]
+        the indexes of the chunks that failed
+    """
+    failed = []
+    running = {}
+
+    def collect(futures):
+        for future in futures:
+            index = running.pop(future)
+            try:
+                paths = future.result()
+                if on_processed is not None:
+                    on_processed(index, *paths)
+                print(f'INFO |  Processed file chunk {index+1}/{n}')
+            except Exception as e:
+                print(f'ERROR | Error while processing file chunk {index+1}/{n}: {e!r}')
+                failed.append(index)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_chunk_worker,
+                             initargs=(aggregated_bs_df, bs_lookup)) as executor:
+        for i, file, chunk in chunks:
+            if len(running) >= workers * 2:
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                collect(done)
+            kwargs = get_chunk_kwargs(chunk_kwargs, aggregate_only is not None and i in aggregate_only)
+            future = executor.submit(_process_chunk_in_worker, chunk, file['dataFile']['filename'], kwargs)
+            running[future] = i
+        collect(list(wait(running.keys()).done))
+    return failed
+
+
+def iterate_chunks(
+        files: List[dict],
+        indexes: Iterable[int],
+        server_url: str,
+        download_folder: str,
+        protocol: str = 'https',
+        skip_download: bool = False,
+        download_workers: int = 1,
+        stream: bool = False,
+        metrics: Optional[List[str]] = None,
+        rollups: Optional[List[str]] = None,
+        on_failed: Optional[Callable[[int, DownloadError], None]] = None
+) -> Iterator[Tuple[int, dict, Union[str, pd.DataFrame, None]]]:
+    """
+    Iterate over the chunks to process, downloading them if required. With more than one download worker
+    the chunks are downloaded concurrently and yielded in the order they complete, otherwise they are
+    downloaded one after the other following the metadata order. The chunks whose download fails are not yielded,
+    they are passed to `on_failed` (without it the DownloadError is raised).
+    Returns
+    -------
+    Iterator[Tuple[int, dict, Union[str, pd.DataFrame, None]]]
+        for each chunk the index, the metadata file entry and the path of the downloaded file
+        (None if the download is skipped). In stream mode, the path is replaced by the processed chunk dataframe and
+        the dataframe of the finest rollup (None without rollups)
+    """
+    fetch = download_metadata_chunk
+    if stream:
+        fetch = functools.partial(stream_metadata_chunk, metrics=metrics, rollups=rollups)
+    if skip_download:
+        for i in indexes:
+            yield i, files[i], None
+    elif download_workers > 1:
+        yield from download_dataset_chunks(server_url, [(i, files[i]) for i in indexes], download_folder,
+                                           protocol=protocol, workers=download_workers, fetch=fetch,
+                                           on_failed=on_failed)
+    else:
+        for i in indexes:
+            file = files[i]
+            # download the chunk and temporary save if (or parse it on the fly in stream mode)
+            try:
+                chunk = fetch(server_url, file, download_folder, protocol=protocol)
+            except DownloadError as e:
+                print(f'\nERROR | Download of chunk {i + 1} failed: {e}')
+                if on_failed is None:
+                    raise
+                on_failed(i, e)
+                continue
+            yield i, file, chunk
+
+
+def stream_metadata_chunk(
+        server_url: str,
+        file: dict,
+        save_folder: Optional[str] = None,
+        protocol: str = 'https',
+        progress: Optional[DownloadProgress] = None,
+        metrics: Optional[List[str]] = None,
+        rollups: Optional[List[str]] = None
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    Download the chunk described by a metadata file entry feeding its content directly to a
+    `ChunkStreamAggregator` (or a `RollupStreamAggregator` with rollups), so the raw file never lands on disk. `save_folder` is ignored, it is accepted
+    only for having the same signature of `download_metadata_chunk`. A failed stream is attempted again from the
+    beginning, and it raises a DownloadError when all the attempts fail
+    """
+    data_file = file['dataFile']
+    checksum, checksum_type = get_data_file_checksum(data_file)
+
+    def stream_chunk():
+        # a new aggregator for each attempt, the stream cannot be resumed
+        if rollups:
+            aggregator = RollupStreamAggregator(rollups[0], metrics=metrics)
+        else:
+            aggregator = ChunkStreamAggregator(metrics=metrics)
+        stream_dataset_chunk(server_url, data_file['persistentId'], aggregator.feed, protocol=protocol,
+                             progress=progress, checksum=checksum, checksum_type=checksum_type)
+        return aggregator.result(), aggregator.rollup_result() if rollups else None
+
+    return with_download_retries(stream_chunk)
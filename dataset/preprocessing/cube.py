@@ -0,0 +1,182 @@
+import json
+import os
+from typing import List, Tuple, Optional, Dict
+
+import numpy as np
+import pandas as pd
+
+from dataset.preprocessing.dataframe import DEFAULT_METRICS
+from dataset.preprocessing.storage import read_dataframe, get_date_from_name
+from dataset.utils import ROOT_DIR, load_json_file
+
+# number of (hour, weekday) slots, the slot of a row is its `idx`: hour + weekday * 24
+N_SLOTS = 24 * 7
+
+
+def load_cell_ids(path: str) -> np.ndarray:
+    """
+    Load the sorted cell ids of a grid, from the grid geojson or from any csv/parquet file with a `cellId` column
+    (e.g. data/milan/mi-empty-grid.csv)
+    """
+    path = os.path.join(ROOT_DIR, path)
+    if path.endswith('.geojson') or path.endswith('.json'):
+        features = load_json_file(path)['features']
+        cell_ids = [feature['properties']['cellId'] for feature in features]
+    else:
+        cell_ids = read_dataframe(path, columns=['cellId'])['cellId']
+    return np.unique(np.asarray(cell_ids, dtype=np.int64))
+
+
+def build_cell_lookup(cell_ids: np.ndarray) -> np.ndarray:
+    """
+    Build the array mapping a cellId to its offset in the cube, cells not in the grid are mapped to -1
+    """
+    lookup = np.full(int(cell_ids.max()) + 1, -1, dtype=np.int64)
+    lookup[cell_ids] = np.arange(len(cell_ids), dtype=np.int64)
+    return lookup
+
+
+def get_cell_offsets(cell_lookup: np.ndarray, cell_ids: np.ndarray) -> np.ndarray:
+    offsets = np.full(len(cell_ids), -1, dtype=np.int64)
+    in_range = (cell_ids >= 0) & (cell_ids < len(cell_lookup))
+    offsets[in_range] = cell_lookup[cell_ids[in_range]]
+    return offsets
+
+
+def accumulate_cube(
+        cell_offsets: np.ndarray,
+        slots: np.ndarray,
+        values: np.ndarray,
+        n_cells: int,
+        cube: Optional[np.ndarray] = None,
+        counts: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the values into a (cells x slots) cube using `np.bincount` on the flat offsets.
+    Rows of cells outside the grid (offset -1) are ignored. If `cube` and `counts` are provided the values are
+    added to them, otherwise they are allocated
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        the cube of the sums and the cube with the number of rows of each (cell, slot)
+    """
+    valid = cell_offsets >= 0
+    flat = cell_offsets[valid] * N_SLOTS + slots[valid]
+    size = n_cells * N_SLOTS
+    sums = np.bincount(flat, weights=np.nan_to_num(values[valid]), minlength=size).reshape(n_cells, N_SLOTS)
+    rows = np.bincount(flat, minlength=size).reshape(n_cells, N_SLOTS)
+    if cube is None:
+        return sums, rows
+    cube += sums
+    counts += rows
+    return cube, counts
+
+
+def chunk_to_cube(
+        df: pd.DataFrame,
+        cell_lookup: np.ndarray,
+        n_cells: int,
+        metrics: Optional[List[str]] = None
+) -> Tuple[Dict[str, np.ndarray], np.ndarray, int]:
+    """
+    Aggregate a raw chunk (as returned by `read_dataset_chunk`) in a (cells x slots) cube for each metric
+    Returns
+    -------
+    Tuple[Dict[str, np.ndarray], np.ndarray, int]
+        the cube of the sums of each metric, the cube of the counts and the number of rows of cells outside the grid
+    """
+    dates = df['datetime'].dt
+    slots = (dates.hour.to_numpy(dtype=np.int64) + dates.weekday.to_numpy(dtype=np.int64) * 24)
+    return _dataframe_to_cube(df, slots, cell_lookup, n_cells, metrics)
+
+
+def processed_chunk_to_cube(
+        df: pd.DataFrame,
+        cell_lookup: np.ndarray,
+        n_cells: int,
+        metrics: Optional[List[str]] = None
+) -> Tuple[Dict[str, np.ndarray], np.ndarray, int]:
+    """
+    Same as `chunk_to_cube`, but starting from a chunk already grouped by (hour, weekday, cellId)
+    """
+    return _dataframe_to_cube(df, df['idx'].to_numpy(dtype=np.int64), cell_lookup, n_cells, metrics)
+
+
+def _dataframe_to_cube(
+        df: pd.DataFrame,
+        slots: np.ndarray,
+        cell_lookup: np.ndarray,
+        n_cells: int,
+        metrics: Optional[List[str]] = None
+) -> Tuple[Dict[str, np.ndarray], np.ndarray, int]:
+    metrics = metrics if metrics is not None else DEFAULT_METRICS
+    offsets = get_cell_offsets(cell_lookup, df['cellId'].to_numpy(dtype=np.int64))
+    cubes = {}
+    counts = None
+    for metric in metrics:
+        cubes[metric], counts = accumulate_cube(offsets, slots, df[metric].to_numpy(dtype=np.float64), n_cells)
+    return cubes, counts, int((offsets < 0).sum())
+
+
+def cube_to_dataframe(
+        cubes: Dict[str, np.ndarray],
+        counts: np.ndarray,
+        cell_ids: np.ndarray
+) -> pd.DataFrame:
+    """
+    Convert the (cells x slots) cubes of the metrics in the processed chunk layout
+    (hour, weekday, cellId, <metrics>, idx), keeping only the (cell, slot) with at least one row and sorting them
+    as `group_dataset_chunk` does
+    """
+    # slot axis ordered by hour and then weekday, as the groupby on (hour, weekday, cellId)
+    hours = np.repeat(np.arange(24), 7)
+    weekdays = np.tile(np.arange(7), 24)
+    slot_order = hours + weekdays * 24
+    present = counts[:, slot_order].T > 0
+    slot_index, cell_index = np.nonzero(present)
+    df = pd.DataFrame({
+        'hour': hours[slot_index].astype(np.int32),
+        'weekday': weekdays[slot_index].astype(np.int32),
+        'cellId': cell_ids[cell_index]
+    })
+    for metric, cube in cubes.items():
+        df[metric] = cube[cell_index, slot_order[slot_index]]
+    df['idx'] = df['hour'] + (df['weekday'] * 24)
+    return df
+
+
+def get_cube_path(chunk_path: str, metric: str = 'internet') -> str:
+    """
+    Path of the cube of a metric for a processed chunk: <chunk folder>/<metric>-<city>-<date>.npy
+    """
+    parts = os.path.basename(os.path.splitext(chunk_path)[0]).split('-')
+    return os.path.join(os.path.dirname(chunk_path), '-'.join([metric] + parts[-4:]) + '.npy')
+
+
+def save_cube(path: str, cube: np.ndarray):
+    np.save(path, cube)
+
+
+def load_cube(path: str, mmap_mode: Optional[str] = 'r') -> np.ndarray:
+    return np.load(os.path.join(ROOT_DIR, path), mmap_mode=mmap_mode)
+
+
+def stack_cubes(cube_paths: List[str], save_path: str, cell_ids: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Stack the cubes of the single chunks in a (dates x cells x slots) memory mapped cube.
+    The dates are saved next to it in `<save_path>-dates.json` and, if provided, the cell ids in
+    `<save_path>-cells.npy`
+    """
+    cube_paths = sorted(cube_paths, key=get_date_from_name)
+    first = load_cube(cube_paths[0])
+    stacked = np.lib.format.open_memmap(save_path, mode='w+', dtype=first.dtype,
+                                        shape=(len(cube_paths),) + first.shape)
+    for i, path in enumerate(cube_paths):
+        stacked[i] = load_cube(path)
+    stacked.flush()
+    base_path = save_path.replace('.npy', '')
+    with open(f'{base_path}-dates.json', 'w') as f:
+        json.dump([get_date_from_name(path) for path in cube_paths], f)
+    if cell_ids is not None:
+        np.save(f'{base_path}-cells.npy', cell_ids)
+    return stacked
@@ -0,0 +1,61 @@
+import json
+import os
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+class RunManifest:
+    """
+    Manifest of the chunks-pipeline runs. For each chunk and stage (`process`, `aggregate`) it records the checksum
+    of the stage input, the parameters used and the output path, so a re-run can execute only the stages
+    whose inputs or parameters changed.
+    The manifest is a json file saved in the pipeline output folder:
+
+        {"chunks": {"<chunk name>": {"<stage>": {"input_checksum": ..., "params": {...}, "output": ..., ...}}}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = {'chunks': {}}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.data = json.load(f)
+
+    def get(self, chunk: str, stage: str) -> Optional[Dict[str, Any]]:
+        return self.data['chunks'].get(chunk, {}).get(stage)
+
+    def is_up_to_date(self, chunk: str, stage: str, input_checksum: Optional[str], params: Dict[str, Any]) -> bool:
+        """
+        A stage is up to date if it has been executed with the same input and parameters and its output still exists
+        """
+        entry = self.get(chunk, stage)
+        if entry is None or input_checksum is None:
+            return False
+        return entry['input_checksum'] == input_checksum and entry['params'] == params \
+            and os.path.exists(entry['output'])
+
+    def record(
+            self,
+            chunk: str,
+            stage: str,
+            input_checksum: Optional[str],
+            params: Dict[str, Any],
+            output: str,
+            output_checksum: Optional[str] = None
+    ):
+        self.data['chunks'].setdefault(chunk, {})[stage] = {
+            'input_checksum': input_checksum,
+            'params': params,
+            'output': output,
+            'output_checksum': output_checksum,
+            'updated': datetime.now().isoformat(timespec='seconds')
+        }
+
+    def save(self):
+        # write and rename, so an interrupted run never leaves a truncated manifest
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,233 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from dataset.preprocessing.aggregate_bs_to_cell import BS_KEY
+from dataset.preprocessing.bs_dimension import find_bs_dimension, write_full_data_view, VIEW_EXTENSION
+from dataset.preprocessing.dataframe import METRICS, add_running_totals
+from dataset.preprocessing.storage import list_chunk_files, read_columns, iter_dataframe_blocks, write_dataframe, \
+    get_date_from_name
+from dataset.utils import ROOT_DIR, format_bytes, print_status
+
+MERGE_REDUCTIONS = ('sum', 'mean')
+MINIMAL_KEYS = ['hour', 'weekday', 'idx', 'aggregated_bs_id']
+FULL_KEYS = MINIMAL_KEYS + ['type', 'lng', 'lat', 'n_base_stations']
+# number of chunks (days) in which a key appears, used for the mean
+DAYS_COLUMN = 'n_days'
+DEFAULT_MEMORY_LIMIT = 512
+# rough size in memory of a parsed value, including the pandas parsing overhead
+VALUE_BYTES = 32
+
+
+def merge_chunks(args):
+    chunks_folder = os.path.join(ROOT_DIR, args.input)
+    output_folder = os.path.join(ROOT_DIR, args.output)
+    bs_types = args.bs_types
+    reduction = args.reduction
+    workers = args.workers
+    memory_limit = args.memory_limit
+    output_format = args.format
+    bs_dimension = os.path.join(ROOT_DIR, args.bs_dimension) if args.bs_dimension is not None else None
+    print(f'INFO | Merging the aggregated chunks in {chunks_folder} | output folder: {output_folder} '
+          f'| bs types: {bs_types} | reduction: {reduction} | workers: {workers} '
+          f'| memory limit: {memory_limit} MB | format: {output_format}')
+    merge_aggregated_chunks(chunks_folder, output_folder, bs_types=bs_types, reduction=reduction, workers=workers,
+                            memory_limit=memory_limit, output_format=output_format, bs_dimension=bs_dimension)
+
+
+def merge_aggregated_chunks(
+        chunks_folder: str,
+        output_folder: str,
+        bs_types: Optional[str] = None,
+        reduction: str = 'sum',
+        workers: int = 1,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT,
+        output_format: str = 'csv',
+        bs_dimension: Optional[str] = None
+) -> List[str]:
+    """
+    Reduce the aggregated chunks (aggregated-<metrics>-<city>-<date>) in a single row for each
+    (hour, weekday, aggregated BS), saving `aggregated-<metrics>-<city>-minimal-data-<BS_TYPES>` and, if the chunks
+    have been aggregated with all the BS columns, `aggregated-<metrics>-<city>-full-data-<BS_TYPES>`.
+    Chunks aggregated for the full-data view (with the `BS_KEY` column) produce the full-data view instead:
+    the `-full-data-<BS_TYPES>.view.json` descriptor, its facts file and the `bs_dimension` table.
+    The chunks are read in blocks and reduced one at a time in running totals, so the memory used grows with
+    the number of keys and not with the number of rows. With more workers each process reduces a group of chunks
+    and the partial totals are then combined in a tree
+    Parameters
+    ----------
+    chunks_folder: str
+        folder of the aggregated chunks, csv or parquet
+    output_folder: str
+        folder where the merged files are saved
+    bs_types: Optional[str]
+        comma separated list of the BS types, used as suffix of the file names
+    reduction: str
+        `sum` of the values of all the chunks or `mean` over the number of chunks (days) in which each key appears
+    workers: int
+        number of processes used
+    memory_limit: int
+        memory, in MB, for the blocks read by each process
+    output_format: str
+        one of `OUTPUT_FORMATS`
+    bs_dimension: Optional[str]
+        BS dimension of the full-data view, by default the one of `bs_types` in the parent folder of `chunks_folder`
+    Returns
+    -------
+    List[str]
+        the paths of the merged files
+    """
+    if reduction not in MERGE_REDUCTIONS:
+        raise ValueError(f'Invalid reduction "{reduction}", available reductions are: {", ".join(MERGE_REDUCTIONS)}')
+    paths = []
+    for prefix, files in group_chunk_files(list_chunk_files(chunks_folder)).items():
+        columns = read_columns(files[0])
+        metrics = [col for col in columns if col in METRICS]
+        key_sets = {'minimal-data': MINIMAL_KEYS}
+        if all([col in columns for col in FULL_KEYS]):
+            key_sets['full-data'] = FULL_KEYS
+        elif BS_KEY in columns:
+            key_sets['full-data'] = MINIMAL_KEYS + [BS_KEY]
+        else:
+            print(f'INFO | The {prefix} chunks do not have the BS columns, only the minimal-data file is produced')
+        block_rows = get_block_rows(memory_limit // max(workers, 1), len(columns))
+        if workers > 1 and len(files) > 1:
+            totals = reduce_chunk_files_in_pool(files, key_sets, metrics, block_rows, workers)
+        else:
+            totals = reduce_chunk_files(files, key_sets, metrics, block_rows, show_status=True)
+        for name, df in totals.items():
+            size = df.memory_usage(deep=True).sum()
+            if size > memory_limit * 1024 * 1024:
+                print(f'WARNING | The {name} keys of {prefix} take {format_bytes(size)}, more than the memory limit')
+            path = get_merged_path(output_folder, prefix, name, bs_types, reduction, output_format)
+            if BS_KEY in key_sets[name]:
+                dimension_path = bs_dimension if bs_dimension is not None \
+                    else find_bs_dimension(os.path.dirname(os.path.normpath(chunks_folder)), bs_types)
+                if dimension_path is None:
+                    print(f'ERROR | BS dimension not found, the {name} view of {prefix} is not saved')
+                    continue
+                path = path.replace(f'.{output_format}', VIEW_EXTENSION)
+                write_full_data_view(finalize_merged_totals(df, reduction), path, dimension_path, output_format)
+            else:
+                write_dataframe(finalize_merged_totals(df, reduction), path, output_format)
+            print(f'INFO | Merged {len(files)} chunks of {prefix} in {len(df)} rows saved in {path}')
+            paths.append(path)
+    return paths
+
+
+def group_chunk_files(files: List[str]) -> Dict[str, List[str]]:
+    """
+    Group the chunk files by their name without the date (e.g. aggregated-internet-mi)
+    """
+    groups = {}
+    for path in files:
+        name = os.path.basename(path).replace('.csv', '').replace('.parquet', '')
+        prefix = name.replace(f'-{get_date_from_name(name)}', '')
+        groups.setdefault(prefix, []).append(path)
+    return groups
+
+
+def get_merged_path(
+        output_folder: str,
+        prefix: str,
+        name: str,
+        bs_types: Optional[str] = None,
+        reduction: str = 'sum',
+        output_format: str = 'csv'
+) -> str:
+    # aggregated-internet-mi + minimal-data -> aggregated-internet-mi-minimal-data-LTE(-mean).csv
+    parts = [prefix, name]
+    if bs_types is not None:
+        parts += bs_types.split(',')
+    if reduction != 'sum':
+        parts.append(reduction)
+    return os.path.join(output_folder, f'{"-".join(parts)}.{output_format}')
+
+
+def get_block_rows(memory_limit: int, n_columns: int) -> int:
+    return max(1024, memory_limit * 1024 * 1024 // (max(n_columns, 1) * VALUE_BYTES))
+
+
+def reduce_chunk_file(
+        path: str,
+        key_sets: Dict[str, List[str]],
+        metrics: List[str],
+        block_rows: int
+) -> Dict[str, pd.DataFrame]:
+    """
+    Sum the metrics of a chunk file for each set of keys, reading it in blocks of `block_rows` rows.
+    Each key of the result has `DAYS_COLUMN` set to 1
+    """
+    columns = list(dict.fromkeys([col for keys in key_sets.values() for col in keys] + metrics))
+    totals = {name: None for name in key_sets}
+    for block in iter_dataframe_blocks(path, block_rows, columns=columns):
+        # categories of different files can not be aligned, the BS type is reduced as a string
+        if 'type' in block.columns:
+            block['type'] = block['type'].astype(str)
+        for name, keys in key_sets.items():
+            grouped = block.groupby(keys)[metrics].sum()
+            totals[name] = add_running_totals(totals[name], grouped)
+    for name, keys in key_sets.items():
+        if totals[name] is None:
+            totals[name] = pd.DataFrame(columns=keys + metrics).set_index(keys)
+        totals[name][DAYS_COLUMN] = 1
+    return totals
+
+
+def reduce_chunk_files(
+        files: List[str],
+        key_sets: Dict[str, List[str]],
+        metrics: List[str],
+        block_rows: int,
+        show_status: bool = False
+) -> Dict[str, pd.DataFrame]:
+    totals = {name: None for name in key_sets}
+    for i, path in enumerate(files):
+        totals = combine_totals(totals, reduce_chunk_file(path, key_sets, metrics, block_rows))
+        if show_status:
+            print_status(i + 1, len(files), 'Merged chunks', loading_len=40)
+    if show_status:
+        print()
+    return totals
+
+
+def combine_totals(
+        totals: Dict[str, Optional[pd.DataFrame]],
+        other: Dict[str, Optional[pd.DataFrame]]
+) -> Dict[str, pd.DataFrame]:
+    return {name: add_running_totals(totals[name], other[name]) if other[name] is not None else totals[name]
+            for name in totals}
+
+
+def reduce_chunk_files_in_pool(
+        files: List[str],
+        key_sets: Dict[str, List[str]],
+        metrics: List[str],
+        block_rows: int,
+        workers: int
+) -> Dict[str, pd.DataFrame]:
+    """
+    Tree reduction: each process reduces a contiguous group of chunks and the partial totals are combined in pairs,
+    always in the same order, so the result does not depend on which process finishes first
+    """
+    groups = [group.tolist() for group in np.array_split(np.array(files, dtype=object), min(workers, len(files)))]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = list(executor.map(reduce_chunk_files, groups, [key_sets] * len(groups),
+                                     [metrics] * len(groups), [block_rows] * len(groups)))
+    while len(partials) > 1:
+        combined = [combine_totals(partials[i], partials[i + 1]) for i in range(0, len(partials) - 1, 2)]
+        if len(partials) % 2 == 1:
+            combined.append(partials[-1])
+        partials = combined
+    return partials[0]
+
+
+def finalize_merged_totals(totals: pd.DataFrame, reduction: str = 'sum') -> pd.DataFrame:
+    totals = totals.sort_index()
+    days = totals.pop(DAYS_COLUMN)
+    if reduction == 'mean':
+        totals = totals.div(days, axis=0)
+    return totals.reset_index()
@@ -0,0 +1,104 @@
+import os
+from typing import List, Dict, Optional
+
+import pandas as pd
+
+from dataset.preprocessing.dataframe import TIMEZONE, DEFAULT_METRICS, ChunkStreamAggregator, add_running_totals
+from dataset.preprocessing.storage import get_chunk_output_path, write_dataframe
+
+# time granularities available, from the finest (the native resolution of the dataset) to the coarsest.
+# Each level is a multiple of the previous one, so it can be derived from it
+ROLLUP_LEVELS = ['10min', '30min', 'hour', 'day']
+ROLLUP_FREQUENCIES = {
+    '10min': '10min',
+    '30min': '30min',
+    'hour': 'h',
+    'day': 'D'
+}
+ROLLUPS_FOLDER = 'rollups'
+
+
+def parse_rollups(rollups: str) -> List[str]:
+    """
+    Parse a comma separated list of rollup levels (e.g. "10min,hour"), returning them from the finest
+    to the coarsest. It raises a ValueError for unknown levels
+    """
+    parsed = [level.strip() for level in rollups.split(',') if len(level.strip()) > 0]
+    unknown = [level for level in parsed if level not in ROLLUP_LEVELS]
+    if len(unknown) > 0:
+        raise ValueError(f'Invalid rollups "{rollups}", available levels are: {", ".join(ROLLUP_LEVELS)}')
+    return [level for level in ROLLUP_LEVELS if level in parsed]
+
+
+def floor_datetime(dates: pd.Series, level: str) -> pd.Series:
+    """
+    Floor the Europe/Rome datetimes to the start of their time slot. Days start at local midnight,
+    the other levels are floored in UTC, so they are never ambiguous across daylight saving changes
+    """
+    if level == 'day':
+        return dates.dt.tz_localize(None).dt.floor(ROLLUP_FREQUENCIES[level]).dt.tz_localize(TIMEZONE)
+    return dates.dt.tz_convert('UTC').dt.floor(ROLLUP_FREQUENCIES[level]).dt.tz_convert(TIMEZONE)
+
+
+def rollup(df: pd.DataFrame, level: str, metrics: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Sum the metrics of a dataframe with `datetime` and `cellId` columns over the time slots of `level`.
+    It works both on raw chunks (as returned by `read_dataset_chunk`) and on finer rollups
+    Returns
+    -------
+    pd.DataFrame
+        dataframe with columns datetime, cellId, <metrics>, sorted by datetime and cellId
+    """
+    metrics = metrics if metrics is not None else DEFAULT_METRICS
+    grouped = df[['cellId'] + metrics].assign(datetime=floor_datetime(df['datetime'], level))
+    return grouped.groupby(['datetime', 'cellId'], as_index=False)[metrics].sum()
+
+
+def compute_rollups(base_df: pd.DataFrame, levels: List[str], metrics: Optional[List[str]] = None
+                    ) -> Dict[str, pd.DataFrame]:
+    """
+    Cascade the rollups: `base_df` must be already at the finest level requested (levels[0]),
+    each following level is derived from the previous one and not from the raw data
+    """
+    rollups = {levels[0]: base_df}
+    for previous, level in zip(levels[:-1], levels[1:]):
+        rollups[level] = rollup(rollups[previous], level, metrics)
+    return rollups
+
+
+def save_rollups(rollups: Dict[str, pd.DataFrame], output_folder: str, name: str, output_format: str = 'csv'
+                 ) -> List[str]:
+    """
+    Save each rollup level in its own folder: <output_folder>/rollups/<level>/<name>.<format>
+    """
+    paths = []
+    for level, df in rollups.items():
+        path = get_chunk_output_path(os.path.join(output_folder, ROLLUPS_FOLDER, level), name, output_format)
+        write_dataframe(df, path, output_format)
+        paths.append(path)
+    return paths
+
+
+class RollupStreamAggregator(ChunkStreamAggregator):
+    """
+    `ChunkStreamAggregator` that, in the same pass, keeps also the running sums at the finest rollup level
+    """
+
+    def __init__(self, rollup_level: str, **kwargs):
+        super().__init__(**kwargs)
+        self.rollup_level = rollup_level
+        self._rollup_totals: Optional[pd.DataFrame] = None
+
+    def rollup_result(self) -> pd.DataFrame:
+        """
+        The base rollup of the chunk, it must be called after `result`, which parses the last block
+        """
+        metrics = self.metrics if self.metrics is not None else DEFAULT_METRICS
+        if self._rollup_totals is None:
+            return pd.DataFrame(columns=['datetime', 'cellId'] + metrics)
+        return self._rollup_totals.sort_index().reset_index()
+
+    def _reduce_block(self, df: pd.DataFrame):
+        super()._reduce_block(df)
+        grouped = rollup(df, self.rollup_level, self.metrics).set_index(['datetime', 'cellId'])
+        self._rollup_totals = add_running_totals(self._rollup_totals, grouped)
@@ -0,0 +1,99 @@
+import os
+from glob import glob
+from typing import List, Optional, Iterator
+
+import pandas as pd
+
+from dataset.utils import create_directory_from_filepath
+
+OUTPUT_FORMATS = ('csv', 'parquet')
+PARQUET_COMPRESSION = 'zstd'
+# compact dtypes used for the columnar files, the values always fit in them
+PARQUET_DTYPES = {
+    'hour': 'int8',
+    'weekday': 'int8',
+    'idx': 'int16',
+    'cellId': 'int32',
+    'aggregated_bs_id': 'int32',
+    'n_base_stations': 'int16',
+    'type': 'category'
+}
+
+
+def get_file_format(path: str) -> str:
+    return 'parquet' if path.endswith('.parquet') else 'csv'
+
+
+def get_chunk_output_path(folder: str, name: str, output_format: str = 'csv') -> str:
+    """
+    Path of a file produced for a single dataset chunk. CSV files are saved directly in the folder,
+    while parquet files are partitioned by the chunk date (`<folder>/date=<date>/<name>.parquet`),
+    so the folder can be read as a single dataset
+    Parameters
+    ----------
+    folder: str
+        output folder
+    name: str
+        name of the file without extension, it must end with the chunk date (e.g. internet-mi-2013-11-01)
+    output_format: str
+        one of `OUTPUT_FORMATS`
+    """
+    if output_format == 'parquet':
+        return os.path.join(folder, f'date={get_date_from_name(name)}', f'{name}.parquet')
+    return os.path.join(folder, f'{name}.csv')
+
+
+def get_date_from_name(name: str) -> str:
+    name = os.path.basename(name)
+    for extension in ['.csv', '.parquet', '.txt']:
+        name = name.replace(extension, '')
+    return '-'.join(name.split('-')[-3:])
+
+
+def list_chunk_files(folder: str) -> List[str]:
+    """
+    List the chunk files in a folder, both csv and parquet (also partitioned by date)
+    """
+    files = glob(os.path.join(folder, '*.csv'))
+    files += glob(os.path.join(folder, '*.parquet'))
+    files += glob(os.path.join(folder, 'date=*', '*.parquet'))
+    return sorted(files, key=lambda path: (get_date_from_name(path), path))
+
+
+def read_dataframe(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    if get_file_format(path) == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
+
+
+def read_columns(path: str) -> List[str]:
+    """
+    Names of the columns of a csv or parquet file, without reading its rows
+    """
+    if get_file_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def iter_dataframe_blocks(path: str, block_rows: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Read a csv or parquet file in blocks of at most `block_rows` rows
+    """
+    if get_file_format(path) == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=block_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        for block in pd.read_csv(path, usecols=columns, chunksize=block_rows):
+            yield block
+
+
+def write_dataframe(df: pd.DataFrame, path: str, output_format: Optional[str] = None):
+    output_format = output_format if output_format is not None else get_file_format(path)
+    create_directory_from_filepath(path)
+    if output_format == 'parquet':
+        dtypes = {col: dtype for col, dtype in PARQUET_DTYPES.items() if col in df.columns}
+        df.astype(dtypes).to_parquet(path, index=False, compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(path_or_buf=path, header=True, index=False)
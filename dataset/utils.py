@@ -1,6 +1,9 @@
+import hashlib
 import json
 import math
 import os
+import time
+from typing import Iterator
 
 
 def format_bytes(size_bytes):
@@ -50,15 +53,132 @@ def create_directory_from_filepath(filepath):
     return path
 
 
+# minimum seconds between two progress lines
+PROGRESS_INTERVAL = 0.5
+_last_progress_time = 0.0
+
+
+def print_progress(message: str, force: bool = False):
+    """
+    Print a progress line, overwritten by the next one, at most once every PROGRESS_INTERVAL seconds unless `force`
+    """
+    global _last_progress_time
+    now = time.monotonic()
+    if not force and now - _last_progress_time < PROGRESS_INTERVAL:
+        return
+    _last_progress_time = now
+    print(message, end='\r')
+
+
 def print_status(current, total, pre_message='', loading_len=20, unit='', current_formatted=None, total_formatted=None):
+    # the last status (current equal to total) is always printed
+    if current < total and time.monotonic() - _last_progress_time < PROGRESS_INTERVAL:
+        return
     current_str = current_formatted if current_formatted is not None else f'{current}{unit}'
     total_str = total_formatted if total_formatted is not None else f'{total}{unit}'
 
     perc = int((current * loading_len) / total)
     message = f'{pre_message}:\t{"#" * perc}{"." * (loading_len - perc)}\t{current_str}/{total_str}'
-    print(message, end='\r')
+    print_progress(message, force=True)
 
 
 def load_json_file(path):
     with open(path, 'r') as f:
         return json.load(f)
+
+
+def iter_geojson_features(path: str, block_size: int = 1024 * 1024) -> Iterator[dict]:
+    """
+    Iterate the features of a geojson FeatureCollection parsing them one by one, the file is read by blocks so the
+    memory used depends on the size of a feature and not on the size of the file
+    Parameters
+    ----------
+    path: str
+        geojson path
+    block_size: int
+        number of characters read at a time
+    Returns
+    -------
+    Iterator[dict]
+        the features, in the order of the file
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buffer = ''
+        position = 0
+        eof = False
+
+        def read_more() -> bool:
+            nonlocal buffer, position, eof
+            block = f.read(block_size)
+            if block == '':
+                eof = True
+                return False
+            # the parsed part of the buffer is dropped
+            buffer = buffer[position:] + block
+            position = 0
+            return True
+
+        # move to the beginning of the features array
+        while True:
+            start = buffer.find('"features"', position)
+            if start != -1:
+                array_start = buffer.find('[', start)
+                if array_start != -1:
+                    position = array_start + 1
+                    break
+            else:
+                # keep the tail, the key can be split between two blocks
+                position = max(0, len(buffer) - len('"features"'))
+            if not read_more():
+                raise ValueError(f'No features array found in {path}')
+        while True:
+            # skip the separators between the features
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                if not read_more():
+                    raise ValueError(f'Unexpected end of file in the features array of {path}')
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                feature, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the feature continues in the next block
+                if not read_more():
+                    raise
+                continue
+            position = end
+            yield feature
+
+
+def new_hasher(algorithm: str = 'MD5'):
+    """
+    Create a hashlib object from an algorithm name as reported in the dataset metadata (e.g. MD5, SHA-1)
+    """
+    return hashlib.new(algorithm.lower().replace('-', ''))
+
+
+def update_hasher_from_file(hasher, path: str, block_size: int = 1024 * 1024):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher
+
+
+def file_checksum(path: str, algorithm: str = 'MD5') -> str:
+    """
+    Compute the checksum of a file reading it by blocks
+    Parameters
+    ----------
+    path: str
+        file path
+    algorithm: str
+        name of the hash algorithm, as reported in the dataset metadata
+    Returns
+    -------
+    str
+        the hex digest of the file
+    """
+    return update_hasher_from_file(new_hasher(algorithm), path).hexdigest()